@@ -8,7 +8,22 @@ def run_server(host, port, cortex_database):
     server = rest_api.get_api('cortex.api', cortex_database, json.dumps)
     server.run(host,  int(port))
 
-def run_api_server(host, port, database_url, threaded=False, daemon=True):
+def _get_database(database_url):
+    db = databases.repository.get_database(database_url)
+    if not db:
+        raise Exception(f"could not get database implementation for url {database_url}")
+    return db
+
+def run_prefork_api_server(host, port, database_url, **prefork_options):
+    """
+    runs the api server in pre-forked gunicorn workers. every worker connects to the database after the fork.
+    :param prefork_options: workers, backlog, timeout, graceful_timeout (see `cortex.utils.prefork`)
+    """
+    from cortex.utils import prefork
+    prefork.serve(lambda: rest_api.get_api('cortex.api', _get_database(database_url), json.dumps),
+                  host, port, **prefork_options)
+
+def run_api_server(host, port, database_url, threaded=False, daemon=True, prefork=False, **prefork_options):
     """
     runs the api server bound on the given host addr, port and connected to the given database.
     if threaded is True, starts the server on a different thread
@@ -17,13 +32,17 @@ def run_api_server(host, port, database_url, threaded=False, daemon=True):
     :param port: port to bind on
     :param database_url: the database url to connect to.
     :param threaded: whether or not to run the server on a different thread.
+    :param prefork: run in pre-forked worker processes instead of the Flask server. can't be threaded
+    :param prefork_options: passed to the pre-fork server
     :return: the created thread object if True, None otherwise.
     """
-    db = databases.repository.get_database(database_url)
-    if not db:
-        raise Exception(f"could not get database implementation for url {database_url}")
     if not host in ['0.0.0.0', '127.0.0.1']:
         raise ValueError(f"""host {host} invalid, please choose {" or ".join(["0.0.0.0", "127.0.0.1"])}""")
+    if prefork:
+        if threaded:
+            raise ValueError("the prefork server manages its own processes, it can't run on a thread")
+        return run_prefork_api_server(host, port, database_url, **prefork_options)
+    db = _get_database(database_url)
     args = (host, port, db)
     if not threaded:
         run_server(*args)
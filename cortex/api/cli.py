@@ -14,7 +14,12 @@ def cli():
 @click.option('-h', '--host', default='0.0.0.0')
 @click.option('-p', '--port', default=5000, type=int)
 @click.option('-d', '--database', default='mongodb://localhost:27017', type=str)
-def run_server(host, port, database):
+@click.option('--prefork', is_flag=True, help="serve from several worker processes")
+@click.option('-w', '--workers', type=int, help="worker processes with --prefork")
+@click.option('--backlog', type=int, help="listen backlog with --prefork")
+@click.option('--timeout', type=int, help="seconds before a stuck worker is restarted with --prefork")
+def run_server(host, port, database, prefork, workers, backlog, timeout):
     with log_exception(logger, to_suppress=(ValueError, Exception)):
-        run_api_server(host=host, port=port, database_url=database)
+        run_api_server(host=host, port=port, database_url=database, prefork=prefork,
+                       workers=workers, backlog=backlog, timeout=timeout)
 
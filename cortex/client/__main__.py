@@ -1,5 +1,6 @@
 import click
-from . import upload_sample
+from . import upload_sample, client as _client, sample_reader, sample_index
+from cortex.utils import filesystem
 
 @click.group()
 def client():
@@ -9,13 +10,44 @@ def client():
 @client.command('upload-sample')
 @click.option('-h', '--host', default="127.0.0.1", help="server ip/name, defaults to localhost")
 @click.option('-p', '--port', default="8000", help="server port, defaults to 8000")
+@click.option('-b', '--batch-size', type=int, default=None,
+              help="snapshots per upload request, defaults to the configured batch size")
+@click.option('-c', '--concurrency', type=int, default=None,
+              help="upload requests in flight at once, defaults to the configured concurrency")
+@click.option('-r', '--retries', type=int, default=None, help="retries per failed upload request")
+@click.option('-w', '--workers', type=int, default=None,
+              help="processes that parse and send snapshots while this one reads the sample")
 @click.argument('sample_path')
-def upload_cli(host, port, sample_path):
+def upload_cli(host, port, sample_path, batch_size, concurrency, retries, workers):
     """
     uploads the thoughts in the sample file to the server
     """
-    return upload_sample(host, port, sample_path)
+    return upload_sample(host, port, sample_path, batch_size=batch_size, concurrency=concurrency, retries=retries,
+                         workers=workers)
 
 
+@client.command('measure-read')
+@click.option('-n', '--limit', type=int, default=None, help="read at most this many snapshots")
+@click.argument('sample_path')
+def measure_read_cli(sample_path, limit):
+    """
+    measures how many snapshots per second are read from the sample file, through a plain file stream and through
+    the stream upload-sample uses (memory mapped or large-buffered)
+    """
+    openers = {'plain': lambda path: filesystem.open_file(path, 'rb'), 'open_sample': sample_reader.open_sample}
+    for name, opener in openers.items():
+        count, elapsed = _client.measure_read(sample_path, opener, limit)
+        click.echo(f"{name}: {count} snapshots in {elapsed:.2f}s, {count / elapsed:.1f} snapshots/s")
+
+
+@client.command('index-sample')
+@click.argument('sample_path')
+def index_sample_cli(sample_path):
+    """
+    builds (or refreshes) the index sidecar file of the sample file
+    """
+    index = sample_index.SampleIndex.for_sample(sample_path)
+    click.echo(f"indexed {len(index)} snapshots into {sample_index.SampleIndex.sidecar_path(sample_path)}")
+
 
 client()
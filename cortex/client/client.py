@@ -1,41 +1,103 @@
 import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
+import requests.adapters
 import urlpath
-from funcy import once_per
+from funcy import once_per, chunks, ilen, take
 from google.protobuf.json_format import MessageToDict
 
 from . import sample_reader, protobuf_parser
-from cortex.core import cortex_pb2
-from cortex import configuration
-from cortex.utils import filesystem
+from cortex.core import cortex_pb2, snapshot_bundle
+from cortex import configuration, Thought
+from cortex.utils import logging, compression
+
+module_logger = logging.get_module_logger(__file__)
 
 class ClientHTTPSession:
     """
     Implements an HTTPSession with a Cortex host.
     The session is meant to work with a snapshots from a single user.
+    While the session is open (see `open`, or use it as a context manager), all requests go through a pool of
+    keep-alive connections to the host, instead of connecting anew for every request.
     """
     SCHEME = 'http'
+    BATCH_UNSUPPORTED = (404, 405)  # a server without the batch endpoint answers these
     @classmethod
     def start(cls, host, port):
         url = urlpath.URL().with_scheme(cls.SCHEME).with_hostinfo(host, port)
         out = cls(url)
-        out.get_config()
+        out.open()
+        try:
+            out.get_config()
+        except BaseException:
+            out.close()
+            raise
         return out
 
     def __init__(self, url, server_config=None):
         self._server_config = server_config
         self.url = urlpath.URL(url)
+        self._transport = None
+        self._batch_supported = True
 
     def __enter__(self):
-        return self
+        return self.open()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
+        self.close()
+
+    def open(self):
+        """
+        opens the pooled transport, if it isn't open already.
+        the pool blocks when all of its connections are taken, so concurrent senders wait for a connection
+        instead of opening throwaway ones.
+        :return: self
+        """
+        if self._transport is None:
+            config = configuration.get_config()
+            self._transport = requests.Session()
+            self._transport.mount(f'{self.SCHEME}://',
+                                  requests.adapters.HTTPAdapter(pool_connections=1,
+                                                                pool_maxsize=config[configuration.CONFIG_CLIENT_POOL_SIZE],
+                                                                pool_block=True))
+        return self
+
+    def close(self):
+        """ closes the pooled transport and all of its connections """
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self._batch_supported = True
+
+    @property
+    def transport(self):
+        """ the pooled transport if the session is open, otherwise a connection is made per request """
+        return self._transport or requests
+
+    @property
+    def server_config(self):
+        return self._server_config
+
+    @property
+    def content_encoding(self):
+        """ the codec snapshots are compressed with: the best one both sides support, None to send them as they are """
+        offered = (self._server_config or {}).get(configuration.CLIENT_CONFIG_CONTENT_ENCODINGS, ())
+        return compression.negotiate(offered,
+                                     configuration.get_config()[configuration.CONFIG_CLIENT_CONTENT_ENCODINGS])
+
+    @property
+    def timeout(self):
+        config = configuration.get_config()
+        return config[configuration.CONFIG_CLIENT_CONNECT_TIMEOUT], config[configuration.CONFIG_CLIENT_READ_TIMEOUT]
 
     def get_config(self):
         """ retrieves configuration from the server, if necessary"""
         config_url = self.url / configuration.get_config()[configuration.CONFIG_SERVER_CONFIG_ENDPOINT]
-        resp = config_url.get()
+        resp = self.transport.get(str(config_url), timeout=self.timeout)
         if not resp.ok or resp.status_code != 200:
             raise Exception(f"Couldn't get server config: {resp.status_code}, {resp.text}")
         self._server_config = resp.json()
@@ -43,25 +105,58 @@ class ClientHTTPSession:
     def serialize_thought(self, thought, serializer):
         """
         a hook that serializes the thought, doing taking action according to the configuration.
+        if the server named the snapshot fields it wants, the rest are not sent.
         :param thought:
         :param serializer:
         :return:
         """
-        #TODO: add configuration filtering? here?
+        fields = (self._server_config or {}).get(configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS)
+        if fields is not None:
+            thought = Thought.from_snapshot(thought.metadata, _filter_snapshot(thought.snapshot, fields))
         return thought.serialize(serializer)
 
-    def send_thought(self, thought, serializer, metadata_serializer):
+    def send_thought(self, thought, serializer, metadata_serializer, register_user=True):
         """
         sends the thoughts as the current user
         :param thought: the thought to send
         :param serializer: the thought serializer
         :param metadata_serializer: the user metadata serializer
+        :param register_user: make sure the user is registered first. pass False if it was registered elsewhere
         :return:
         """
-        self.ensure_user(thought,  metadata_serializer)
+        if register_user:
+            self.ensure_user(thought,  metadata_serializer)
         data = self.serialize_thought(thought, serializer)
-        content_type =  'application/octet-stream' if isinstance(data, bytes) else ''
-        return self.post_with_content_type(f'user/{thought.user_id}', data, content_type= content_type)
+        is_bytes = isinstance(data, bytes)
+        content_type = 'application/octet-stream' if is_bytes else ''
+        return self.post_with_content_type(f'user/{thought.user_id}', data, content_type= content_type,
+                                           content_encoding=self.content_encoding if is_bytes else None)
+
+    def send_thoughts(self, thoughts, serializer, metadata_serializer, register_user=True):
+        """
+        sends the thoughts as the current user in a single request, bundled (see `snapshot_bundle`).
+        if the server has no batch endpoint, they are sent one by one, and so is every later batch of the session.
+        :param thoughts: the thoughts to send. they all belong to the same user.
+        :param serializer: the thought serializer, must return bytes
+        :param metadata_serializer: the user metadata serializer
+        :param register_user: make sure the user is registered first. pass False if it was registered elsewhere
+        :return:
+        """
+        thoughts = list(thoughts)
+        if not thoughts:
+            return True
+        if register_user:
+            self.ensure_user(thoughts[0], metadata_serializer)
+        if self._batch_supported:
+            data = snapshot_bundle.pack(self.serialize_thought(thought, serializer) for thought in thoughts)
+            resp = self._post(f'user/{thoughts[0].user_id}/batch', data, snapshot_bundle.CONTENT_TYPE,
+                              content_encoding=self.content_encoding)
+            if resp.status_code not in self.BATCH_UNSUPPORTED:
+                return resp.ok
+            module_logger.warning(f"the server has no batch endpoint ({resp.status_code}), sending snapshots one by one")
+            self._batch_supported = False
+        return all([self.send_thought(thought, serializer, metadata_serializer, register_user=False)
+                    for thought in thoughts])
 
     @once_per('self')
     def ensure_user(self, thought, serializer):
@@ -69,27 +164,203 @@ class ClientHTTPSession:
         data = thought.serialize_user(serializer)
         return self.post_with_content_type('users', data, 'application/json')
 
-    def post_with_content_type(self, path, data, content_type=None):
+    def post_with_content_type(self, path, data, content_type=None, content_encoding=None):
+        return self._post(path, data, content_type, content_encoding).ok
+
+    def _post(self, path, data, content_type=None, content_encoding=None):
         url = self.url / path
         headers = {'Content-Type': content_type} if content_type else {}
-        resp = url.post(data=data, headers=headers)
-        return resp.ok
+        if content_encoding:
+            data = compression.compress(content_encoding, data)
+            headers['Content-Encoding'] = content_encoding
+        return self.transport.post(str(url), data=data, headers=headers, timeout=self.timeout)
 
 
 ClientSession = ClientHTTPSession
 
-def _upload_sample(thought_collection, session):
-    for thought in thought_collection:
-            session.send_thought(thought, cortex_pb2.Snapshot.SerializeToString, lambda x: json.dumps(MessageToDict(x)))
 
-def upload_sample(host, port, sample_path):
+def _filter_snapshot(snapshot, fields):
+    """
+    returns a copy of the snapshot that only has the given fields (and its datetime, which is always needed)
+    """
+    keep = set(fields) | {'datetime'}
+    filtered = type(snapshot)()
+    for descriptor, value in snapshot.ListFields():
+        if descriptor.name not in keep:
+            continue
+        if descriptor.message_type:
+            getattr(filtered, descriptor.name).CopyFrom(value)
+        else:
+            setattr(filtered, descriptor.name, value)
+    return filtered
+
+def _serialize_user(user):
+    return json.dumps(MessageToDict(user))
+
+
+def _send(session, unit, retries, register_user=True):
+    """
+    sends a single thought, or a list of thoughts as one bundle, retrying on failure.
+    :return: (ok, attempts)
+    """
+    send = session.send_thoughts if isinstance(unit, list) else session.send_thought
+    for attempt in range(1, retries + 2):
+        with logging.log_exception(module_logger, to_suppress=(Exception,),
+                                   format=lambda e: f"upload attempt {attempt} failed: {e}"):
+            if send(unit, cortex_pb2.Snapshot.SerializeToString, _serialize_user, register_user=register_user):
+                return True, attempt
+    return False, retries + 1
+
+
+def _report(index, ok, attempts):
+    if not ok and not attempts:
+        module_logger.error(f"upload #{index} failed before it was sent")
+    elif not ok:
+        module_logger.error(f"upload #{index} failed after {attempts} attempts")
+    elif attempts > 1:
+        module_logger.warning(f"upload #{index} succeeded after {attempts} attempts")
+
+
+def _upload_in_order(units, submit, window):
+    """
+    submits the units for upload, keeping at most `window` of them in flight so that the reader can't run away
+    with the memory. results are reported in the order the units were read, regardless of the order they finish in.
+    a failed upload doesn't stop the rest, the failures are summed up at the end.
+    :param units: an iterable of things to upload
+    :param submit: lambda unit -> a callable that waits for the upload to finish and returns (ok, attempts)
+    :param window: how many uploads may be in flight
+    :return: the indices of the uploads that failed
+    """
+    in_flight = deque()
+    failed = []
+
+    def report(index, wait):
+        ok, attempts = wait()
+        _report(index, ok, attempts)
+        if not ok:
+            failed.append(index)
+    total = 0
+    for total, unit in enumerate(units, 1):
+        if len(in_flight) >= window:
+            report(*in_flight.popleft())
+        in_flight.append((total - 1, submit(unit)))
+    for done in in_flight:
+        report(*done)
+    if failed:
+        module_logger.error(f"{len(failed)} of {total} uploads failed: {failed}")
+    return failed
+
+
+def _upload_concurrently(units, session, concurrency, window, retries):
+    """
+    uploads with `concurrency` sender threads, while this thread reads (and decompresses and parses) ahead of them.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cortex-upload') as pool:
+        _upload_in_order(units, lambda unit: pool.submit(_send, session, unit, retries).result, window)
+
+
+_worker_state = {}
+
+
+def _init_upload_worker(url, server_config, user_data):
+    session = ClientSession(url, server_config).open()
+    user = cortex_pb2.User()
+    user.ParseFromString(user_data)
+    _worker_state.update(session=session, user=user)
+
+
+def _send_from_worker(unit, retries):
+    """
+    parses the raw snapshot (or list of them) and sends it with the worker's session.
+    the user was registered by the reading process, so workers never register it.
+    """
+    def to_thought(message):
+        snapshot = cortex_pb2.Snapshot()
+        snapshot.ParseFromString(message)
+        return Thought.from_snapshot(_worker_state['user'], snapshot)
+    unit = list(map(to_thought, unit)) if isinstance(unit, list) else to_thought(unit)
+    return _send(_worker_state['session'], unit, retries, register_user=False)
+
+
+def _worker_result(async_result):
+    """
+    :return: a callable that waits for an upload on a worker and returns (ok, attempts). an error on the worker,
+             like a snapshot that doesn't parse, fails that upload alone, with no attempts
+    """
+    def wait():
+        try:
+            return async_result.get()
+        except Exception as e:
+            module_logger.error(f"upload worker failed: {e!r}")
+            return False, 0
+    return wait
+
+
+def _upload_with_workers(sample, session, workers, batch_size, window, retries):
+    """
+    uploads with `workers` processes. this process only scans the sample (decompressing it) and cuts it into raw
+    messages, the workers parse and send them.
+    the user is registered once, from this process, before any of the workers start sending.
+    """
+    parser = protobuf_parser.ProtobufSampleParser()
+    user = parser.parse_user(sample)
+    session.ensure_user(Thought.from_snapshot(user, None), _serialize_user)
+    messages = iter(lambda: parser.read_raw_message(sample), None)
+    messages = map(bytes, messages)  # memoryviews over the sample can't be sent to other processes
+    units = map(list, chunks(batch_size, messages)) if batch_size > 1 else messages
+    with multiprocessing.Pool(workers, initializer=_init_upload_worker,
+                              initargs=(str(session.url), session.server_config, user.SerializeToString())) as pool:
+        _upload_in_order(units, lambda unit: _worker_result(pool.apply_async(_send_from_worker, (unit, retries))),
+                         window)
+
+
+def _upload_sample(thought_collection, session, batch_size=1, concurrency=1, window=None, retries=0):
+    units = map(list, chunks(batch_size, thought_collection)) if batch_size > 1 else thought_collection
+    if concurrency > 1:
+        return _upload_concurrently(units, session, concurrency, window or 2 * concurrency, retries)
+    for index, unit in enumerate(units):
+        _report(index, *_send(session, unit, retries))
+
+
+def upload_sample(host, port, sample_path, batch_size=None, concurrency=None, retries=None, workers=None):
     """
     uploads the sample at the given path to a cortex host at the given host/port.
     :param host: hostname
     :param port: port
     :param sample_path: path the the samplefile
+    :param batch_size: how many snapshots to send per request. defaults to the configured batch size,
+                       1 sends every snapshot on its own.
+    :param concurrency: how many requests may be in the air at once. defaults to the configured concurrency,
+                        1 uploads sequentially.
+    :param retries: how many times to retry a failed upload. defaults to the configured amount.
+    :param workers: how many processes parse and send the snapshots. defaults to the configured amount,
+                    1 does everything in this process. takes precedence over concurrency.
     :return:
     """
-    with filesystem.open_file(sample_path) as sample, ClientSession.start(host, port) as session:
+    config = configuration.get_config()
+    batch_size = batch_size or config[configuration.CONFIG_CLIENT_BATCH_SIZE]
+    concurrency = concurrency or config[configuration.CONFIG_CLIENT_CONCURRENCY]
+    retries = config[configuration.CONFIG_CLIENT_RETRIES] if retries is None else retries
+    workers = workers or config[configuration.CONFIG_CLIENT_WORKERS]
+    window = config[configuration.CONFIG_CLIENT_UPLOAD_WINDOW]
+    with sample_reader.open_sample(sample_path) as sample, ClientSession.start(host, port) as session:
+        if workers > 1:
+            return _upload_with_workers(sample, session, workers, batch_size, window or 2 * workers, retries)
+        reader = sample_reader.SampleReader(sample, protobuf_parser.ProtobufSampleParser())
+        _upload_sample(reader, session, batch_size=batch_size, concurrency=concurrency,
+                       window=window, retries=retries)
+
+
+def measure_read(sample_path, open_stream=sample_reader.open_sample, limit=None):
+    """
+    reads (and parses) the snapshots in the sample without sending them anywhere, to measure reading throughput.
+    :param sample_path: path to the sample file
+    :param open_stream: a context manager factory that opens the sample path as a stream
+    :param limit: stop after this many snapshots
+    :return: (snapshots read, seconds taken)
+    """
+    start = time.perf_counter()
+    with open_stream(sample_path) as sample:
         reader = sample_reader.SampleReader(sample, protobuf_parser.ProtobufSampleParser())
-        _upload_sample(reader, session)
+        count = ilen(take(limit, reader)) if limit else ilen(reader)
+    return count, time.perf_counter() - start
@@ -24,19 +24,30 @@ class ProtobufSampleParser:
         return read_size
 
 
-    def read_message(self, stream, into):
+    def read_raw_message(self, stream):
         """
-        reads a single message into the given thing from the stream
+        reads a single message from the stream, without parsing it
         :param stream: stream to read from.
-        :param into: the message type that is being parsed
-        :return: Nothing, the message is in into. raises on error
+        :return: the message bytes, or None at the end of the stream. raises on error
         """
         message_size = self.read_message_size(stream)
         if not message_size:
-            return False
+            return None
         message = utils.read_all(stream, message_size)
         if not message:  # this would happen if read_all fails to read all the data from the stream
             raise ProtobufParseError("Could not read message from stream")
+        return message
+
+    def read_message(self, stream, into):
+        """
+        reads a single message into the given thing from the stream
+        :param stream: stream to read from.
+        :param into: the message type that is being parsed
+        :return: Nothing, the message is in into. raises on error
+        """
+        message = self.read_raw_message(stream)
+        if message is None:
+            return False
         into.ParseFromString(message)
         return True
 
@@ -0,0 +1,151 @@
+"""
+An index of a sample file: where every message in it starts, how big it is, and the snapshot's datetime.
+The index is stored in a sidecar file next to the sample (<sample>.idx), so a sample is only scanned once.
+
+With an index, a sample no longer has to be read front to back:
+ - `between` finds the snapshots in a time range, and `read` reads only them.
+ - `split` cuts the sample into contiguous parts of about the same size, for parallel readers.
+
+Offsets are in the uncompressed stream, so seeking in a gzipped sample still decompresses up to the offset.
+"""
+import pathlib
+from collections import namedtuple
+from struct import Struct
+
+from cortex import utils, Thought
+from cortex.utils import protobuf_wire
+from . import cortex_pb2, sample_reader
+from .protobuf_parser import ProtobufSampleParser, ProtobufParseError
+
+IndexEntry = namedtuple('IndexEntry', ['offset', 'size', 'datetime'])
+
+SNAPSHOT_DATETIME_FIELD = cortex_pb2.Snapshot.DESCRIPTOR.fields_by_name['datetime'].number
+
+
+class SampleIndex:
+    MAGIC = b'CXI1'
+    HEADER = Struct("4sQ")  # magic, number of snapshot entries
+    ENTRY = Struct("QIQ")  # message offset (after its size), message size, snapshot datetime
+
+    @classmethod
+    def build(cls, stream, parser=None):
+        """
+        scans the sample stream from its start and indexes it.
+        snapshots are not parsed, their datetime is read straight off the wire.
+        :param stream: the sample stream
+        :param parser: the sample parser, its message framing is used to walk the stream
+        :return: a SampleIndex
+        """
+        parser = parser or ProtobufSampleParser()
+        entries = []
+        offset = 0
+        size = parser.read_message_size(stream)
+        if not size:
+            raise ProtobufParseError("sample has no user message")
+        user = IndexEntry(offset + parser.MESSAGE_SIZE_PARSER.size, size, 0)
+        utils.read_all(stream, size)
+        offset = user.offset + size
+        while True:
+            size = parser.read_message_size(stream)
+            if not size:
+                break
+            message = utils.read_all(stream, size)
+            entries.append(IndexEntry(offset + parser.MESSAGE_SIZE_PARSER.size, size,
+                                      protobuf_wire.find_varint(message, SNAPSHOT_DATETIME_FIELD)))
+            offset += parser.MESSAGE_SIZE_PARSER.size + size
+        return cls(user, entries)
+
+    @classmethod
+    def load(cls, path):
+        data = pathlib.Path(path).read_bytes()
+        magic, count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a sample index")
+        entries = [IndexEntry(*i) for i in cls.ENTRY.iter_unpack(memoryview(data)[cls.HEADER.size:])]
+        if len(entries) != count + 1:
+            raise ValueError(f"{path} is truncated")
+        return cls(entries[0], entries[1:])
+
+    @staticmethod
+    def sidecar_path(sample_path):
+        sample_path = pathlib.Path(sample_path)
+        return sample_path.with_name(sample_path.name + '.idx')
+
+    @classmethod
+    def for_sample(cls, sample_path):
+        """
+        returns the index of the sample file, from its sidecar if it is up to date, otherwise builds and saves it.
+        :param sample_path: path to the sample file
+        :return: a SampleIndex
+        """
+        sidecar = cls.sidecar_path(sample_path)
+        if sidecar.exists() and sidecar.stat().st_mtime >= pathlib.Path(sample_path).stat().st_mtime:
+            return cls.load(sidecar)
+        with sample_reader.open_sample(sample_path) as stream:
+            index = cls.build(stream)
+        index.save(sidecar)
+        return index
+
+    def __init__(self, user, entries):
+        """
+        :param user: the IndexEntry of the user message
+        :param entries: the IndexEntries of the snapshots, in file order
+        """
+        self.user = user
+        self.entries = list(entries)
+
+    def save(self, path):
+        parts = [self.HEADER.pack(self.MAGIC, len(self.entries)), self.ENTRY.pack(*self.user)]
+        parts.extend(self.ENTRY.pack(*entry) for entry in self.entries)
+        pathlib.Path(path).write_bytes(b''.join(parts))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def between(self, start=None, end=None):
+        """
+        :return: the entries of the snapshots with start <= datetime < end, in file order. None means unbounded
+        """
+        return [i for i in self.entries
+                if (start is None or i.datetime >= start) and (end is None or i.datetime < end)]
+
+    def split(self, parts):
+        """
+        splits the snapshots into (at most) `parts` contiguous runs of about the same number of bytes
+        :param parts: how many runs to split into
+        :return: a list of entry lists
+        """
+        total = sum(i.size for i in self.entries)
+        out, current, current_size = [], [], 0
+        for entry in self.entries:
+            current.append(entry)
+            current_size += entry.size
+            if current_size * parts >= total * (len(out) + 1) and len(out) < parts - 1:
+                out.append(current)
+                current = []
+        if current:
+            out.append(current)
+        return out
+
+    @staticmethod
+    def byte_range(entries):
+        """
+        :return: the (start, end) byte range that holds the given contiguous entries, size prefixes included
+        """
+        return entries[0].offset - ProtobufSampleParser.MESSAGE_SIZE_PARSER.size, entries[-1].offset + entries[-1].size
+
+    def read(self, stream, entries=None):
+        """
+        reads the given snapshots from the sample stream, seeking to each of them
+        :param stream: a seekable sample stream
+        :param entries: entries to read, defaults to all of them
+        :return: a generator of Thoughts
+        """
+        user = cortex_pb2.User()
+        stream.seek(self.user.offset)
+        user.ParseFromString(utils.read_all(stream, self.user.size))
+        for entry in self.entries if entries is None else entries:
+            stream.seek(entry.offset)
+            snapshot = cortex_pb2.Snapshot()
+            snapshot.ParseFromString(utils.read_all(stream, entry.size))
+            yield Thought.from_snapshot(user, snapshot)
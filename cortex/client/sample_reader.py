@@ -13,8 +13,84 @@ The thing we are trying to achieve here is the following:
 What I chose to do is have a SampleThoughtReader which:
  1. Implements the logic of reading thoughts one by another
  2. Can be decorated with a stream type (for context manager 'open' functions) and a format parser.
+
+`open_sample` picks the stream for a sample file: uncompressed samples are memory mapped, and reads from them are
+memoryview slices of the mapping, so a message goes into ParseFromString without being copied.
+gzipped samples are decompressed as a stream through a large buffer.
 """
-from contextlib import contextmanager
+import gzip
+import io
+import mmap
+import pathlib
+from contextlib import contextmanager, suppress
+
+from cortex import configuration
+
+
+class MappedSampleStream:
+    """
+    A read-only stream over a memory mapped file.
+    reads return memoryview slices over the mapping rather than copies of the data.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._offset = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._offset + size, len(self._view))
+        out = self._view[self._offset:end]
+        self._offset = end
+        return out
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._offset, io.SEEK_END: len(self._view)}[whence]
+        self._offset = max(0, min(base + offset, len(self._view)))
+        return self._offset
+
+    def tell(self):
+        return self._offset
+
+    def close(self):
+        self._view.release()
+        # a map with views still out can't be closed. it is then unmapped once the last view is released
+        with suppress(BufferError):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._file.name!r})"
+
+
+@contextmanager
+def open_sample(path, mapped=None, buffer_size=None):
+    """
+    opens a sample file for reading with the fastest stream available for it.
+    :param path: path to the sample file
+    :param mapped: memory map uncompressed samples. defaults to the configuration
+    :param buffer_size: the read buffer size for compressed samples. defaults to the configuration
+    :return: a stream over the sample
+    """
+    config = configuration.get_config()
+    mapped = config[configuration.CONFIG_CLIENT_MAP_SAMPLES] if mapped is None else mapped
+    buffer_size = buffer_size or config[configuration.CONFIG_CLIENT_READ_BUFFER_SIZE]
+    path = pathlib.Path(path)
+    if path.suffix == '.gz':
+        with gzip.open(path) as raw, io.BufferedReader(raw, buffer_size) as stream:
+            yield stream
+    elif mapped and path.stat().st_size:  # empty files can't be mapped
+        with MappedSampleStream(path) as stream:
+            yield stream
+    else:
+        with open(path, 'rb', buffering=buffer_size) as stream:
+            yield stream
 
 
 class SampleReader:
@@ -10,17 +10,60 @@ import logging
 
 CONFIG_DEBUG_LEVEL = 'debug_level'
 CONFIG_CLIENT_CONFIG = 'client_config'
+CLIENT_CONFIG_SNAPSHOT_FIELDS = 'snapshot_fields'  # in CONFIG_CLIENT_CONFIG, the snapshot fields clients should send
+CLIENT_CONFIG_CONTENT_ENCODINGS = 'content_encodings'  # in CONFIG_CLIENT_CONFIG, the codecs the server can decode
+CONFIG_CLIENT_BATCH_SIZE = 'client_batch_size'
+CONFIG_CLIENT_CONCURRENCY = 'client_concurrency'
+CONFIG_CLIENT_UPLOAD_WINDOW = 'client_upload_window'
+CONFIG_CLIENT_RETRIES = 'client_retries'
+CONFIG_CLIENT_WORKERS = 'client_workers'
+CONFIG_CLIENT_POOL_SIZE = 'client_pool_size'
+CONFIG_CLIENT_CONNECT_TIMEOUT = 'client_connect_timeout'
+CONFIG_CLIENT_READ_TIMEOUT = 'client_read_timeout'
+CONFIG_CLIENT_MAP_SAMPLES = 'client_map_samples'
+CONFIG_CLIENT_READ_BUFFER_SIZE = 'client_read_buffer_size'
+CONFIG_CLIENT_CONTENT_ENCODINGS = 'client_content_encodings'
 CONFIG_SERVER_THREAD_NAME = 'backend_thread_name'
 CONFIG_SERVER_CONFIG_ENDPOINT = 'client_configuration_endpoint'
 CONFIG_SERVER_PUBLISH_TOPICS = 'server_publish_topics'
+CONFIG_SERVER_MODE = 'server_mode'
+CONFIG_SERVER_ASYNC_WORKERS = 'server_async_workers'
+CONFIG_SERVER_MAX_BODY_SIZE = 'server_max_body_size'
+CONFIG_SERVER_BACKLOG = 'server_backlog'
+CONFIG_SERVER_FAN_OUT = 'server_fan_out'
+CONFIG_PREFORK_WORKERS = 'prefork_workers'
+CONFIG_PREFORK_BACKLOG = 'prefork_backlog'
+CONFIG_PREFORK_TIMEOUT = 'prefork_timeout'
+CONFIG_PREFORK_GRACEFUL_TIMEOUT = 'prefork_graceful_timeout'
 CONFIG_RAW_MESSAGE_REPO = 'server_snapshot_location'
 RAW_MESSAGE_REPO = 'raw_message_repo'
 CONFIG_RAW_MESSAGE_DECODER = 'raw-message-decoder'
 CONFIG_RAW_MESSAGE_ENCODER = 'raw-message-encoder'
+CONFIG_RAW_MESSAGE_BACKEND = 'raw_message_backend'
+CONFIG_SEGMENT_SIZE = 'segment_size'
+CONFIG_SEGMENT_RETENTION = 'segment_retention'
+CONFIG_SEGMENT_MAP_CACHE = 'segment_map_cache'
+CONFIG_RAW_MESSAGE_RETENTION = 'raw_message_retention'
+CONFIG_RAW_MESSAGE_INLINE_THRESHOLD = 'raw_message_inline_threshold'
+CONFIG_RAW_MESSAGE_REAPER_INTERVAL = 'raw_message_reaper_interval'
 
 CONFIG_DISPATCHER_CONSUMER_DIR = 'server-dispatcher-consumer-dir'
 CONFIG_PARSER_DIR = 'server-parser-dir'
+CONFIG_PARSER_START_MODE = 'parser_start_mode'
+CONFIG_PARSER_REPLICAS = 'parser_replicas'
+CONFIG_CONSUMER_PREFETCH = 'consumer_prefetch'
+CONFIG_CONSUMER_MANUAL_ACK = 'consumer_manual_ack'
+CONFIG_PUBLISHER_BUFFER_SIZE = 'publisher_buffer_size'
+CONFIG_PUBLISHER_BATCH_SIZE = 'publisher_batch_size'
+CONFIG_PUBLISHER_CONFIRMS = 'publisher_confirms'
+MESSAGE_TARGETS_KEY = 'targets'  # the parser targets a snapshot was split for, carried on to the parsed results
+MESSAGE_EXCHANGE = 'cortex.topics'  # a topic exchange; messages are routed by their topic
+DEAD_LETTER_EXCHANGE = 'cortex.dead_letters'
+DEAD_LETTER_QUEUE = 'cortex.dead_letters'
 CONFIG_SAVER_DIR = 'server-saver-dir'
+CONFIG_SAVER_BATCH_SIZE = 'saver_batch_size'
+CONFIG_SAVER_BATCH_DELAY = 'saver_batch_delay'
+CONFIG_SAVER_MERGE_TIMEOUT = 'saver_merge_timeout'
 
 CONFIG_SERVICE_DOCKER_IMAGES = 'server-docker-image-data'
 
@@ -57,13 +100,54 @@ def get_config():
     return {
         CONFIG_DEBUG_LEVEL: logging.INFO,
         CONFIG_CLIENT_CONFIG: {},
+        CONFIG_CLIENT_BATCH_SIZE: 1,  # snapshots per upload. above 1 they're bundled, which older servers can't take
+        CONFIG_CLIENT_CONCURRENCY: 1,
+        CONFIG_CLIENT_UPLOAD_WINDOW: None,  # defaults to twice the concurrency
+        CONFIG_CLIENT_RETRIES: 2,
+        CONFIG_CLIENT_WORKERS: 1,
+        CONFIG_CLIENT_POOL_SIZE: 8,  # should be at least the upload concurrency
+        CONFIG_CLIENT_CONNECT_TIMEOUT: 5,
+        CONFIG_CLIENT_READ_TIMEOUT: 60,
+        CONFIG_CLIENT_MAP_SAMPLES: True,
+        CONFIG_CLIENT_READ_BUFFER_SIZE: 4 * 1024 * 1024,
+        CONFIG_CLIENT_CONTENT_ENCODINGS: ('zstd', 'lz4', 'gzip'),  # best first, empty to never compress
         CONFIG_SERVER_THREAD_NAME: "cortex_backend_server",
         CONFIG_SERVER_CONFIG_ENDPOINT: '/configuration',
         CONFIG_SERVER_PUBLISH_TOPICS: ['test1'],
+        CONFIG_SERVER_MODE: 'flask',  # 'flask', 'async' or 'prefork'
+        CONFIG_SERVER_ASYNC_WORKERS: 32,  # threads that encode and publish for the async server
+        CONFIG_SERVER_MAX_BODY_SIZE: 256 * 1024 * 1024,
+        CONFIG_SERVER_BACKLOG: 1024,
+        CONFIG_SERVER_FAN_OUT: True,  # split snapshots per parser, if every parser is named after a snapshot field
+        CONFIG_PREFORK_WORKERS: 2 * (os.cpu_count() or 1) + 1,
+        CONFIG_PREFORK_BACKLOG: 2048,
+        CONFIG_PREFORK_TIMEOUT: 30,  # seconds a worker may spend on a request before it is restarted
+        CONFIG_PREFORK_GRACEFUL_TIMEOUT: 30,
         CONFIG_RAW_MESSAGE_REPO: shared_message_repo(),
+        CONFIG_RAW_MESSAGE_BACKEND: 'files',  # 'files': a file per message, 'segments': an append-only segment log
+        CONFIG_SEGMENT_SIZE: 64 * 1024 * 1024,
+        CONFIG_SEGMENT_RETENTION: 0,  # seconds a consumed segment is kept after it is sealed
+        CONFIG_SEGMENT_MAP_CACHE: 32,  # segments a reader keeps mapped, the least recently read are unmapped
+        CONFIG_RAW_MESSAGE_INLINE_THRESHOLD: 16 * 1024,  # smaller snapshots travel in the message, 0 to never inline
+        CONFIG_RAW_MESSAGE_RETENTION: 3600,  # seconds a consumed record is kept after it was last stored
+        CONFIG_RAW_MESSAGE_REAPER_INTERVAL: 60,  # seconds between reaper runs in the server, 0 to not reap
         CONFIG_DISPATCHER_CONSUMER_DIR: (),
         CONFIG_PARSER_DIR : (),
+        CONFIG_PARSER_START_MODE: 'threads',  # how start-all runs parsers: 'threads' or 'processes'
+        CONFIG_PARSER_REPLICAS: {},  # parser target -> worker processes to run it in, 1 if missing
+        CONFIG_CONSUMER_PREFETCH: 16,  # unacknowledged messages a consumer may hold, see basic_qos
+        CONFIG_CONSUMER_MANUAL_ACK: False,  # ack messages after they were handled, dead letter the failed ones
+        CONFIG_PUBLISHER_BUFFER_SIZE: 4096,  # messages the ingest publisher holds for its ioloop before refusing more
+        CONFIG_PUBLISHER_BATCH_SIZE: 256,  # messages a publisher publishes per ioloop tick
+        CONFIG_PUBLISHER_CONFIRMS: False,  # keep published messages until the broker confirms it has them
         CONFIG_SAVER_DIR: (),
+        # snapshots the saver writes in one bulk write, 1 writes every update as it comes. needs consumer_manual_ack,
+        # and is capped at consumer_prefetch, the most unacked messages the saver is delivered.
+        # None batches when consumer_manual_ack is on, and doesn't otherwise
+        CONFIG_SAVER_BATCH_SIZE: None,
+        CONFIG_SAVER_BATCH_DELAY: 0.5,  # most seconds the saver holds an update before writing it
+        # seconds the saver waits for all of a snapshot's parsers, 0 doesn't merge. needs consumer_manual_ack
+        CONFIG_SAVER_MERGE_TIMEOUT: 0,
         CONFIG_SERVICE_DOCKER_IMAGES: {'db': MONGO_DB_DOCKER_INFO, 'mq': RABBIT_MQ_DOCKER_INFO},
         CONFIG_USER_STORAGE_BASE: shared_storage_path() / 'users'
     }
@@ -87,8 +171,30 @@ class topics:
     user_info = 'user_info'
 
 
-def get_raw_data_topic_name():
-    return topics.snapshot
+def get_raw_data_topic_name(target=''):
+    """
+    :param target: a parser target, for the topic that carries snapshots split for that parser
+    """
+    return f"{topics.snapshot}{target}"
+
+
+def get_topic_bindings(topic):
+    """
+    the routing keys a consumer of the topic is bound with, so the broker delivers it only what it consumes:
+    the topic itself, and for the snapshot topics of single parsers also the topic of whole snapshots,
+    since snapshots that aren't split are published whole.
+    """
+    out = [topic]
+    if topic != topics.snapshot and topic.startswith(topics.snapshot):
+        out.append(topics.snapshot)
+    return out
+
+
+def get_work_queue_name(name):
+    """
+    :return: the queue that all the replicas of the named parser (or other worker) take their work from
+    """
+    return f"work.{name}"
 
 
 def get_parsed_data_topic_name(name):
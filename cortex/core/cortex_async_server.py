@@ -0,0 +1,123 @@
+"""
+An asyncio version of the ingest server in `cortex_rest_server`, with the same routes and the same behaviour.
+
+The event loop only ever reads requests and writes responses. Encoding a snapshot (which writes it to disk) and
+publishing it are blocking, so they run on a thread pool and the handler awaits them. A slow disk or broker then
+holds up the requests that wait on it, not every connected client.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from cortex import configuration
+from cortex.core import snapshot_bundle
+from cortex.core.cortex_rest_server import decode_body, user_info_message, get_snapshot_publisher
+from cortex.utils import compression
+from cortex.utils.dispatchers.backpressure import PublisherFull
+
+
+def get_server(publisher, message_encoder, client_config=None, executor=None, snapshot_publisher=None):
+    """
+    Gets an aiohttp application that accepts thoughts and forwards them to the publisher.
+    :param publisher: whatever pipelines the requests further down to the backend, a callable or has `publish`
+    :param message_encoder: a callable that gets the message and encodes it into a string
+    :param client_config: the configuration handed to clients, defaults to the configured client config
+    :param executor: where the encoder and publisher run, defaults to a thread pool sized by the configuration
+    :param snapshot_publisher: encodes and publishes a (snapshot, user=id), see `cortex_rest_server.get_server`
+    :return: the application, run it with `run_server`
+    """
+    config = configuration.get_config()
+    publish_func = publisher if callable(publisher) else publisher.publish
+    publish_snapshot = get_snapshot_publisher(publish_func, message_encoder, snapshot_publisher)
+    executor = executor or ThreadPoolExecutor(config[configuration.CONFIG_SERVER_ASYNC_WORKERS],
+                                              thread_name_prefix='cortex_ingest')
+
+    def publish_snapshots(snapshots, user):
+        for snapshot in snapshots:
+            publish_snapshot(snapshot, user=user)
+
+    async def in_executor(func, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except PublisherFull as e:
+            raise web.HTTPServiceUnavailable(text=f"Busy, try again later: {e}", headers={'Retry-After': '1'})
+
+    async def snapshot_data(request):
+        data = await request.read()
+        try:
+            # decompressing megabytes would hold up every other connection, so it doesn't happen on the loop
+            return await in_executor(decode_body, data, request.headers.get('Content-Encoding'))
+        except compression.UnsupportedEncoding as e:
+            raise web.HTTPUnsupportedMediaType(text=str(e))
+        except compression.TooLarge as e:
+            raise web.HTTPRequestEntityTooLarge(max_size=e.max_size, actual_size=e.max_size + 1, text=str(e))
+        except Exception as e:
+            raise web.HTTPBadRequest(text=f"Could not decode body: {e}")
+
+    async def handle_new_thought(request):
+        data = await snapshot_data(request)
+        await in_executor(publish_snapshots, [data], request.match_info['id'])
+        return web.Response(text='OK')
+
+    async def handle_thought_batch(request):
+        data = await snapshot_data(request)
+        try:
+            snapshots = list(snapshot_bundle.unpack(data))
+        except snapshot_bundle.BundleError as e:
+            raise web.HTTPBadRequest(text=f"Bad bundle: {e}")
+        await in_executor(publish_snapshots, snapshots, request.match_info['id'])
+        return web.Response(text='OK')
+
+    async def get_configuration(request):
+        if client_config is not None:
+            return web.json_response(client_config)
+        return web.json_response(configuration.get_config()[configuration.CONFIG_CLIENT_CONFIG])
+
+    async def ensure_user(request):
+        message = user_info_message(await request.json())
+        await in_executor(publish_func, configuration.get_parsed_data_topic_name(configuration.topics.user_info),
+                          message)
+        return web.Response(text='OK')
+
+    async def shutdown_executor(app):
+        executor.shutdown(wait=True)
+
+    # bodies are decoded by decode_body, like the Flask server does, so the codecs stay the ones we advertise
+    app = web.Application(client_max_size=config[configuration.CONFIG_SERVER_MAX_BODY_SIZE],
+                          handler_args=dict(auto_decompress=False))
+    app.add_routes([web.post('/user/{id}', handle_new_thought),
+                    web.post('/user/{id}/batch', handle_thought_batch),
+                    web.get(config[configuration.CONFIG_SERVER_CONFIG_ENDPOINT], get_configuration),
+                    web.post('/users', ensure_user)])
+    app.on_cleanup.append(shutdown_executor)
+    return app
+
+
+def run_server(app, host, port):
+    """
+    serves the application on a new event loop until the loop is stopped. blocks, so it can be a thread's target.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port, backlog=configuration.get_config()[configuration.CONFIG_SERVER_BACKLOG])
+    loop.run_until_complete(site.start())
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+
+class AsyncServer:
+    """ runs an application the way the Flask server runs: `run(host, port)` """
+    def __init__(self, app):
+        self.app = app
+
+    def run(self, host, port):
+        run_server(self.app, host, port)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.app!r}>"
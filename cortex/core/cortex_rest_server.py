@@ -1,9 +1,12 @@
 import json
 
-from flask import Flask, request
+from flask import Flask, request, abort
 
 from cortex import utils
 from cortex import configuration
+from cortex.core import snapshot_bundle
+from cortex.utils import compression
+from cortex.utils.dispatchers.backpressure import PublisherFull
 
 def get_logger():
     get_logger.counter += 1
@@ -12,7 +15,47 @@ def get_logger():
 get_logger.counter = 0
 
 
-def get_server(publisher, message_encoder, server_name="cortex_api", *flask_args, **flask_kwargs):
+def decode_body(data, content_encoding, max_size=None):
+    """
+    decompresses a request body according to its Content-Encoding header
+    :param data: the body
+    :param content_encoding: the header value, may be None
+    :param max_size: the most bytes the body may decompress to, defaults to the configured max body size
+    :return: the decompressed body
+    :raises compression.TooLarge: if the body decompresses to more than max_size
+    :raises compression.Truncated: if the body was cut short, which the servers answer with 400
+    """
+    if not content_encoding or content_encoding == 'identity':
+        return data
+    if max_size is None:
+        max_size = configuration.get_config()[configuration.CONFIG_SERVER_MAX_BODY_SIZE]
+    return compression.decompress(content_encoding, data, max_size=max_size)
+
+
+def user_info_message(user_info):
+    """
+    turns the user info a client registers into the parsed user_info message
+    :param user_info: the json the client posted to /users
+    :return: the message to publish, a json string
+    """
+    # parsing here because this is hella simple
+    user_info['id'] = user_info.pop('userId')
+    gender_enum = user_info.get('gender', 0)
+    user_info['gender'] = 'Male' if gender_enum == 0 else 'Female' if gender_enum == 1 else 'Other'
+    return json.dumps(user_info)
+
+
+def get_snapshot_publisher(publish_func, message_encoder, snapshot_publisher=None):
+    """
+    :return: snapshot_publisher, or one that publishes whole snapshots on the snapshot topic
+    """
+    if snapshot_publisher:
+        return snapshot_publisher
+    return lambda snapshot, user: publish_func(configuration.topics.snapshot, message_encoder(snapshot, user=user))
+
+
+def get_server(publisher, message_encoder, server_name="cortex_api", *flask_args, client_config=None,
+               snapshot_publisher=None, **flask_kwargs):
     """
     Gets a server that accepts a thought and forwards it to the dispatcher.
     The server also gives configuration to users that request it.
@@ -26,12 +69,39 @@ def get_server(publisher, message_encoder, server_name="cortex_api", *flask_args
     :param publisher: whatever pieplines the requests further down to the backend.
     :param server_name: ...
     :param flask_args: args to pass to the Flask constructor after the name. the name of this server is always 'api'
+    :param client_config: the configuration handed to clients, defaults to the configured client config
+    :param snapshot_publisher: a callable that gets (snapshot, user=id) and encodes and publishes it.
+                               defaults to encoding it with message_encoder and publishing it on the snapshot topic
     :param flask_kwargs: kwargs to pass to the Flask constructor
     :return: the server to be 'run'
     """
 
     ThoughtAPI = Flask(server_name, *flask_args, **flask_kwargs)
+    ThoughtAPI.config['MAX_CONTENT_LENGTH'] = configuration.get_config()[configuration.CONFIG_SERVER_MAX_BODY_SIZE]
     publish_func = publisher if callable(publisher) else publisher.publish
+    publish_snapshot = get_snapshot_publisher(publish_func, message_encoder, snapshot_publisher)
+
+    def snapshot_data():
+        try:
+            return decode_body(request.get_data(), request.headers.get('Content-Encoding'))
+        except (compression.UnsupportedEncoding, compression.TooLarge):
+            raise
+        except Exception as e:
+            abort(400, f"Could not decode body: {e}")
+
+    @ThoughtAPI.errorhandler(compression.UnsupportedEncoding)
+    def unsupported_encoding(e):
+        return str(e), 415
+
+    @ThoughtAPI.errorhandler(compression.TooLarge)
+    def too_large(e):
+        return str(e), 413
+
+    @ThoughtAPI.errorhandler(PublisherFull)
+    def publisher_full(e):
+        # the publisher is behind, the client should hold on to its snapshots and send them again
+        return f"Busy, try again later: {e}", 503, {'Retry-After': '1'}
+
     @ThoughtAPI.route("/user/<id>", methods=["POST"])
     def handle_new_thought(id):
         """
@@ -39,22 +109,36 @@ def get_server(publisher, message_encoder, server_name="cortex_api", *flask_args
         :param id: the id from the url
         :return: empty string. this happens whether the backend manages to save the thought or not.
         """
-        message = message_encoder(request.data, user=id)
-        publish_func(configuration.topics.snapshot, message)
+        publish_snapshot(snapshot_data(), user=id)
+        return 'OK'
+
+    @ThoughtAPI.route("/user/<id>/batch", methods=["POST"])
+    def handle_thought_batch(id):
+        """
+        this handles a bundle of thoughts on the user ID (see `snapshot_bundle`).
+        every snapshot in the bundle is published as if it was posted on its own to /user/<id>.
+        the bundle is validated as a whole before anything is published, so a bad bundle publishes nothing.
+        :param id: the id from the url
+        :return: 'OK', or a 400 if the bundle is malformed
+        """
+        try:
+            snapshots = list(snapshot_bundle.unpack(snapshot_data()))
+        except snapshot_bundle.BundleError as e:
+            return f"Bad bundle: {e}", 400
+        for snapshot in snapshots:
+            publish_snapshot(snapshot, user=id)
         return 'OK'
 
     @ThoughtAPI.route("/configuration")
     def get_configuration():
+        if client_config is not None:
+            return client_config
         return configuration.get_config()[configuration.CONFIG_CLIENT_CONFIG]
 
     @ThoughtAPI.route('/users', methods=["POST"])
     def ensure_user():
-        user_info = request.json
-        # parsing here because this is hella simple
-        user_info['id'] = user_info.pop('userId')
-        gender_enum = user_info.get('gender', 0)
-        user_info['gender'] = 'Male' if gender_enum == 0 else 'Female' if gender_enum == 1 else 'Other'
-        publish_func(configuration.get_parsed_data_topic_name(configuration.topics.user_info), json.dumps(user_info))
+        publish_func(configuration.get_parsed_data_topic_name(configuration.topics.user_info),
+                     user_info_message(request.json))
         return 'OK'
 
     return ThoughtAPI
@@ -0,0 +1,44 @@
+"""
+A bundle is a bunch of serialized messages sent together, framed exactly like a sample file:
+    [<message size> <message>]*
+This allows a client to upload many snapshots in a single request instead of paying a round trip per snapshot.
+"""
+from struct import Struct
+
+MESSAGE_SIZE = Struct("I")
+CONTENT_TYPE = 'application/x-cortex-bundle'
+
+
+class BundleError(Exception): pass
+
+
+def pack(messages):
+    """
+    packs the given serialized messages into a single bundle
+    :param messages: an iterable of bytes
+    :return: the bundle bytes
+    """
+    parts = []
+    for message in messages:
+        parts.append(MESSAGE_SIZE.pack(len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+
+def unpack(data):
+    """
+    yields the messages in the bundle one by one, as memoryview slices over the original data (no copying).
+    :param data: the bundle bytes
+    :return: a generator of memoryviews
+    """
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + MESSAGE_SIZE.size > len(view):
+            raise BundleError(f"truncated message size at offset {offset}")
+        size, = MESSAGE_SIZE.unpack_from(view, offset)
+        offset += MESSAGE_SIZE.size
+        if not size or offset + size > len(view):
+            raise BundleError(f"invalid message size {size} at offset {offset - MESSAGE_SIZE.size}")
+        yield view[offset: offset + size]
+        offset += size
@@ -0,0 +1,72 @@
+"""
+Splits snapshots at ingest, so that every parser gets only the part of a snapshot it parses.
+
+A snapshot is cut at the protobuf wire level, without parsing it: every payload is the snapshot's datetime field
+followed by the field its parser reads, which is itself a valid (partial) Snapshot message.
+The payload for a parser is published on its own raw data topic (see `configuration.get_raw_data_topic_name`),
+so the pose parser never receives, let alone decodes, image bytes.
+"""
+from cortex import configuration
+from cortex.core import cortex_pb2
+from cortex.utils import protobuf_wire
+
+SNAPSHOT_FIELDS = cortex_pb2.Snapshot.DESCRIPTOR.fields_by_name
+DATETIME_FIELD = SNAPSHOT_FIELDS['datetime'].number
+
+
+def can_split_for(targets):
+    """
+    :return: True if every target is a snapshot field, so the snapshot can be split for them
+    """
+    return bool(targets) and all(i in SNAPSHOT_FIELDS for i in targets)
+
+
+def split(snapshot, fields):
+    """
+    cuts a serialized snapshot into a payload per field
+    :param snapshot: the serialized snapshot, bytes-like
+    :param fields: a {field number: key} map of the fields to cut out
+    :return: a {key: payload} dict, for the fields that are in the snapshot
+    """
+    snapshot = memoryview(snapshot)
+    head = []
+    parts = {}
+    for number, _, start, _, end in protobuf_wire.iter_fields(snapshot):
+        if number == DATETIME_FIELD:
+            head.append(snapshot[start:end])
+        elif number in fields:
+            parts.setdefault(fields[number], []).append(snapshot[start:end])
+    return {key: b''.join(head + value) for key, value in parts.items()}
+
+
+class SnapshotFanOut:
+    def __init__(self, publish, message_encoder, targets, release=None):
+        """
+        :param publish: publishes a (topic, message)
+        :param message_encoder: encodes a payload into a raw message, like `snapshot_xcoder.snapshot_encoder`
+        :param targets: the parser targets to split snapshots for, all snapshot field names
+        :param release: called with (message, the other targets) after publishing a message to a single target,
+                        so a store that waits for every target to be done with a message doesn't wait for ever
+        """
+        if not can_split_for(targets):
+            raise ValueError(f"can't split snapshots for {targets}, they are not all snapshot fields")
+        self.publish = publish
+        self.message_encoder = message_encoder
+        self.targets = list(targets)
+        self.release = release
+        self._fields = {SNAPSHOT_FIELDS[i].number: i for i in self.targets}
+
+    def __call__(self, snapshot, **kwargs):
+        """
+        splits the snapshot and publishes a payload to every target whose field is in it
+        :param snapshot: the serialized snapshot
+        :param kwargs: the message's other fields, e.g the user
+        """
+        parts = split(snapshot, self._fields)
+        # the targets that get a part are the ones the snapshot is complete with, see `saver.aggregator`
+        kwargs[configuration.MESSAGE_TARGETS_KEY] = sorted(parts)
+        for target, payload in parts.items():
+            message = self.message_encoder(payload, **kwargs)
+            self.publish(configuration.get_raw_data_topic_name(target), message)
+            if self.release:
+                self.release(message, [i for i in self.targets if i != target])
@@ -1,12 +1,40 @@
+"""
+Raw snapshot messages come in two forms:
+ - a json object with the message's fields, where 'snapshot' is the uri of a MessageRecord holding the snapshot.
+ - for snapshots smaller than the inline threshold, an envelope that carries the snapshot itself:
+       MAGIC <header size> <header: json of the other fields> <snapshot bytes>
+`snapshot_decoder` tells them apart by the magic, which can't start a json document.
+"""
 from json import loads, dumps
+from struct import Struct
 
+from cortex import configuration
 from cortex.utils.filesystem import MessageRecord
 from cortex.utils.logging import log_exception, get_module_logger
 
 logger = get_module_logger(__file__)
 
+INLINE_MAGIC = b'\x00CXS'
+INLINE_HEADER_SIZE = Struct("I")
+
+
+def _encode_inline(snapshot, fields):
+    header = dumps(fields).encode()
+    return b''.join([INLINE_MAGIC, INLINE_HEADER_SIZE.pack(len(header)), header, snapshot])
+
+
+def _decode_inline(message):
+    message = memoryview(message)
+    start = len(INLINE_MAGIC) + INLINE_HEADER_SIZE.size
+    header_size, = INLINE_HEADER_SIZE.unpack_from(message, len(INLINE_MAGIC))
+    d = loads(bytes(message[start: start + header_size]))
+    d['snapshot'] = bytes(message[start + header_size:])
+    return d
+
 
 def snapshot_encoder(snapshot, **kwargs):
+    if len(snapshot) < configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_INLINE_THRESHOLD]:
+        return _encode_inline(snapshot, kwargs)
     with MessageRecord.create() as mr:
         mr.write(snapshot)
     to_encode = {k: v for k, v in kwargs.items()}
@@ -15,12 +43,39 @@ def snapshot_encoder(snapshot, **kwargs):
 
 
 def snapshot_decoder(message_string):
+    if isinstance(message_string, (bytes, bytearray, memoryview)) and message_string[:len(INLINE_MAGIC)] == INLINE_MAGIC:
+        return _decode_inline(message_string)
     d = loads(message_string)
-    with log_exception(logger, to_suppress=(FileNotFoundError, KeyError, ),
+    with log_exception(logger, to_suppress=(FileNotFoundError, KeyError, ValueError),
                        format=lambda x: f"Could not read MessageRecord: {repr(x)}, parsed_message: {d}"):
         with MessageRecord.open(d['snapshot']) as mr:
-            d['snapshot'] = mr.read()
+            d['snapshot_uri'], d['snapshot'] = d['snapshot'], mr.read()
             return d
 
     return None
 
+
+
+def snapshot_acknowledger(consumer, message):
+    """
+    tells the raw message store that the consumer is done with the message's snapshot
+    :param consumer: name of the consumer, e.g the parser's target
+    :param message: a message decoded by `snapshot_decoder`
+    """
+    if message and message.get('snapshot_uri'):
+        with log_exception(logger, to_suppress=(Exception,),
+                           format=lambda x: f"Could not acknowledge {message['snapshot_uri']}: {x!r}"):
+            MessageRecord.acknowledge(message['snapshot_uri'], consumer)
+
+
+def snapshot_releaser(message, consumers):
+    """
+    acknowledges an encoded message's snapshot on behalf of consumers that will never see it
+    :param message: a message made by `snapshot_encoder`
+    :param consumers: names of the consumers
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)) and message[:len(INLINE_MAGIC)] == INLINE_MAGIC:
+        return
+    uri = loads(message)['snapshot']
+    for consumer in consumers:
+        MessageRecord.acknowledge(uri, consumer)
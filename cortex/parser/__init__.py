@@ -7,11 +7,13 @@ import click
 import urlpath
 
 
+from cortex import configuration
 from cortex.parser import repository
 from cortex.utils import logging,\
-                            dispatchers
+                            dispatchers, supervisor
 
 from cortex.core import snapshot_xcoder
+from cortex.utils.filesystem import MessageRecord
 from cortex.utils.plugin_runner import PluginRunner
 
 module_logger = logging.get_logger(__file__)
@@ -39,18 +41,71 @@ def run_parser(name, url, blocking=True):
 
     with logging.log_exception(module_logger, to_suppress=(RuntimeError, Exception),
                                format=lambda x: f"Error running parser {name}: {x}"):
-        runner = PluginRunner(repository.Repository.get(), snapshot_xcoder.snapshot_decoder, json.dumps)
-        runner.run_with_uri(name, uri=url)
+        parser = repository.Repository.get().get_handler(name)
+        if parser:
+            # the raw message store keeps snapshots until every registered parser acknowledged them
+            MessageRecord.register_consumer(parser.target)
+        runner = PluginRunner(repository.Repository.get(), snapshot_xcoder.snapshot_decoder, json.dumps,
+                              on_handled=snapshot_xcoder.snapshot_acknowledger)
+        runner.run_with_uri(name, uri=url, blocking=blocking)
+
+def run_parser_replicas(name, url, replicas):
+    """
+    runs the parser in `replicas` supervised worker processes. they compete over the parser's work queue,
+    so each message is still parsed once.
+    """
+    sup = supervisor.Supervisor()
+    sup.add(f"parser-{name}", run_parser, args=(name, url), replicas=replicas)
+    sup.run()
 
 @cli.command('run-parser')
+@click.option('--replicas', '-n', type=click.IntRange(min=1), default=1,
+              help="worker processes sharing the parser's work")
 @click.argument('name')
 @click.argument('url', type=urlpath.URL)
-def _run_parser(name, url):
-    run_parser(name, url)
+def _run_parser(replicas, name, url):
+    if replicas > 1:
+        run_parser_replicas(name, url, replicas)
+    else:
+        run_parser(name, url)
+
+def _parse_replicas(ctx, param, value):
+    out = {}
+    for i in value:
+        name, _, count = i.partition('=')
+        if not count.isdigit():
+            raise click.BadParameter(f"expected <parser>=<count>, got {i}")
+        out[name] = int(count)
+    return out
+
+
+def run_all_parsers_in_processes(url, replicas=None):
+    """
+    runs every parser in worker processes under a supervisor, which restarts workers that exit
+    :param url: the consumer/dispatcher url
+    :param replicas: parser target -> number of worker processes, defaults to the configuration. missing ones get 1
+    """
+    replicas = dict(configuration.get_config()[configuration.CONFIG_PARSER_REPLICAS], **(replicas or {}))
+    sup = supervisor.Supervisor()
+    for parser in repository.Repository.get().handlers():
+        sup.add(f"parser-{parser.target}", run_parser, args=(parser.target, url),
+                replicas=replicas.get(parser.target, 1))
+    module_logger.info(f"supervising {len(sup.workers)} parser workers")
+    sup.run()
+
 
 @cli.command('start-all')
+@click.option('--processes/--threads', default=None,
+              help="run every parser in its own worker processes, or all of them on threads of this one")
+@click.option('--replicas', '-n', multiple=True, callback=_parse_replicas,
+              help="<parser>=<count>: worker processes for a parser, may be repeated")
 @click.argument('url', type=urlpath.URL)
-def _run_all_parsers(url):
+def _run_all_parsers(processes, replicas, url):
+    if processes is None:
+        processes = configuration.get_config()[configuration.CONFIG_PARSER_START_MODE] == 'processes'
+    if processes:
+        run_all_parsers_in_processes(url, replicas)
+        return
     repo = repository.Repository.get()
     waiting = []
     for parser in repo.handlers():
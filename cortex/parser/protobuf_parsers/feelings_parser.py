@@ -7,7 +7,8 @@ from . import  parser_decorators as decos
 
 @decos.with_protobuf_snapshot(cortex_pb2.Snapshot,
                               user_key='user',
-                              user_type=int)
+                              user_type=int,
+                              fields=('datetime', 'feelings'))
 def parse_feelings(user, snapshot, rest):
     out = {'user': user, 'timestamp': snapshot.datetime,
            'result': {'feelings': MessageToDict(snapshot.feelings)}}
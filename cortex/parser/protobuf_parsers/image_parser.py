@@ -7,7 +7,8 @@ from cortex.utils.filesystem import user_storage
 
 @decos.with_protobuf_snapshot(cortex_pb2.Snapshot,
                               user_key='user',
-                              user_type=int)
+                              user_type=int,
+                              fields=('datetime', 'color_image'))
 def parse_color_image(user, snapshot, rest):
     ci = snapshot.color_image
     im = images.ColorImage.from_bytes(ci.width, ci.height, ci.data)
@@ -19,7 +20,8 @@ def parse_color_image(user, snapshot, rest):
 
 @decos.with_protobuf_snapshot(cortex_pb2.Snapshot,
                               user_key='user',
-                              user_type=int)
+                              user_type=int,
+                              fields=('datetime', 'depth_image'))
 def parse_depth_image(user, snapshot, rest):
     di = snapshot.depth_image
     im = images.DepthImage.from_bytes(di.width, di.height, list(di.data))
@@ -1,14 +1,27 @@
 import functools
 
+from cortex.utils import protobuf_wire
+
+
+def with_protobuf_snapshot(pb_type, snapshot_key=None, user_key=None, user_type=int, fields=None):
+    """
+    parses the message's snapshot into a pb_type and calls the parser with (user, snapshot, message)
+    :param fields: names of the only fields the parser reads. the rest are skipped on the wire and never decoded,
+                   so a parser that declares ('datetime', 'pose') doesn't pay for the images. None decodes everything
+    """
+    field_numbers = frozenset(pb_type.DESCRIPTOR.fields_by_name[i].number for i in fields) if fields else None
 
-def with_protobuf_snapshot(pb_type, snapshot_key=None, user_key=None, user_type=int):
     def decorator(f):
         @functools.wraps(f)
         def wrapper(data, *args, **kwargs):
             container = pb_type()
-            pb_type.ParseFromString(container, data[snapshot_key or 'snapshot'])
+            snapshot = data[snapshot_key or 'snapshot']
+            if field_numbers:
+                snapshot = protobuf_wire.select_fields(snapshot, field_numbers)
+            pb_type.ParseFromString(container, snapshot)
             user = user_type(data[user_key or 'user'])
             return f(user, container, data, *args, **kwargs)
+        wrapper.fields = tuple(fields) if fields else None
         return wrapper
     return decorator
 
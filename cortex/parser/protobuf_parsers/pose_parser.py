@@ -7,7 +7,8 @@ from . import  parser_decorators as decos
 
 @decos.with_protobuf_snapshot(cortex_pb2.Snapshot,
                               user_key='user',
-                              user_type=int)
+                              user_type=int,
+                              fields=('datetime', 'pose'))
 def parse_pose(user,
                snapshot, rest):
     out = {'user': user, 'timestamp': snapshot.datetime, 'result': {'pose': MessageToDict(snapshot.pose)}}
@@ -0,0 +1,148 @@
+"""
+Merges the parsed fields of a snapshot before they are saved, so a snapshot is written once and not once per parser.
+
+Every parser's result for a snapshot reaches the savers on its own. `SnapshotAggregator` stands in for the database
+the savers get, and holds a snapshot's updates until every expected parser target reported, then writes the merged
+document with a single `update_snapshot`. The expected targets are the ones the ingest server split the snapshot for,
+which the parsed results carry (see `configuration.MESSAGE_TARGETS_KEY`); a result that doesn't carry them is expected
+with the aggregator's own targets. A snapshot that some target never reports for (its parser is down) is written with
+what it has after `timeout` seconds, and counted as incomplete.
+The messages of a snapshot are acknowledged once its merged document was written, through the database it writes to
+if that writes behind (see `write_behind.py`). that takes manual ack mode, the saver only merges with it on.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+from cortex import configuration
+from cortex.utils import logging
+from cortex.utils.dispatchers import acknowledgement
+
+module_logger = logging.get_module_logger(__file__)
+
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def expecting(targets):
+    """
+    used around a saver call: the targets the snapshot being saved is complete with, None if unknown
+    """
+    outer, _current.targets = getattr(_current, 'targets', None), targets
+    try:
+        yield
+    finally:
+        _current.targets = outer
+
+
+class _Pending:
+    def __init__(self, targets):
+        self.targets = targets
+        self.data = {}
+        self.acks = []
+        self.since = time.monotonic()
+
+    def settle(self, ok=True):
+        for settle in self.acks:
+            settle(ok)
+
+
+class SnapshotAggregator:
+    def __init__(self, db, targets, timeout=None):
+        """
+        :param db: the database to write the merged snapshots to
+        :param targets: the parser targets a snapshot is complete with, the keys of their results, when the results
+                        don't tell
+        :param timeout: seconds to wait for a snapshot's missing targets before writing it without them
+        """
+        self.db = db
+        self.targets = frozenset(targets)
+        self.timeout = configuration.get_config()[configuration.CONFIG_SAVER_MERGE_TIMEOUT] if timeout is None \
+            else timeout
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def update_snapshot(self, user, timestamp, data):
+        key = int(user), int(timestamp)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                targets = getattr(_current, 'targets', None)
+                pending = self._pending[key] = _Pending(frozenset(targets) if targets else self.targets)
+            pending.data.update(data)
+            settle = acknowledgement.defer()
+            if settle:
+                pending.acks.append(settle)
+            if not pending.targets.issubset(pending.data):
+                return
+            del self._pending[key]
+        self._write(key, pending, complete=True)
+
+    def _write(self, key, pending, complete):
+        with acknowledgement.handling(pending.settle) as delivery:
+            try:
+                self.db.update_snapshot(*key, pending.data)
+            except Exception as e:
+                module_logger.exception(f"failed writing snapshot {key}: {e!r}")
+                if not delivery.deferred:
+                    pending.settle(False)
+                return
+        if not delivery.deferred:
+            pending.settle(True)
+        self.stats['merged' if complete else 'incomplete'] += 1
+        self.stats['merge_latency'] += time.monotonic() - pending.since
+
+    @property
+    def merge_latency(self):
+        """
+        :return: the mean seconds between a snapshot's first update and its write
+        """
+        written = self.stats['merged'] + self.stats['incomplete']
+        return self.stats['merge_latency'] / written if written else 0
+
+    def expire(self, everything=False):
+        """
+        writes the snapshots that waited longer than the timeout for their missing targets
+        :param everything: write every held snapshot, however long it waited
+        :return: how many snapshots were written
+        """
+        deadline = time.monotonic() - self.timeout
+        with self._lock:
+            expired = [i for i, pending in self._pending.items() if everything or pending.since <= deadline]
+            expired = [(i, self._pending.pop(i)) for i in expired]
+        for key, pending in expired:
+            module_logger.debug(f"snapshot {key} is missing {sorted(pending.targets - set(pending.data))}, writing it")
+            self._write(key, pending, complete=False)
+        return len(expired)
+
+    def __getattr__(self, item):
+        # everything but snapshot updates goes straight to the database
+        return getattr(self.db, item)
+
+    def _run(self):
+        while not self._stopped.wait(self.timeout / 2):
+            self.expire()
+
+    def start(self):
+        """ expires snapshots on a background thread, and starts the database if it has anything to start """
+        start = getattr(self.db, 'start', None)
+        if start:
+            start()
+        self._thread = threading.Thread(target=self._run, name='cortex_snapshot_aggregator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ writes every held snapshot, then stops the database if it has anything to stop """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.expire(everything=True)
+        module_logger.info(f"snapshots merged: {self.stats['merged']}, incomplete: {self.stats['incomplete']}, "
+                           f"mean merge latency: {self.merge_latency:.3f}s")
+        stop = getattr(self.db, 'stop', None)
+        if stop:
+            stop()
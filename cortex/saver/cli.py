@@ -6,10 +6,10 @@ import click
 import urlpath
 from contextlib import suppress
 
-from . import repository, db_dispatcher
+from . import aggregator, repository, db_dispatcher, write_behind
 from cortex import configuration
+from cortex.core import snapshot_fanout
 from cortex.utils import logging, dispatchers, databases
-from cortex.utils.plugin_runner import PluginRunner
 
 module_logger = logging.get_logger(__file__)
 
@@ -46,27 +46,38 @@ def _run_saver(db, message_queue):
         return -1
 
     database = _get_db_or_die(db)
+    config = configuration.get_config()
+    manual_ack = config[configuration.CONFIG_CONSUMER_MANUAL_ACK]
+    batch_size = config[configuration.CONFIG_SAVER_BATCH_SIZE]
+    if batch_size is None:
+        batch_size = write_behind.BATCH_SIZE if manual_ack else 1
+    if batch_size > 1:
+        if manual_ack:
+            database = write_behind.WriteBehindDB(database, batch_size)
+        else:
+            # messages are acked on delivery, holding their updates back would lose them on a crash
+            module_logger.warning("saver batches need consumer_manual_ack, writing every update as it comes")
 
     saver_repo = repository.Repository.get()
-    tees = []
+    if config[configuration.CONFIG_SAVER_MERGE_TIMEOUT]:
+        if manual_ack:
+            # results that don't say which targets their snapshot was split for wait for every saver of a field
+            targets = [i.target for i in saver_repo.handlers() if i.target in snapshot_fanout.SNAPSHOT_FIELDS]
+            database = aggregator.SnapshotAggregator(database, targets)
+        else:
+            module_logger.warning("merging snapshots needs consumer_manual_ack, saving every result as it comes")
+    # a single consumer channel and thread for all the savers, however many there are
+    router = dispatchers.topic_router.get_topic_router(message_queue, 'savers')
+    dispatcher = db_dispatcher.DBDispatcher(database)
     for saver in saver_repo.handlers():
-        # TODO: consider creating a single consumer for all save topics that can route to correct saver.
-        with logging.log_exception(module_logger, to_suppress=(RuntimeError, Exception),
-                                   format=lambda x: f"Error running saver service {db}: {x}"):
-            consumer = dispatchers.get_topic_consumer(
-                configuration.get_parsed_data_topic_name(saver.target),
-                message_queue
-            )
-
-            tee = dispatchers.tee.Tee(consumer, db_dispatcher.DBDispatcher(database))
-            runner = PluginRunner(repository.Repository.get(), json.loads, json.dumps)
-            runner.run_with_tee(saver.target, tee)
-            tees.append(tee)
+        router.route(configuration.get_parsed_data_topic_name(saver.target), dispatcher.result_publisher(saver.handler))
+    with logging.log_exception(module_logger, to_suppress=(RuntimeError, Exception),
+                               format=lambda x: f"Error running saver service {db}: {x}"):
+        dispatcher.start()
+        router.start(message_decoder=json.loads)
     with suppress(KeyboardInterrupt):
-        while True:
+        while router.running:
             time.sleep(1)
-    module_logger.info("Stopping all tees...")
-    for tee in tees:
-        tee.stop()
-
-
+    module_logger.info("Stopping savers...")
+    router.stop()
+    dispatcher.stop()
@@ -1,6 +1,9 @@
 """
 this is a mock dispatcher, it does nothing, just implements whatever tee needs it to implement
 """
+from cortex import configuration
+from . import aggregator
+
 class DBDispatcher:
     """
     this is a dispatcher that matches the api of parsers. it's mostly empty
@@ -9,10 +12,15 @@ class DBDispatcher:
         self.db = db
 
     def start(self):
-        pass
+        # a database that writes behind (see write_behind.py) flushes on its own thread
+        start = getattr(self.db, 'start', None)
+        if start:
+            start()
 
     def stop(self):
-        pass
+        stop = getattr(self.db, 'stop', None)
+        if stop:
+            stop()
 
     def result_publisher(self, f, message_encoder=None):
         """
@@ -21,7 +29,11 @@ class DBDispatcher:
         :param message_encoder:
         :return:
         """
-        return lambda *args, **kwargs: f(self.db, *args, **kwargs)
+        def publish(message, *args, **kwargs):
+            targets = message.get(configuration.MESSAGE_TARGETS_KEY) if isinstance(message, dict) else None
+            with aggregator.expecting(targets):
+                return f(self.db, message, *args, **kwargs)
+        return publish
 
     @property
     def running(self):
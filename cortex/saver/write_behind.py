@@ -0,0 +1,87 @@
+"""
+Holds the savers' snapshot updates back and writes them to the database in batches.
+
+Every parsed field of a snapshot used to be written on its own, a round trip per field. `WriteBehindDB` stands in for
+the database the savers get: it merges the updates of a snapshot, and writes all the snapshots it holds with one
+`update_snapshots` (a bulk write) once it holds `batch_size` of them, or `delay` seconds passed.
+The messages the updates came in are acknowledged only after the write that holds them (see `acknowledgement.defer`),
+so a crash loses nothing that was acked. that takes manual ack mode: the saver only writes behind with it on.
+A consumer holds at most its prefetch count of unacked messages, so a batch never holds more than that.
+"""
+import threading
+
+from cortex import configuration
+from cortex.utils import logging
+from cortex.utils.dispatchers import acknowledgement
+
+module_logger = logging.get_module_logger(__file__)
+
+BATCH_SIZE = 16  # when the configuration doesn't say
+
+
+class WriteBehindDB:
+    def __init__(self, db, batch_size=None, delay=None):
+        """
+        :param db: the database to write to, has `update_snapshots`
+        :param batch_size: snapshots to hold before writing them, at most the consumer prefetch count
+        :param delay: most seconds an update is held
+        """
+        config = configuration.get_config()
+        self.db = db
+        # a bigger batch never fills up, the consumer stops delivering once it holds prefetch unacked messages
+        self.batch_size = min(batch_size or config[configuration.CONFIG_SAVER_BATCH_SIZE] or BATCH_SIZE,
+                              config[configuration.CONFIG_CONSUMER_PREFETCH])
+        self.delay = config[configuration.CONFIG_SAVER_BATCH_DELAY] if delay is None else delay
+        self._lock = threading.Lock()
+        self._updates = {}
+        self._acks = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def update_snapshot(self, user, timestamp, data):
+        with self._lock:
+            self._updates.setdefault((int(user), int(timestamp)), {}).update(data)
+            settle = acknowledgement.defer()
+            if settle:
+                self._acks.append(settle)
+            full = len(self._updates) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        writes the held updates, then settles the messages they came in
+        :return: how many snapshots were written
+        """
+        with self._lock:
+            updates, self._updates = self._updates, {}
+            acks, self._acks = self._acks, []
+        ok = True
+        try:
+            self.db.update_snapshots(updates)
+        except Exception as e:
+            module_logger.exception(f"failed writing {len(updates)} snapshots: {e!r}")
+            ok = False
+        for settle in acks:
+            settle(ok)
+        return len(updates) if ok else 0
+
+    def __getattr__(self, item):
+        # everything but snapshot updates goes straight to the database
+        return getattr(self.db, item)
+
+    def _run(self):
+        while not self._stopped.wait(self.delay):
+            self.flush()
+
+    def start(self):
+        """ flushes every `delay` seconds on a background thread """
+        self._thread = threading.Thread(target=self._run, name='cortex_write_behind', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ stops the background thread and writes whatever is held """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
@@ -11,12 +11,33 @@ def cli():
 @cli.command("run-server")
 @click.option("--host", "-h")
 @click.option("--port", "-p", type=int)
+@click.option("--mode", "-m", type=click.Choice(['flask', 'async', 'prefork']),
+              help="flask is the simple threaded server, async serves many concurrent clients, "
+                   "prefork runs the flask server in several worker processes")
+@click.option("--workers", "-w", type=int, help="worker processes in prefork mode")
+@click.option("--backlog", type=int, help="listen backlog in prefork mode")
+@click.option("--timeout", type=int, help="seconds before a stuck worker is restarted in prefork mode")
 @click.argument('publish_url')
-def run_server_cli(host, port, publish_url):
+def run_server_cli(host, port, mode, workers, backlog, timeout, publish_url):
     with logging.log_exception(logging.get_module_logger(__file__), to_suppress=(Exception,)):
-        server.run_server_with_url(host or "127.0.0.1", port or 8080, publish_url)
+        server.run_server_with_url(host or "127.0.0.1", port or 8080, publish_url, mode=mode,
+                                   workers=workers, backlog=backlog, timeout=timeout)
 
 
+@cli.command("compact-segments")
+@click.option("--retention", type=int, help="seconds to keep a consumed segment after it was sealed")
+def compact_segments_cli(retention):
+    with logging.log_exception(logging.get_module_logger(__file__), to_suppress=(Exception,)):
+        click.echo(f"reclaimed {server.compact_segments(retention)} bytes")
+
+
+@cli.command("forget-consumer")
+@click.argument("name")
+def forget_consumer_cli(name):
+    """ stop keeping raw messages for a retired parser """
+    from cortex.utils.filesystem import MessageRecord
+    MessageRecord.forget_consumer(name)
+
 
 if __name__ == "__main__":
     cli()
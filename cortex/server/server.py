@@ -11,18 +11,110 @@ More and more parsers will see more and more messages as parsing takes place.
 import threading
 
 from cortex import configuration
-from cortex.utils import logging, dispatchers
-from cortex.core import cortex_rest_server
+from cortex.utils import logging, dispatchers, compression
+from cortex.core import cortex_rest_server, snapshot_fanout
 
 module_logger = logging.get_module_logger(__file__)
 
+def get_client_config():
+    """
+    the configuration handed to clients.
+    unless the snapshot fields are configured explicitly, clients are told to send only the fields that the deployed
+    parsers consume. if any parser is not named after a snapshot field it might need anything, so nothing is dropped.
+    clients are also told which content encodings this server can decode.
+    :return: the client config dict
+    """
+    out = dict(configuration.get_config()[configuration.CONFIG_CLIENT_CONFIG])
+    out.setdefault(configuration.CLIENT_CONFIG_CONTENT_ENCODINGS, compression.available())
+    if configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS not in out:
+        targets = raw_message_consumers()
+        if snapshot_fanout.can_split_for(targets):
+            out[configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS] = targets
+    return out
+
+
+def raw_message_consumers():
+    """
+    :return: names of the parser targets this server knows, the consumers it splits snapshots for
+    """
+    from cortex.parser import repository as parser_repository
+    return sorted({parser.target for parser in parser_repository.Repository.get().handlers()})
+
+
+def deployed_consumers():
+    """
+    :return: names of the consumers that must be done with a raw message before it can be reclaimed - the parsers
+             that registered with the raw message repo when they started. before any did, the parsers this
+             server knows
+    """
+    from cortex.utils.filesystem import MessageRecord
+    return MessageRecord.registered_consumers() or raw_message_consumers()
+
+
+def compact_segments(retention=None):
+    """
+    deletes the raw message segments that every parser is done with
+    :param retention: seconds to keep a segment after it was sealed, defaults to the configuration
+    :return: the number of bytes reclaimed
+    """
+    from cortex.utils.filesystem.segment_log import SegmentLog
+    reclaimed = SegmentLog.get().compact(deployed_consumers(), retention=retention)
+    module_logger.info(f"compacted segments, reclaimed {reclaimed} bytes")
+    return reclaimed
+
+
+def start_reaper():
+    """
+    starts reclaiming consumed raw messages in the background, unless the reaper interval is configured to 0
+    :return: the RecordReaper, or None
+    """
+    if not configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_REAPER_INTERVAL]:
+        return None
+    from cortex.utils.filesystem.reaper import RecordReaper
+    reaper = RecordReaper(deployed_consumers)
+    reaper.start()
+    module_logger.info(f"started raw message reaper, every {reaper.interval} seconds")
+    return reaper
+
+
+def get_snapshot_publisher(publish, encoder):
+    """
+    splits snapshots per parser when configured to, and when every parser is named after a snapshot field
+    :return: a `snapshot_fanout.SnapshotFanOut`, or None to publish whole snapshots
+    """
+    targets = raw_message_consumers()
+    if not (configuration.get_config()[configuration.CONFIG_SERVER_FAN_OUT] and snapshot_fanout.can_split_for(targets)):
+        return None
+    from cortex.core import snapshot_xcoder
+    publish = publish if callable(publish) else publish.publish
+    return snapshot_fanout.SnapshotFanOut(publish, encoder or configuration.raw_message_encoder(), targets,
+                                          release=snapshot_xcoder.snapshot_releaser)
+
+
 def get_server(publish, encoder):
     return cortex_rest_server.get_server(publish,
-                                         message_encoder=encoder or configuration.raw_message_encoder())
+                                         message_encoder=encoder or configuration.raw_message_encoder(),
+                                         client_config=get_client_config(),
+                                         snapshot_publisher=get_snapshot_publisher(publish, encoder))
 
-def _run_server(host, port, publish, encoder=None, run_threaded=False):
+def get_async_server(publish, encoder):
+    # aiohttp is only needed in async mode
+    from cortex.core import cortex_async_server
+    return cortex_async_server.AsyncServer(
+        cortex_async_server.get_server(publish,
+                                       message_encoder=encoder or configuration.raw_message_encoder(),
+                                       client_config=get_client_config(),
+                                       snapshot_publisher=get_snapshot_publisher(publish, encoder)))
+
+def _run_server(host, port, publish, encoder=None, run_threaded=False, mode=None):
+    """
+    :param mode: 'flask' for the Flask server, 'async' for the asyncio one. defaults to the configured mode
+    """
     module_logger.debug("getting server...")
-    server = get_server(publish, encoder)
+    mode = mode or configuration.get_config()[configuration.CONFIG_SERVER_MODE]
+    if mode not in ('flask', 'async'):
+        raise ValueError(f"unknown server mode {mode!r}, expected 'flask' or 'async'")
+    server = get_server(publish, encoder) if mode == 'flask' else get_async_server(publish, encoder)
     server_args = dict(host=host, port=port)
     if run_threaded:
         t = threading.Thread(name=configuration.get_config()[configuration.CONFIG_SERVER_THREAD_NAME],
@@ -34,15 +126,47 @@ def _run_server(host, port, publish, encoder=None, run_threaded=False):
         module_logger.info(f"starting {server} on {host}:{port} ...")
         server.run(**server_args)
 
-def run_server_with_url(host, port, publish_url, run_threaded=False, encoder=None):
+def _get_publisher(publish_url):
     publisher = None
+    config = configuration.get_config()
     with logging.log_exception(logger=module_logger, format="Could not find publisher"):
-        publisher = dispatchers.repository.DispatcherRepository.get_repo().get_dispatcher(publish_url,
-                                                                                          configuration.get_config()[
-                                                                                              configuration.CONFIG_SERVER_PUBLISH_TOPICS])
+        # the ingest servers answer a full buffer with a 503, so only they publish through one
+        publisher = dispatchers.repository.DispatcherRepository.get_repo().get_dispatcher(
+            publish_url, config[configuration.CONFIG_SERVER_PUBLISH_TOPICS],
+            buffer_size=config[configuration.CONFIG_PUBLISHER_BUFFER_SIZE],
+            confirm=config[configuration.CONFIG_PUBLISHER_CONFIRMS])
 
 
     module_logger.info(f"got publisher {publisher}")
+    return publisher
+
+def _run_prefork_server(host, port, publish_url, encoder=None, **prefork_options):
+    """
+    runs the Flask server in pre-forked gunicorn workers. every worker connects its own publisher after the fork.
+    :param prefork_options: workers, backlog, timeout, graceful_timeout (see `cortex.utils.prefork`)
+    """
+    from cortex.utils import prefork
+    module_logger.info(f"starting pre-forked servers on {host}:{port} ...")
+    prefork.serve(lambda: get_server(_get_publisher(publish_url), encoder), host, port, **prefork_options)
+
+def run_server_with_url(host, port, publish_url, run_threaded=False, encoder=None, mode=None, **prefork_options):
+    """
+    :param mode: 'flask', 'async' or 'prefork'. defaults to the configured mode
+    :param prefork_options: passed to the pre-fork server in prefork mode
+    """
+    mode = mode or configuration.get_config()[configuration.CONFIG_SERVER_MODE]
+    if mode not in ('flask', 'async', 'prefork'):
+        raise ValueError(f"unknown server mode {mode!r}, expected 'flask', 'async' or 'prefork'")
+    with logging.log_exception(logger=module_logger, to_suppress=(Exception,),
+                               format="Could not start raw message reaper"):
+        start_reaper()
+    if mode == 'prefork':
+        if run_threaded:
+            raise ValueError("the prefork server manages its own processes, it can't run on a thread")
+        with logging.log_exception(logger=module_logger, to_suppress=(Exception,)):
+            _run_prefork_server(host, port, publish_url, encoder=encoder, **prefork_options)
+        return
 
+    publisher = _get_publisher(publish_url)
     with logging.log_exception(logger=module_logger, to_suppress=(Exception,)):
-        _run_server(host, port, publisher)
\ No newline at end of file
+        _run_server(host, port, publisher, encoder=encoder, run_threaded=run_threaded, mode=mode)
\ No newline at end of file
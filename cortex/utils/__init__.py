@@ -12,7 +12,11 @@ from . import logging
 
 
 def read_all(stream, size):
-    message_parts = []
+    part = stream.read(size)
+    if len(part) == size:  # the common case, no need to copy the data again by joining it
+        return part
+    message_parts = [part]
+    size -= len(part)
     while size:
         part = stream.read(size)
         size -= len(part)
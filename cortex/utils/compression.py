@@ -0,0 +1,153 @@
+"""
+Codecs for compressing data on the wire, named as they appear in an HTTP Content-Encoding header.
+gzip is always there. zstd and lz4 are faster, and are used only if their packages are installed.
+
+Decompressors take the most bytes they may output, so a small body that inflates into gigabytes (a compression bomb)
+stops at the limit instead of taking the server's memory.
+Data that is made of several members (frames) decompresses to all of them, and data that was cut short raises.
+"""
+import gzip
+import zlib
+
+CHUNK = 1 << 20
+
+
+def _read_limited(read, max_size):
+    """
+    reads chunks from read(size) until it runs out or more than max_size bytes were read.
+    a chunk at a time, since decompressors allocate the whole size they are asked for up front
+    """
+    out = bytearray()
+    while len(out) <= max_size:
+        chunk = read(min(CHUNK, max_size + 1 - len(out)))
+        if not chunk:
+            break
+        out += chunk
+    return bytes(out)
+
+
+def _members(new_decompressor, decompress, data):
+    """
+    makes read(size) for `_read_limited` out of a decompressor, that goes on to the next member (frame) when one ends,
+    like gzip.decompress does, and raises `Truncated` if the data runs out in the middle of one.
+    :param new_decompressor: makes a decompressor for one member, which has eof and unused_data
+    :param decompress: lambda decompressor, data, size -> (output, the data it is yet to be given).
+                       what it was given past the end of the member is in the decompressor's unused_data
+    :param data: the compressed data
+    """
+    state = [new_decompressor(), data]
+
+    def read(size):
+        while True:
+            decompressor, pending = state
+            if decompressor.eof:
+                rest = (decompressor.unused_data or b'') + pending
+                if not rest:
+                    return b''
+                state[:] = [new_decompressor(), rest]
+                continue
+            out, state[1] = decompress(decompressor, pending, size)
+            if out:
+                return out
+            if not pending:
+                raise Truncated("compressed data ended in the middle of a stream")
+    return read
+
+
+def _gunzip(data, max_size):
+    read = _members(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                    lambda decompressor, data, size: (decompressor.decompress(data, size),
+                                                      decompressor.unconsumed_tail),
+                    data)
+    return _read_limited(read, max_size)
+
+
+def _unlz4(data, max_size):
+    # the decompressor keeps what it could not output yet, and gives it on the next call
+    read = _members(lambda: lz4.frame.LZ4FrameDecompressor(),
+                    lambda decompressor, data, size: (decompressor.decompress(data, size), b''),
+                    data)
+    return _read_limited(read, max_size)
+
+
+# zstd decompressors output all that their input decodes to, so they get it a little at a time. an input byte
+# decodes to at most a few tens of KBs, which keeps a step well under a MB past the limit
+ZSTD_INPUT_CHUNK = 16
+
+
+def _unzstd(data, max_size):
+    read = _members(lambda: zstandard.ZstdDecompressor().decompressobj(),
+                    lambda decompressor, data, size: (decompressor.decompress(data[:ZSTD_INPUT_CHUNK]),
+                                                      data[ZSTD_INPUT_CHUNK:]),
+                    data)
+    return _read_limited(read, max_size)
+
+
+CODECS = {'gzip': (lambda data: gzip.compress(data, compresslevel=1), _gunzip)}
+
+try:
+    import zstandard
+    # compressor objects are not thread safe, and they are cheap to make
+    CODECS['zstd'] = (lambda data: zstandard.ZstdCompressor(level=3).compress(data), _unzstd)
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+    CODECS['lz4'] = (lz4.frame.compress, _unlz4)
+except ImportError:
+    pass
+
+PREFERENCE = ('zstd', 'lz4', 'gzip')
+
+
+class UnsupportedEncoding(ValueError): pass
+
+
+class Truncated(ValueError): pass
+
+
+class TooLarge(ValueError):
+    def __init__(self, max_size):
+        super().__init__(f"decompressed data is over {max_size} bytes")
+        self.max_size = max_size
+
+
+def available():
+    """
+    :return: the names of the codecs that can be used here, best first
+    """
+    return [i for i in PREFERENCE if i in CODECS]
+
+
+def negotiate(offered, preference=PREFERENCE):
+    """
+    picks the codec to use with a peer that offered the given codecs
+    :param offered: codec names the peer supports
+    :param preference: codec names we'd like to use, best first
+    :return: the best codec both sides support, None if there isn't one
+    """
+    return next((i for i in preference if i in offered and i in CODECS), None)
+
+
+def _codec(name):
+    if name not in CODECS:
+        raise UnsupportedEncoding(f"unsupported content encoding {name!r}")
+    return CODECS[name]
+
+
+def compress(name, data):
+    return _codec(name)[0](data)
+
+
+def decompress(name, data, max_size=None):
+    """
+    :param max_size: the most bytes the data may decompress to, unlimited if None
+    :raises TooLarge: if the data decompresses to more than max_size bytes
+    :raises Truncated: if the data ends before the compressed stream does
+    """
+    limit = (1 << 62) if max_size is None else max_size
+    out = _codec(name)[1](data, limit)
+    if len(out) > limit:
+        raise TooLarge(limit)
+    return out
@@ -38,6 +38,17 @@ class MongoDB:
         self.snapshots.find_one_and_update({"user": int(user), "timestamp": int(timestamp)}, {"$set": data},
                                            upsert=True)
 
+    def update_snapshots(self, updates):
+        """
+        updates many snapshots in one round trip
+        :param updates: a {(user, timestamp): data} map, every data is set into its snapshot like update_snapshot does
+        """
+        if not updates:
+            return
+        self.snapshots.bulk_write([pymongo.UpdateOne({"user": int(user), "timestamp": int(timestamp)},
+                                                     {"$set": data}, upsert=True)
+                                   for (user, timestamp), data in updates.items()], ordered=False)
+
     @_as_jsonable_list
     def get_snapshots(self, user):
         return self.snapshots.find({"user": int(user)}, projection={"_id":1, "timestamp":1})
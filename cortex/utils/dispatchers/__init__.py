@@ -1,7 +1,7 @@
 #from cortex.utils.dispatchers.repository import get_dispatcher
 from cortex.utils.dispatchers.topic_consumer import get_topic_consumer
 from cortex.utils.dispatchers.topic_dispatcher import get_topic_dispatcher
-from cortex.utils.dispatchers import tee
+from cortex.utils.dispatchers import tee, topic_router
 from . import repository
 
 
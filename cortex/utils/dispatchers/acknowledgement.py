@@ -0,0 +1,48 @@
+"""
+Lets a message handler acknowledge the message it handles later, after it returned.
+
+A consumer in manual ack mode acks a message once its handler returns. A handler that only queues the work
+(e.g a saver that writes in batches) takes the acknowledgement over with `defer()`, and calls what it got back once
+the work is really done: with True to ack the message, with False to reject it.
+"""
+import contextlib
+import threading
+
+_current = threading.local()
+
+
+class Delivery:
+    def __init__(self, settle):
+        """
+        :param settle: acks the message when called with True, rejects it when called with False. may be called
+                       from any thread
+        """
+        self.settle = settle
+        self.deferred = False
+
+
+@contextlib.contextmanager
+def handling(settle):
+    """
+    used by consumers around the call to a message handler, so the handler can `defer` the acknowledgement
+    :return: the Delivery, whose `deferred` tells the consumer whether to leave the ack to the handler
+    """
+    delivery = Delivery(settle)
+    outer, _current.delivery = getattr(_current, 'delivery', None), delivery
+    try:
+        yield delivery
+    finally:
+        _current.delivery = outer
+
+
+def defer():
+    """
+    takes over acknowledging the message that is being handled on this thread
+    :return: a callable that settles the message, or None if there is nothing to acknowledge
+             (the consumer acks on delivery, or this isn't called from a message handler)
+    """
+    delivery = getattr(_current, 'delivery', None)
+    if delivery is None or delivery.deferred:
+        return None
+    delivery.deferred = True
+    return delivery.settle
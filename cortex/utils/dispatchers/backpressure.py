@@ -0,0 +1,10 @@
+"""
+Lets a dispatcher tell its callers to slow down.
+"""
+
+
+class PublisherFull(Exception):
+    """
+    raised by a dispatcher that buffers messages when its buffer is full. the message was not taken,
+    the caller should back off and try again later (the servers answer 503)
+    """
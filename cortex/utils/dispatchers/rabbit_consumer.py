@@ -12,11 +12,14 @@ import pika
 import pika.exceptions
 import urlpath
 
+from cortex import configuration
+from cortex.utils.dispatchers import acknowledgement
 from cortex.utils.logging import get_logger, get_module_logger, log_exception
 
 LOGGER = get_module_logger(__file__)
 
 SCHEME = 'rabbitmq'
+PRECONDITION_FAILED = 406  # the reply code of a declare that doesn't match the existing queue
 
 def get_consumer(url, handlers=None, auto_start=False ):
     url = urlpath.URL(url)
@@ -31,8 +34,9 @@ def get_consumer(url, handlers=None, auto_start=False ):
 
 
 class RabbitQueueConsumer:
-    HandlerRecord = make_dataclass ("HandlerRecord", ['callback', ('thread', 'str'), 'channel', 'message_decoder'])
-    Exchange='cortex'
+    HandlerRecord = make_dataclass ("HandlerRecord", ['callback', ('thread', 'str'), 'channel', 'message_decoder',
+                                                      ('queue', 'str', None), ('routes', 'dict', None)])
+    Exchange = configuration.MESSAGE_EXCHANGE
     def __init__(self, params, handlers=None, exchange=None):
         """
         creates a new consumer. a consumer is a threaded entity that can handle many channels at once.
@@ -73,9 +77,13 @@ class RabbitQueueConsumer:
                 self._logger.info(f"start consuming {topic}")
                 record.channel.start_consuming()
 
-            record.channel = self._make_channel(topic,
-                                            handler=record.callback,
-                                            message_decoder=record.message_decoder)
+            if record.routes:
+                record.channel = self._make_routing_channel(record.routes, message_decoder=record.message_decoder)
+            else:
+                record.channel = self._make_channel(topic,
+                                                handler=record.callback,
+                                                message_decoder=record.message_decoder,
+                                                queue=record.queue)
 
     def _run_consumer(self, topic):
         with self._io_list_lock:
@@ -111,29 +119,113 @@ class RabbitQueueConsumer:
             t.start()
         return t
 
-    def on_message(self, channel, method, c, body, message_decoder=None, cb=None, topic=None):
+    def on_message(self, channel, method, c, body, message_decoder=None, cb=None, topic=None, manual_ack=False):
+        """
+        decodes the message and hands it to the callback.
+        :param manual_ack: ack the message once the callback returned, or reject it into the dead letter queue if it
+                           raised. otherwise the message was acked on delivery, and a failure loses it.
+                           the callback may take the ack over, see `acknowledgement.defer`
+        """
         if not topic.startswith(method.routing_key):
+            if manual_ack:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
             return
         self._logger.info(f"{threading.current_thread().name} receiving: {body} with {method.routing_key}")
-        if cb and message_decoder:
+        if not (cb and message_decoder):
+            raise RuntimeError(f"could not parse because bad 'decoder :' {message_decoder!r} or callback: {cb!r}")
+        if not manual_ack:
             cb(message_decoder(body))
+            return
+        settle = functools.partial(self._settle_threadsafe, channel, method.delivery_tag)
+        with acknowledgement.handling(settle) as delivery:
+            try:
+                cb(message_decoder(body))
+            except Exception as e:
+                self._logger.exception(f"failed handling message on {topic}, dead lettering it: {e!r}")
+                if not delivery.deferred:
+                    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+        if not delivery.deferred:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _settle_threadsafe(self, channel, delivery_tag, ok=True):
+        """
+        acks (or dead letters) a message from any thread. the channel is only touched on its consuming thread
+        """
+        if ok:
+            settle = functools.partial(channel.basic_ack, delivery_tag=delivery_tag)
         else:
-            raise RuntimeError(f"could not parse because bad 'decoder :' {message_decoder!r} or callback: {cb!r}")
+            settle = functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=False)
+        self._connection.add_callback_threadsafe(settle)
 
-    def _make_channel(self, topic, handler, message_decoder):
+    def _declare_dead_letters(self, channel):
+        channel.exchange_declare(configuration.DEAD_LETTER_EXCHANGE, exchange_type='fanout')
+        channel.queue_declare(configuration.DEAD_LETTER_QUEUE)
+        channel.queue_bind(queue=configuration.DEAD_LETTER_QUEUE, exchange=configuration.DEAD_LETTER_EXCHANGE)
+
+    def _new_channel(self):
         self._ensure_connection()
+        config = configuration.get_config()
         channel = self._connection.channel()
-        channel.exchange_declare(self._exchange, exchange_type='fanout')
-        channel.queue_declare(topic)
-        channel.queue_bind(queue=topic, exchange=self._exchange)
-        channel.basic_consume(queue=topic,
-                              on_message_callback=functools.partial(self.on_message,
-                              cb=handler,
-                              message_decoder=message_decoder, topic=topic),
-                              auto_ack=True)
+        channel.basic_qos(prefetch_count=config[configuration.CONFIG_CONSUMER_PREFETCH])
+        channel.exchange_declare(self._exchange, exchange_type='topic')
+        if config[configuration.CONFIG_CONSUMER_MANUAL_ACK]:
+            self._declare_dead_letters(channel)
+        return channel
+
+    def _declare_dead_lettered_queue(self, channel, queue):
+        """
+        declares a queue whose rejected messages go to the dead letter exchange.
+        a queue's arguments can't change once it exists, so a queue declared before manual acks were turned on
+        has to be deleted (or drained and re-declared) before it can be consumed this way
+        """
+        try:
+            channel.queue_declare(queue, arguments={'x-dead-letter-exchange': configuration.DEAD_LETTER_EXCHANGE})
+        except pika.exceptions.ChannelClosedByBroker as e:
+            if e.reply_code != PRECONDITION_FAILED:
+                raise
+            message = (f"queue {queue} exists without a dead letter exchange, which "
+                       f"{configuration.CONFIG_CONSUMER_MANUAL_ACK} needs. delete it (e.g rabbitmqctl delete_queue "
+                       f"{queue}) or turn {configuration.CONFIG_CONSUMER_MANUAL_ACK} off: {e.reply_text}")
+            self._logger.error(message)
+            raise RuntimeError(message) from e
+
+    def _consume(self, channel, topic, handler, message_decoder, queue):
+        manual_ack = configuration.get_config()[configuration.CONFIG_CONSUMER_MANUAL_ACK]
+        if manual_ack:
+            self._declare_dead_lettered_queue(channel, queue)
+        else:
+            channel.queue_declare(queue)
+        for routing_key in configuration.get_topic_bindings(topic):
+            channel.queue_bind(queue=queue, exchange=self._exchange, routing_key=routing_key)
+        on_message = functools.partial(self.on_message, cb=handler, message_decoder=message_decoder, topic=topic)
+        if manual_ack:
+            on_message = functools.partial(on_message, manual_ack=True)
+        channel.basic_consume(queue=queue,
+                              on_message_callback=on_message,
+                              auto_ack=not manual_ack)
+
+    def _make_channel(self, topic, handler, message_decoder, queue=None):
+        """
+        :param queue: the queue to consume from, defaults to one named after the topic.
+                      consumers on the same queue compete: each message goes to one of them
+        """
+        channel = self._new_channel()
+        self._consume(channel, topic, handler, message_decoder, queue or topic)
+        return channel
+
+    def _make_routing_channel(self, routes, message_decoder):
+        """
+        a single channel that consumes every topic in routes from its own queue, and hands each message to the
+        handler of the topic it came from
+        :param routes: topic -> handler
+        """
+        channel = self._new_channel()
+        for topic, handler in routes.items():
+            self._consume(channel, topic, handler, message_decoder, topic)
         return channel
 
-    def register_handler(self, topic, handler, auto_start=False, message_decoder=json.loads):
+    def register_handler(self, topic, handler, auto_start=False, message_decoder=json.loads, queue=None):
         """
         registers a new handler to the consumer. each handler is running in a separate thread.
         This is called behind the scenes when an instance is used as a decorator
@@ -141,16 +233,35 @@ class RabbitQueueConsumer:
         :param handler: function to execute with message
         :param auto_start: should the thread start immediately
         :param message_decoder: decoder for messages coming over the handler
+        :param queue: a work queue to share with other consumers of the topic, e.g replicas of a parser.
+                      defaults to a queue named after the topic
         :return: the handler argument
         """
-        channel = self._make_channel(topic, handler, message_decoder)
+        channel = self._make_channel(topic, handler, message_decoder, queue=queue)
         with self._io_list_lock:
             self.handlers[topic] = record = self.HandlerRecord(callback=handler, thread=None, channel=channel,
-                                                               message_decoder=message_decoder)
+                                                               message_decoder=message_decoder, queue=queue)
         t = self._make_consumer(topic, auto_start)
         record.thread = t
         return handler
 
+    def register_routes(self, name, routes, auto_start=False, message_decoder=json.loads):
+        """
+        registers many handlers that share one channel and one thread, instead of a channel and a thread each.
+        :param name: what the routes are registered under, in place of a topic
+        :param routes: topic -> handler, every handler gets the messages of its topic
+        :param auto_start: should the thread start immediately
+        :param message_decoder: decoder for the messages of all the topics
+        :return: the routes argument
+        """
+        routes = dict(routes)
+        channel = self._make_routing_channel(routes, message_decoder)
+        with self._io_list_lock:
+            self.handlers[name] = record = self.HandlerRecord(callback=None, thread=None, channel=channel,
+                                                              message_decoder=message_decoder, routes=routes)
+        record.thread = self._make_consumer(name, auto_start)
+        return routes
+
     def register_handlers(self, handlers, auto_start=False):
         """
         registers the given handlers as consumers
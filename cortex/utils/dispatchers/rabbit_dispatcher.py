@@ -1,11 +1,18 @@
+import collections
 import functools
+import itertools
+import queue
+import threading
+import time
 
 import pika
 from threading import Thread
 
 import urlpath
 
-from cortex import utils
+from cortex import utils, configuration
+from cortex.utils.dispatchers import acknowledgement
+from cortex.utils.dispatchers.backpressure import PublisherFull
 
 SCHEME = "rabbitmq"
 
@@ -17,7 +24,9 @@ def get_dispatcher(url, topics, auto_start=True, **kwargs):
     :param auto_start: bool: start the dispatcher right away (on False, this will not connect the dispatcher)
     :param url: where to connect
     :param topics: topics that could be published
-    :param kwargs: anything to pass on to the dispatcher implementation (TODO)
+    :param kwargs: anything to pass on to the dispatcher implementation, e.g buffer_size and confirm.
+                   unbuffered by default: a buffered dispatcher raises `PublisherFull`, which only a caller that can
+                   answer it (the ingest server) should get
     :return: a dispatcher if the url scheme matches, None otherwise
     """
     url = urlpath.URL(url)
@@ -25,15 +34,31 @@ def get_dispatcher(url, topics, auto_start=True, **kwargs):
         return None
 
     topics = topics if not isinstance(topics, str) else (topics, )
-    dispatcher = RabbitQueueDispatcher(pika.ConnectionParameters(host=url.hostname, port=url.port), topics)
+    dispatcher = RabbitQueueDispatcher(pika.ConnectionParameters(host=url.hostname, port=url.port), topics, **kwargs)
     if auto_start:
         dispatcher.start()
     return dispatcher
 
 
 class RabbitQueueDispatcher:
-    Exchange = 'cortex'
-    def __init__(self, endpoints, topics, reconnecting=True):
+    Exchange = configuration.MESSAGE_EXCHANGE
+    RETRY_DELAY = 0.1
+    def __init__(self, endpoints, topics, reconnecting=True, buffer_size=None, batch_size=None, confirm=False,
+                 block_when_full=False):
+        """
+        :param buffer_size: when given, `dispatch` never touches the channel. it puts the message in a buffer of
+                            this size and the ioloop thread publishes it, so dispatching from many threads is safe.
+                            a full buffer raises `PublisherFull`
+        :param block_when_full: wait for room in a full buffer instead of raising, for callers with nothing better
+                                to do than wait (a parser handing its result on)
+        :param batch_size: most messages published per ioloop tick, so the loop still gets to do its own io
+        :param confirm: have the broker confirm the messages it took. a message is kept until it is confirmed, and
+                        published again if the broker nacks it or the channel goes down first. needs a buffer_size.
+                        a message published while handling a consumed message takes over its ack
+                        (see `acknowledgement.defer`), so the consumed message is acked once this one is confirmed
+        """
+        if confirm and not buffer_size:
+            raise ValueError("publisher confirms are tracked on the ioloop thread, they need a buffer_size")
         self._logger = utils.logging.get_instance_logger(self)
         self._connection = None
         self._exchange = None
@@ -43,8 +68,20 @@ class RabbitQueueDispatcher:
         self._ioloop = None
         self._reconnect = reconnecting
         self._queue = []
+        self._buffer = queue.Queue(buffer_size) if buffer_size else None
+        self._block_when_full = block_when_full
+        self._batch_size = batch_size or configuration.get_config()[configuration.CONFIG_PUBLISHER_BATCH_SIZE]
+        self._drain_lock = threading.Lock()
+        self._drain_scheduled = False
+        self._confirm = confirm
+        self._delivery_tag = 0
+        self._unconfirmed = collections.OrderedDict()  # delivery tag -> (message, publish time), in order
+        self._started_at = time.monotonic()
+        self.stats = collections.Counter()
 
     def dispatch(self, topic, data, again=False):
+        if self._buffer is not None:
+            return self._buffer_message(topic, data)
         self._logger.info(f"got {topic}, {data} to publish {'again' if again else ''}")
         if not self._send_with_existing_channel(topic, data):
             self._logger.debug("creating new channel to dispatch with")
@@ -72,23 +109,145 @@ class RabbitQueueDispatcher:
 
         return False
 
+    def _buffer_message(self, topic, data):
+        # buffered messages are (topic, data), and (topic, data, settle) when they settle a consumed message
+        settle = acknowledgement.defer() if self._confirm else None
+        message = (topic, data, settle) if settle else (topic, data)
+        try:
+            self._buffer.put(message, block=self._block_when_full)
+        except queue.Full:
+            if settle:
+                settle(False)
+            raise PublisherFull(f"{self._buffer.maxsize} messages are waiting to be published") from None
+        self._schedule_drain()
+
+    def _schedule_drain(self):
+        with self._drain_lock:
+            if self._drain_scheduled or not self._connection:
+                # a drain is coming, or the connection isn't there yet and will drain once it has a channel
+                return
+            self._drain_scheduled = True
+        self._connection.ioloop.add_callback_threadsafe(self._drain)
+
+    def _drain(self):
+        """
+        runs on the ioloop thread: publishes a batch of buffered messages, and comes back for the rest
+        """
+        with self._drain_lock:
+            self._drain_scheduled = False
+        if not self._channel:
+            self._connection.ioloop.call_later(self.RETRY_DELAY, self._schedule_drain)
+            return
+        for _ in range(self._batch_size - len(self._queue)):
+            try:
+                self._queue.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        if self._flush_messages() and not self._buffer.empty():
+            self._schedule_drain()
+
+    @property
+    def backlog(self):
+        """
+        :return: the fraction of the buffer in use, 0 when the publisher keeps up and 1 when it refuses messages
+        """
+        if self._buffer is None:
+            return 0
+        return self._buffer.qsize() / self._buffer.maxsize
+
+    @property
+    def unconfirmed(self):
+        """
+        :return: how many published messages the broker didn't confirm yet
+        """
+        return len(self._unconfirmed)
+
+    @property
+    def throughput(self):
+        """
+        :return: confirmed messages per second, since the dispatcher was created
+        """
+        return self.stats['confirmed'] / max(time.monotonic() - self._started_at, 1e-9)
+
+    @property
+    def confirm_latency(self):
+        """
+        :return: the mean seconds between publishing a message and its confirmation
+        """
+        return self.stats['confirm_latency'] / self.stats['confirmed'] if self.stats['confirmed'] else 0
+
+    def _setup_channel(self, channel):
+        """
+        turns on confirms on a new channel. its delivery tags start over, so whatever wasn't confirmed on the old
+        channel is published again first, ahead of the messages that are waiting, to keep them in order
+        """
+        if not self._confirm:
+            return
+        channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation)
+        self._delivery_tag = 0
+        if self._unconfirmed:
+            self.stats['republished'] += len(self._unconfirmed)
+            self._queue[:0] = [message for message, _ in self._unconfirmed.values()]
+            self._unconfirmed.clear()
+
+    def _on_delivery_confirmation(self, frame):
+        """
+        the broker acks (or nacks) a delivery tag, or with `multiple` every tag up to it
+        """
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        now = time.monotonic()
+        nacked = []
+        if method.multiple:
+            tags = list(itertools.takewhile(lambda i: i <= method.delivery_tag, self._unconfirmed))
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._unconfirmed else []
+        for tag in tags:
+            message, published_at = self._unconfirmed.pop(tag)
+            if acked:
+                self.stats['confirmed'] += 1
+                self.stats['confirm_latency'] += now - published_at
+                if len(message) > 2:
+                    message[2](True)
+            else:
+                nacked.append(message)
+        if nacked:
+            self._logger.warning(f"broker nacked {len(nacked)} messages, publishing them again")
+            self.stats['nacked'] += len(nacked)
+            self._queue[:0] = nacked
+            self._flush_messages()
+
     def _on_channel_opened(self, channel):
+        self._setup_channel(channel)
         self._channel = channel
         self._flush_messages()
+        if self._buffer is not None:
+            self._schedule_drain()
 
     def _flush_messages(self):
         """
         flushes all the messages that were to be dispatched by the queue.
-        :return:
+        :return: True if all of them were published
         """
         while self._queue:
-            topic, data = self._queue.pop(0)
+            message = self._queue.pop(0)
+            topic, data = message[:2]
             try:
                 self._channel.basic_publish(self._exchange, topic, data)
+                self.stats['published'] += 1
+                if self._confirm:
+                    self._delivery_tag += 1
+                    self._unconfirmed[self._delivery_tag] = (message, time.monotonic())
             except Exception:
                 # there is an issue with this channel, we're trying to reconnect.
-                self.dispatch(topic, data, again=True)
-                break
+                if self._buffer is None:
+                    self.dispatch(topic, data, again=True)
+                else:
+                    self._queue.insert(0, message)
+                    self._channel = None
+                    self._connection.channel(on_open_callback=self._on_channel_opened)
+                return False
+        return True
 
 
     def _declare_topics(self, connection):
@@ -101,13 +260,17 @@ class RabbitQueueDispatcher:
 
         def has_channel(channel):
             self._logger.info("declaring topics & exchange...")
-            channel.exchange_declare(exchange=self.Exchange, exchange_type='fanout')
+            channel.exchange_declare(exchange=self.Exchange, exchange_type='topic')
 
             for i in self._topics:
                 channel.queue_declare(i)
 
             self._exchange = self.Exchange
+            self._setup_channel(channel)
             self._channel = channel
+            if self._buffer is not None:
+                # messages may have been buffered before there was a connection to schedule their drain on
+                self._schedule_drain()
 
         ch = connection.channel(on_open_callback=has_channel)
 
@@ -120,6 +283,9 @@ class RabbitQueueDispatcher:
         """
         self._logger.info(f"connection closed: {reason}")
         self._connection.ioloop.stop()
+        with self._drain_lock:
+            # a drain scheduled on the closed loop never runs, the next channel schedules a new one
+            self._drain_scheduled = False
         if self._reconnect:
             self.start()
 
@@ -6,19 +6,21 @@ from cortex.utils.dispatchers.topic_dispatcher import get_topic_dispatcher
 from cortex.utils.logging import get_logger
 
 
-def get_topic_tee(in_topic, out_topic, consumer_uri, publisher_uri):
+def get_topic_tee(in_topic, out_topic, consumer_uri, publisher_uri, consumer_queue=None, publisher_options=None):
     """
     returns a tee over the topic. consumer and publisher are unbounded and not started
     :param out_topic: topic published by the dispatcher
     :param in_topic: topic that comes in through the consumer
     :param consumer_uri: uri to the consumer
     :param publisher_uri: uri to the publisher
+    :param consumer_queue: a work queue the consumer shares with competing consumers
+    :param publisher_options: kwargs for the publisher implementation
     :return: a Tee
     """
-    cons = get_topic_consumer(in_topic, consumer_uri)
+    cons = get_topic_consumer(in_topic, consumer_uri, queue=consumer_queue)
     if not cons:
         raise ValueError(f"Could not find consumer impl for {consumer_uri}")
-    pub = get_topic_dispatcher(out_topic, publisher_uri)
+    pub = get_topic_dispatcher(out_topic, publisher_uri, **(publisher_options or {}))
     if not pub:
         raise ValueError(f"Could not find consumer impl for {publisher_uri}")
 
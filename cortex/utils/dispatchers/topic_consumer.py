@@ -4,28 +4,30 @@ import functools
 
 from cortex.utils.dispatchers import repository
 
-def get_topic_consumer(topic, uri, auto_start=False):
+def get_topic_consumer(topic, uri, auto_start=False, queue=None):
     consumer = repository.ConsumerRepository.get_repo().get_consumer(uri, {}, auto_start=auto_start)
-    return TopicConsumer.wrap_consumer(topic, consumer)
+    return TopicConsumer.wrap_consumer(topic, consumer, queue=queue)
 
 class TopicConsumer:
     @classmethod
-    def wrap_consumer(cls, topic : str, consumer, callback=None, message_decoder=None, auto_start=False):
+    def wrap_consumer(cls, topic : str, consumer, callback=None, message_decoder=None, auto_start=False, queue=None):
         if consumer.running:
             # TODO: I should probably be able to support that, but it creates clutter.
             raise RuntimeError("cant wrap running consumer")
-        wrapped = cls(topic, consumer)
+        wrapped = cls(topic, consumer, queue=queue)
         if callback:
             wrapped.bind(callback, message_decoder, auto_start)
         return wrapped
 
-    def __init__(self, topic : str, consumer):
+    def __init__(self, topic : str, consumer, queue=None):
         """
         gets a topic string and a consumer to later bind to that.
         :param topic: the topic to bind to
         :param consumer: the consumer that will be bound to that
+        :param queue: a work queue shared with competing consumers, if the consumer supports them
         """
         self._topic = topic
+        self.queue = queue
         self._consumer = consumer
         self._callback = None
         self._decoder = None
@@ -37,6 +39,8 @@ class TopicConsumer:
         register = self._consumer.register_handler
         if message_decoder:
             register = functools.partial(register, message_decoder=message_decoder)
+        if self.queue:
+            register = functools.partial(register, queue=self.queue)
         register(self.topic, callback, auto_start=auto_start)
         self._callback = callback
 
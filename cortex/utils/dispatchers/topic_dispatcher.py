@@ -3,8 +3,11 @@ import json
 
 from cortex.utils.dispatchers import repository
 
-def get_topic_dispatcher(topic, uri):
-    disp = repository.DispatcherRepository.get_repo().get_dispatcher(uri, topic)
+def get_topic_dispatcher(topic, uri, **kwargs):
+    """
+    :param kwargs: passed on to the dispatcher implementation, e.g buffer_size
+    """
+    disp = repository.DispatcherRepository.get_repo().get_dispatcher(uri, topic, **kwargs)
     return TopicDispatcher.wrap_dispatcher(topic, disp)
 
 class TopicDispatcher:
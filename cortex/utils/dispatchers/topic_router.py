@@ -0,0 +1,56 @@
+"""
+Consumes many topics over one consumer channel, and hands every message to the callback of the topic it came on.
+A process with a callback per topic (like the saver, with a saver per parsed topic) then holds one channel and one
+consuming thread, however many topics it handles.
+"""
+import json
+
+from cortex.utils.dispatchers import repository
+
+
+def get_topic_router(uri, name, auto_start=False):
+    consumer = repository.ConsumerRepository.get_repo().get_consumer(uri, {}, auto_start=auto_start)
+    return TopicRouter(name, consumer)
+
+
+class TopicRouter:
+    def __init__(self, name, consumer):
+        """
+        :param name: the name the routes are registered under in the consumer
+        :param consumer: the consumer to consume with, not running
+        """
+        self.name = name
+        self._consumer = consumer
+        self.routes = {}
+        self.started = False
+
+    def route(self, topic, callback):
+        """
+        hands the messages of topic to callback. routes are added before the router starts
+        """
+        if self.started:
+            raise RuntimeError("can't add routes to a started router")
+        if not callable(callback):
+            raise TypeError("expected callable callback")
+        self.routes[topic] = callback
+        return callback
+
+    def start(self, message_decoder=json.loads):
+        if not self.routes:
+            raise RuntimeError("Cannot start a router without routes")
+        if hasattr(self._consumer, 'register_routes'):
+            self._consumer.register_routes(self.name, self.routes, message_decoder=message_decoder)
+        else:
+            # consumers that can't share a channel between topics get a handler per topic
+            for topic, callback in self.routes.items():
+                self._consumer.register_handler(topic, callback, message_decoder=message_decoder)
+        self._consumer.start()
+        self.started = True
+
+    def stop(self):
+        self._consumer.stop()
+        self.started = False
+
+    @property
+    def running(self):
+        return self._consumer.running
@@ -1,29 +1,123 @@
+import hashlib
+import os
 import pathlib
+import tempfile
 import urlpath
-from contextlib import suppress
-from datetime import datetime
 
 from cortex import configuration
 from cortex.utils import logging
+from .segment_log import SegmentRecord, SegmentLog, is_segment_uri
 module_logger = logging.get_module_logger(__file__)
 class MessageRecord:
+    """
+    raw messages, stored by content: a message lives at <repo>/ab/cd/abcd... where abcd... is the hash of its bytes.
+    a new record is written to a temporary file and moved into place when it is closed, so readers never see a
+    partial record, and storing the same message twice keeps one copy.
+    with the 'segments' backend configured, records are appended to a `segment_log.SegmentLog` instead.
+
+    every time a record is stored its digest is appended to a references journal, and every acknowledgement appends
+    it to the consumer's journal. `reaper.RecordReaper` reads the journals and deletes what every consumer is done with.
+    consumers register themselves (see `register_consumer`), so the reaper waits for the ones that are deployed.
+    """
+    HASH_SIZE = 20  # bytes of blake2b digest
+    FAN_OUT = 2  # directory levels, two hex digits each
+    TMP_DIR = 'tmp'
+    JOURNAL_DIR = 'journal'
+    REFERENCES_JOURNAL = 'references'
+    ACK_SUFFIX = '.ack'
+    CONSUMERS_DIR = 'consumers'
+
+    @classmethod
+    def repo(cls):
+        return pathlib.Path(configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_REPO])
+
+    @classmethod
+    def path_for(cls, digest):
+        """
+        :param digest: the hex digest of a message
+        :return: where the message with that digest is stored
+        """
+        parts = [digest[2 * i: 2 * i + 2] for i in range(cls.FAN_OUT)]
+        return cls.repo().joinpath(*parts, digest)
 
     @classmethod
     def create(cls):
-        repo = pathlib.Path(configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_REPO])
-        repo.mkdir(parents=True, exist_ok=True)
-        path = repo / str(f"snapshot_{datetime.now():%b-%d-%Y_%H:%M:%S_%f}")
-        module_logger.info(f"creating {path}")
-        return cls(path.open('wb'), path)
+        if configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_BACKEND] == 'segments':
+            return SegmentRecord.create()
+        tmp_dir = cls.repo() / cls.TMP_DIR
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        # same file system as the records, so moving a finished record into place is a rename
+        handle = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix='snapshot_', delete=False)
+        return cls(handle, pathlib.Path(handle.name), hasher=hashlib.blake2b(digest_size=cls.HASH_SIZE))
 
     @classmethod
     def open(cls, path, mode='rb'):
+        if is_segment_uri(path):
+            return SegmentRecord.open(path, mode)
         path = pathlib.Path(urlpath.URL(path).path)
         return cls(path.open(mode), path)
 
-    def __init__(self, fd, path=None):
+    @classmethod
+    def acknowledge(cls, uri, consumer):
+        """
+        tells the store that the consumer is done with the record at the uri, so it can be reclaimed once
+        every consumer is.
+        :param uri: the record's uri
+        :param consumer: name of the consumer
+        """
+        if is_segment_uri(uri):
+            SegmentLog.get().acknowledge(uri, consumer)
+        else:
+            cls._journal(consumer + cls.ACK_SUFFIX, pathlib.Path(urlpath.URL(uri).path).name)
+
+    @classmethod
+    def register_consumer(cls, consumer):
+        """
+        records that the consumer is deployed, so records are kept until it acknowledged them
+        """
+        path = cls.repo() / cls.CONSUMERS_DIR / consumer
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    @classmethod
+    def forget_consumer(cls, consumer):
+        """
+        records that the consumer was retired, so records no longer wait for it
+        """
+        (cls.repo() / cls.CONSUMERS_DIR / consumer).unlink()
+
+    @classmethod
+    def registered_consumers(cls):
+        """
+        :return: names of the consumers that registered, sorted
+        """
+        directory = cls.repo() / cls.CONSUMERS_DIR
+        return sorted(i.name for i in directory.iterdir()) if directory.exists() else []
+
+    @classmethod
+    def journal_dir(cls):
+        return cls.repo() / cls.JOURNAL_DIR
+
+    @classmethod
+    def _journal(cls, name, digest):
+        # one small O_APPEND write per line, so many processes can append to the same journal
+        path = cls.journal_dir() / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, f"{digest}\n".encode())
+        finally:
+            os.close(fd)
+
+    def __init__(self, fd, path=None, hasher=None):
+        """
+        :param fd: the open file
+        :param path: its path
+        :param hasher: a hashlib hash, given to records being created. the record is stored by its digest on close
+        """
         self.handle = fd
         self._path = path
+        self._hasher = hasher
 
     def __enter__(self):
         return self
@@ -32,6 +126,8 @@ class MessageRecord:
         self.close()
 
     def write(self, data):
+        if self._hasher:
+            self._hasher.update(data)
         return self.handle.write(data)
 
     def read(self, size=None):
@@ -44,9 +140,33 @@ class MessageRecord:
 
     @property
     def path(self):
-        with suppress():
-            return self.handle.name
-        return self._path
+        return self._path or pathlib.Path(self.handle.name)
+
+    @property
+    def digest(self):
+        """ the hex digest of a created record, None for opened ones """
+        return self._hasher.hexdigest() if self._hasher else None
+
+    def _store(self):
+        path = self.path_for(self.digest)
+        # journaled first, so a reaper that runs from here on sees the reference and keeps the record
+        self._journal(self.REFERENCES_JOURNAL, self.digest)
+        try:
+            # the reaper keeps recently touched records, so it won't take this one from under the new reference
+            os.utime(path)
+        except FileNotFoundError:
+            # not stored yet, or reaped just now
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._path, path)
+            module_logger.info(f"stored {path}")
+        else:
+            module_logger.debug(f"{path} is already stored")
+            os.unlink(self._path)
+        self._path = path
 
     def close(self):
+        if self.handle.closed:
+            return
         self.handle.close()
+        if self._hasher:
+            self._store()
@@ -0,0 +1,197 @@
+"""
+Reclaims raw message records once every consumer is done with them.
+
+`MessageRecord` journals a digest every time a record is stored (a reference) and every time a consumer
+acknowledges it. The reaper takes the journals over (renames them, so writers start new ones), folds them into
+its counts, and deletes a record once every expected consumer has acknowledged it as many times as it was stored,
+and it hasn't been touched for the retention period.
+Its counts are kept in a state file, so records that are half way through are not forgotten between runs.
+Server instances sharing the repo may each run a reaper: a run holds a lock file, and starts from the state file
+the last run (of any instance) left.
+
+Segments of the segment log backend are compacted by the same reaper.
+"""
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+
+from cortex import configuration
+from cortex.utils import logging
+from .message_record import MessageRecord
+from .segment_log import SegmentLog
+
+module_logger = logging.get_module_logger(__file__)
+
+
+class RecordReaper:
+    STATE_FILE = 'reaper_state.json'
+    LOCK_FILE = 'reaper.lock'
+    TAKEN_SUFFIX = '.reaping'
+
+    def __init__(self, consumers, retention=None, interval=None):
+        """
+        :param consumers: a callable that returns the names of the consumers that must acknowledge a record
+        :param retention: seconds a record is kept after it was last stored, even if it was consumed
+        :param interval: seconds between runs of the background thread
+        """
+        config = configuration.get_config()
+        self.consumers = consumers
+        self.retention = config[configuration.CONFIG_RAW_MESSAGE_RETENTION] if retention is None else retention
+        self.interval = config[configuration.CONFIG_RAW_MESSAGE_REAPER_INTERVAL] if interval is None else interval
+        self.stats = collections.Counter()
+        self._references = collections.Counter()
+        self._acks = collections.defaultdict(collections.Counter)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def _state_path(self):
+        return MessageRecord.journal_dir() / self.STATE_FILE
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """ holds the reaper lock of the repo, shared by the reapers of every server instance """
+        path = MessageRecord.journal_dir() / self.LOCK_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_state(self):
+        self._references = collections.Counter()
+        self._acks = collections.defaultdict(collections.Counter)
+        if not self._state_path.exists():
+            return
+        state = json.loads(self._state_path.read_text())
+        self._references.update(state['references'])
+        for consumer, acks in state['acks'].items():
+            self._acks[consumer].update(acks)
+
+    def _save_state(self):
+        tmp = self._state_path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps({'references': self._references, 'acks': self._acks}))
+        os.replace(tmp, self._state_path)
+
+    def _take_journals(self):
+        """
+        moves the journals aside and folds them into the counts
+        :return: the journal files that were taken, to delete once the counts are saved
+        """
+        journal_dir = MessageRecord.journal_dir()
+        if not journal_dir.exists():
+            return []
+        taken = []
+        for path in list(journal_dir.iterdir()):
+            if path.name in (self.STATE_FILE, self.LOCK_FILE) or path.suffix == '.tmp':
+                continue
+            if path.suffix != self.TAKEN_SUFFIX:
+                # journals that were already taken were left by an interrupted run, and are read as they are
+                taken_path = path.with_name(f"{path.name}.{time.time_ns()}{self.TAKEN_SUFFIX}")
+                os.replace(path, taken_path)
+                path = taken_path
+            # <journal>.<time>.reaping, where the journal is the references or <consumer>.ack, and consumers may have dots
+            name = path.name[:-len(self.TAKEN_SUFFIX)].rpartition('.')[0]
+            digests = path.read_text().split()
+            if name == MessageRecord.REFERENCES_JOURNAL:
+                self._references.update(digests)
+            elif name.endswith(MessageRecord.ACK_SUFFIX):
+                self._acks[name[:-len(MessageRecord.ACK_SUFFIX)]].update(digests)
+            else:
+                module_logger.warning(f"ignoring unknown journal {path}")
+            taken.append(path)
+        return taken
+
+    def _fresh_references(self):
+        """
+        :return: the digests referenced since the journals were taken. a store may be reusing their records right now
+        """
+        path = MessageRecord.journal_dir() / MessageRecord.REFERENCES_JOURNAL
+        try:
+            return set(path.read_text().split())
+        except FileNotFoundError:
+            return set()
+
+    def _forget(self, digest):
+        del self._references[digest]
+        for acks in self._acks.values():
+            acks.pop(digest, None)
+
+    def _is_done(self, digest, consumers):
+        return all(self._acks[i][digest] >= self._references[digest] for i in consumers)
+
+    def reap(self):
+        """
+        one run of the reaper: reads the journals and deletes consumed records and segments
+        :return: the number of bytes reclaimed
+        """
+        consumers = list(self.consumers())
+        if not consumers:
+            module_logger.warning("no consumers are registered, not reaping anything")
+            return 0
+        with self._locked():
+            return self._reap(consumers)
+
+    def _reap(self, consumers):
+        # another instance may have run since this one did, its state is the current one
+        self._load_state()
+        taken = self._take_journals()
+        reclaimed = 0
+        now = time.time()
+        fresh = self._fresh_references()
+        aside = []
+        for digest in [i for i in self._references if i not in fresh and self._is_done(i, consumers)]:
+            path = MessageRecord.path_for(digest)
+            taken_path = path.with_name(path.name + self.TAKEN_SUFFIX)
+            try:
+                if taken_path.exists():
+                    # left aside by an interrupted run
+                    os.replace(taken_path, path)
+                stat = path.stat()
+                if now - stat.st_mtime < self.retention:
+                    continue
+                # moved aside rather than deleted, until it's certain no store reused it in the meantime
+                os.replace(path, taken_path)
+                aside.append((digest, path, taken_path, stat.st_size))
+            except FileNotFoundError:
+                self._forget(digest)
+        # a store journals its reference before it touches the record, so those that reused one are in the journal now
+        fresh = self._fresh_references()
+        for digest, path, taken_path, size in aside:
+            if digest in fresh:
+                os.replace(taken_path, path)
+                continue
+            taken_path.unlink()
+            reclaimed += size
+            self.stats['records_reclaimed'] += 1
+            self._forget(digest)
+        self._save_state()
+        for path in taken:
+            path.unlink()
+        reclaimed += SegmentLog.get().compact(consumers)
+        self.stats['bytes_reclaimed'] += reclaimed
+        self.stats['runs'] += 1
+        module_logger.info(f"reaped {reclaimed} bytes, {dict(self.stats)}")
+        return reclaimed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with logging.log_exception(module_logger, to_suppress=(Exception,),
+                                       format=lambda e: f"reaper run failed: {e!r}"):
+                self.reap()
+
+    def start(self):
+        """ starts reaping on a background thread, every `interval` seconds """
+        self._thread = threading.Thread(target=self._run, name='cortex_record_reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,308 @@
+"""
+An append-only log of raw messages, as an alternative to one file per message.
+
+Messages are appended to segment files of a few tens of megabytes, and addressed as
+segment://<segment id>?offset=<offset>&len=<length>. Readers map segments into memory and slice messages out of them.
+
+Every process writes to its own segment (the host and pid are in the segment id), so writers never share a file.
+The offset of every message is appended to <id>.idx after the message. When a segment is full it is sealed:
+a <id>.sealed file is written next to it with the number of messages in it. A segment whose writer died before sealing
+it is sealed by `compact`, with the messages its index holds.
+
+Consumers acknowledge messages with `acknowledge`, which appends the message's offset to <id>.<consumer>.ack,
+so acks from many processes need no locking. A message acknowledged twice (it was redelivered) still counts once.
+A sealed segment that every expected consumer has acknowledged every message of is deleted by `compact`.
+
+Readers keep a bounded number of segments mapped, see `CONFIG_SEGMENT_MAP_CACHE`.
+"""
+import atexit
+import collections
+import contextlib
+import mmap
+import os
+import pathlib
+import socket
+import struct
+import threading
+import time
+
+import urlpath
+
+from cortex import configuration
+from cortex.utils import logging
+
+module_logger = logging.get_module_logger(__file__)
+
+SCHEME = 'segment'
+
+
+def is_segment_uri(uri):
+    return urlpath.URL(str(uri)).scheme == SCHEME
+
+
+def parse_uri(uri):
+    """
+    :return: (segment id, offset, length) of a segment uri
+    """
+    url = urlpath.URL(str(uri))
+    if url.scheme != SCHEME:
+        raise ValueError(f"{uri} is not a segment uri")
+    return url.netloc, int(url.form.get_one('offset')), int(url.form.get_one('len'))
+
+
+def make_uri(segment_id, offset, length):
+    return f"{SCHEME}://{segment_id}?offset={offset}&len={length}"
+
+
+class SegmentLog:
+    SUFFIX = '.seg'
+    SEALED_SUFFIX = '.sealed'
+    INDEX_SUFFIX = '.idx'
+    ACK_SUFFIX = '.ack'
+    OFFSET = struct.Struct('<Q')
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        :return: this process's log over the configured raw message repo
+        """
+        directory = pathlib.Path(configuration.get_config()[configuration.CONFIG_RAW_MESSAGE_REPO]) / 'segments'
+        key = (os.getpid(), directory)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(directory)
+            return cls._instances[key]
+
+    def __init__(self, directory, segment_size=None, map_cache=None):
+        """
+        :param directory: where segments are kept
+        :param segment_size: a segment is sealed once it is at least this big. defaults to the configuration
+        :param map_cache: most segments kept mapped for reading. defaults to the configuration
+        """
+        config = configuration.get_config()
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size or config[configuration.CONFIG_SEGMENT_SIZE]
+        self.map_cache = map_cache or config[configuration.CONFIG_SEGMENT_MAP_CACHE]
+        self._lock = threading.Lock()
+        self._active = None  # (segment id, file, size, message count, index file)
+        self._maps = collections.OrderedDict()  # segment id -> mmap, least recently read first
+        self._maps_lock = threading.Lock()
+        atexit.register(self.seal)
+
+    def _path(self, segment_id, suffix=SUFFIX):
+        return self.directory / f"{segment_id}{suffix}"
+
+    def _ack_path(self, segment_id, consumer):
+        return self._path(segment_id, f".{consumer}{self.ACK_SUFFIX}")
+
+    def _open_segment(self):
+        segment_id = f"{time.time_ns():020d}-{socket.gethostname()}-{os.getpid()}"
+        module_logger.info(f"opening segment {segment_id}")
+        return [segment_id, self._path(segment_id).open('ab', buffering=0), 0, 0,
+                self._path(segment_id, self.INDEX_SUFFIX).open('ab', buffering=0)]
+
+    def append(self, data):
+        """
+        appends a message to the active segment, sealing it when it is full
+        :param data: bytes-like
+        :return: the message's uri
+        """
+        with self._lock:
+            if self._active is None:
+                self._active = self._open_segment()
+            segment_id, handle, offset, _, index = self._active
+            handle.write(data)
+            # after the message: a message the index has is whole
+            index.write(self.OFFSET.pack(offset))
+            self._active[2] += len(data)
+            self._active[3] += 1
+            if self._active[2] >= self.segment_size:
+                self._seal_active()
+        return make_uri(segment_id, offset, len(data))
+
+    def _seal_active(self):
+        segment_id, handle, size, count, index = self._active
+        handle.close()
+        index.close()
+        self._path(segment_id, self.SEALED_SUFFIX).write_text(str(count))
+        module_logger.info(f"sealed segment {segment_id}: {count} messages, {size} bytes")
+        self._active = None
+
+    @staticmethod
+    def _writer_is_dead(segment_id):
+        """
+        :return: True if the segment was written by a process on this host that is gone
+        """
+        writer, _, pid = segment_id[21:].rpartition('-')
+        if writer != socket.gethostname() or not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def seal_stale(self):
+        """
+        seals the segments whose writer died before sealing them, so they can be compacted
+        :return: ids of the segments that were sealed
+        """
+        sealed = []
+        for path in list(self.directory.glob(f"*{self.SUFFIX}")):
+            segment_id = path.name[:-len(self.SUFFIX)]
+            if self._path(segment_id, self.SEALED_SUFFIX).exists() or not self._writer_is_dead(segment_id):
+                continue
+            try:
+                count = self._path(segment_id, self.INDEX_SUFFIX).stat().st_size // self.OFFSET.size
+            except FileNotFoundError:
+                count = 0
+            self._path(segment_id, self.SEALED_SUFFIX).write_text(str(count))
+            module_logger.warning(f"sealed segment {segment_id} of a dead writer: {count} messages")
+            sealed.append(segment_id)
+        return sealed
+
+    def seal(self):
+        """ seals the active segment, if there is one """
+        with self._lock:
+            if self._active is not None:
+                self._seal_active()
+
+    @staticmethod
+    def _unmap(mapped):
+        # a map with views still out can't be closed. it is then unmapped once the last view is released
+        with contextlib.suppress(BufferError):
+            mapped.close()
+
+    def _map(self, segment_id, end):
+        with self._maps_lock:
+            mapped = self._maps.get(segment_id)
+            if mapped is None or len(mapped) < end:
+                # new segment, or one that grew since it was mapped
+                if mapped is not None:
+                    self._unmap(mapped)
+                with self._path(segment_id).open('rb') as f:
+                    mapped = self._maps[segment_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.move_to_end(segment_id)
+            while len(self._maps) > self.map_cache:
+                self._unmap(self._maps.popitem(last=False)[1])
+            return mapped
+
+    def _drop_map(self, segment_id):
+        with self._maps_lock:
+            mapped = self._maps.pop(segment_id, None)
+        if mapped is not None:
+            self._unmap(mapped)
+
+    def read(self, uri):
+        """
+        :return: a memoryview of the message at the uri, over the segment's map, no copy is made
+        """
+        segment_id, offset, length = parse_uri(uri)
+        mapped = self._map(segment_id, offset + length)
+        if len(mapped) < offset + length:
+            raise ValueError(f"{uri} runs past the end of its segment")
+        return memoryview(mapped)[offset: offset + length]
+
+    def acknowledge(self, uri, consumer):
+        """
+        marks the message at the uri as done with, by the given consumer
+        """
+        segment_id, offset, _ = parse_uri(uri)
+        fd = os.open(self._ack_path(segment_id, consumer), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, self.OFFSET.pack(offset))
+        finally:
+            os.close(fd)
+
+    def _acked(self, segment_id, consumer):
+        """
+        :return: how many distinct messages of the segment the consumer acknowledged
+        """
+        try:
+            data = self._ack_path(segment_id, consumer).read_bytes()
+        except FileNotFoundError:
+            return 0
+        # an ack cut short by a crash is ignored
+        return len({i for i, in self.OFFSET.iter_unpack(data[:len(data) - len(data) % self.OFFSET.size])})
+
+    def sealed_segments(self):
+        """
+        :return: (segment id, message count, sealed at) of every sealed segment
+        """
+        for marker in self.directory.glob(f"*{self.SEALED_SUFFIX}"):
+            yield marker.name[:-len(self.SEALED_SUFFIX)], int(marker.read_text()), marker.stat().st_mtime
+
+    def compact(self, consumers, retention=None):
+        """
+        deletes the sealed segments that every consumer has acknowledged all of
+        :param consumers: names of the consumers that must be done with a segment before it goes
+        :param retention: seconds a segment is kept after it is sealed, even if it was consumed.
+                          defaults to the configuration
+        :return: the number of bytes reclaimed
+        """
+        if retention is None:
+            retention = configuration.get_config()[configuration.CONFIG_SEGMENT_RETENTION]
+        self.seal_stale()
+        reclaimed = 0
+        now = time.time()
+        for segment_id, count, sealed_at in list(self.sealed_segments()):
+            if now - sealed_at < retention or any(self._acked(segment_id, i) < count for i in consumers):
+                continue
+            self._drop_map(segment_id)
+            path = self._path(segment_id)
+            reclaimed += path.stat().st_size
+            path.unlink()
+            for i in self.directory.glob(f"{segment_id}.*"):
+                i.unlink()
+            module_logger.info(f"compacted segment {segment_id}")
+        return reclaimed
+
+
+class SegmentRecord:
+    """
+    a MessageRecord that lives in the segment log. writes are buffered and appended as one message on close
+    """
+    @classmethod
+    def create(cls):
+        return cls(SegmentLog.get())
+
+    @classmethod
+    def open(cls, uri, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError("segment records can't be changed once written")
+        return cls(SegmentLog.get(), uri)
+
+    def __init__(self, log, uri=None):
+        self.log = log
+        self._uri = uri
+        self._parts = [] if uri is None else None
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def read(self, size=None):
+        data = self.log.read(self._uri)
+        out = data[self._position:] if not size else data[self._position: self._position + size]
+        self._position += len(out)
+        return out
+
+    def uri(self):
+        return self._uri
+
+    def close(self):
+        if self._parts is not None:
+            self._uri = self.log.append(b''.join(self._parts))
+            self._parts = None
@@ -6,32 +6,35 @@ it passes a message encoder and decoder in so that the plugin itself can have an
 """
 
 import contextlib
+import functools
 from time import sleep
 
 from cortex import configuration
 from cortex.utils import dispatchers
 
 class PluginRunner:
-    def __init__(self, repo, message_decoder, message_encoder=None):
+    def __init__(self, repo, message_decoder, message_encoder=None, on_handled=None):
         """
         creates a new parser runner with a message encoder and decoder to pass to the parser once it starts running.
         :param message_decoder:
         :param message_encoder:
+        :param on_handled: called with (plugin target, decoded message) after the plugin handled a consumed message
         """
         self.repo = repo
         if not message_decoder or not callable(message_decoder):
             raise ValueError(f"Can't create runner with {type(message_decoder)}. Must be callable")
         self.message_decoder = message_decoder
         self.message_encoder = message_encoder
+        self.on_handled = on_handled
 
     def _run_with_tee(self, handler, tee, blocking):
         tee.bind(handler, message_decoder=self.message_decoder,
                  message_encoder=self.message_encoder)
         with contextlib.suppress(KeyboardInterrupt):
             tee.start()
-            while blocking:
-                if not (tee.consumer.running and tee.publisher.running):
-                    sleep(1)
+            # returns once either side stops, so whoever runs this (e.g a supervisor) can tell it stopped
+            while blocking and tee.consumer.running and tee.publisher.running:
+                sleep(1)
         if blocking:
             tee.stop()
 
@@ -49,16 +52,52 @@ class PluginRunner:
             raise RuntimeError(f"No entry for {name} in {self.repo}")
         self._run_with_tee(handler.handler, tee, blocking)
 
+    @staticmethod
+    def _publisher_options():
+        config = configuration.get_config()
+        if not config[configuration.CONFIG_CONSUMER_MANUAL_ACK]:
+            return {}
+        # a consumed message is acked once the broker confirmed the result published for it, not when it's handed
+        # to the publisher. a parser waits for room in a full publisher rather than failing the message
+        return dict(buffer_size=config[configuration.CONFIG_PUBLISHER_BUFFER_SIZE], confirm=True,
+                    block_when_full=True)
+
     def _run_with_uri(self, handler, uri, blocking, publisher_uri=None):
-        tee = dispatchers.tee.get_topic_tee(in_topic=configuration.get_raw_data_topic_name() + str(handler.target),
+        tee = dispatchers.tee.get_topic_tee(in_topic=configuration.get_raw_data_topic_name(handler.target),
                                             out_topic=configuration.get_parsed_data_topic_name(handler.target),
                                             consumer_uri=uri,
-                                            publisher_uri=publisher_uri or uri)
+                                            publisher_uri=publisher_uri or uri,
+                                            consumer_queue=configuration.get_work_queue_name(handler.target),
+                                            publisher_options=self._publisher_options())
         parser = handler.handler
         parser = parser if callable(parser) else parser.parse
+        parser = self._carry_targets(parser)
+        if self.on_handled:
+            parser = self._notify_handled(parser, handler.target)
 
         self._run_with_tee(parser, tee, blocking=blocking)
 
+    @staticmethod
+    def _carry_targets(parser):
+        """
+        copies the targets a snapshot was split for onto the parser's result, so the saver knows what to wait for
+        """
+        @functools.wraps(parser)
+        def wrapper(message):
+            out = parser(message)
+            if isinstance(out, dict) and isinstance(message, dict) and configuration.MESSAGE_TARGETS_KEY in message:
+                out.setdefault(configuration.MESSAGE_TARGETS_KEY, message[configuration.MESSAGE_TARGETS_KEY])
+            return out
+        return wrapper
+
+    def _notify_handled(self, parser, target):
+        @functools.wraps(parser)
+        def wrapper(message):
+            out = parser(message)
+            self.on_handled(target, message)
+            return out
+        return wrapper
+
 
     def run_with_uri(self, name, uri, publisher_uri=None, blocking=True):
         """
@@ -0,0 +1,50 @@
+"""
+Serves WSGI apps (our Flask apps) with gunicorn's pre-fork worker model instead of Flask's development server.
+
+Apps are given as factories and built inside every worker, after the fork. Anything an app holds on to - a publisher
+with its ioloop thread, a database client with its connection pool - is then made in the process that uses it,
+and never inherited half-alive from the master.
+"""
+from gunicorn.app.base import BaseApplication
+
+from cortex import configuration
+
+
+def get_options(workers=None, backlog=None, timeout=None, graceful_timeout=None):
+    """
+    :return: gunicorn settings, from the arguments that were given and the configuration for the rest
+    """
+    config = configuration.get_config()
+    given = dict(workers=workers, backlog=backlog, timeout=timeout, graceful_timeout=graceful_timeout)
+    defaults = dict(workers=config[configuration.CONFIG_PREFORK_WORKERS],
+                    backlog=config[configuration.CONFIG_PREFORK_BACKLOG],
+                    timeout=config[configuration.CONFIG_PREFORK_TIMEOUT],
+                    graceful_timeout=config[configuration.CONFIG_PREFORK_GRACEFUL_TIMEOUT])
+    return {k: defaults[k] if v is None else v for k, v in given.items()}
+
+
+class PreforkServer(BaseApplication):
+    def __init__(self, app_factory, host, port, **options):
+        """
+        :param app_factory: a callable that takes no arguments and returns the WSGI app. called once per worker
+        :param host: host to bind on
+        :param port: port to bind on
+        :param options: workers, backlog, timeout, graceful_timeout. missing ones are taken from the configuration
+        """
+        self.app_factory = app_factory
+        self.options = dict(get_options(**options), bind=f"{host}:{port}", preload_app=False)
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.app_factory()
+
+
+def serve(app_factory, host, port, **options):
+    """
+    runs the app in pre-forked workers until the master is stopped. blocks, and must run on the main thread
+    """
+    PreforkServer(app_factory, host, port, **options).run()
@@ -0,0 +1,81 @@
+"""
+Just enough of the protobuf wire format to look at a serialized message without parsing all of it.
+see https://developers.google.com/protocol-buffers/docs/encoding
+"""
+
+VARINT, FIXED64, LENGTH_DELIMITED, START_GROUP, END_GROUP, FIXED32 = range(6)
+
+
+class WireFormatError(Exception): pass
+
+
+def read_varint(data, offset=0):
+    """
+    reads a varint from the data
+    :param data: bytes-like
+    :param offset: where the varint starts
+    :return: (value, offset right after the varint)
+    """
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise WireFormatError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _skip_value(data, wire_type, offset):
+    if wire_type == VARINT:
+        return read_varint(data, offset)[1]
+    if wire_type == FIXED64:
+        return offset + 8
+    if wire_type == FIXED32:
+        return offset + 4
+    if wire_type == LENGTH_DELIMITED:
+        size, offset = read_varint(data, offset)
+        return offset + size
+    raise WireFormatError(f"unsupported wire type {wire_type}")
+
+
+def iter_fields(data):
+    """
+    iterates over the top level fields of a serialized message, without decoding them
+    :param data: bytes-like, the serialized message
+    :return: a generator of (field number, wire type, field start, value start, field end) tuples.
+             data[field start:field end] is the whole field, tag included.
+    """
+    offset = 0
+    while offset < len(data):
+        tag, value_offset = read_varint(data, offset)
+        end = _skip_value(data, tag & 0x7, value_offset)
+        if end > len(data):
+            raise WireFormatError(f"field {tag >> 3} runs past the end of the message")
+        yield tag >> 3, tag & 0x7, offset, value_offset, end
+        offset = end
+
+
+def find_varint(data, field_number, default=0):
+    """
+    finds the value of a varint field, stopping at the first occurrence.
+    serializers write fields in field number order, so low numbered fields are found right away.
+    :return: the value, or default if the field isn't there
+    """
+    for number, wire_type, _, value_offset, _ in iter_fields(data):
+        if number == field_number and wire_type == VARINT:
+            return read_varint(data, value_offset)[0]
+    return default
+
+
+def select_fields(data, field_numbers):
+    """
+    cuts the given fields out of a serialized message, skipping over everything else without decoding it
+    :param data: bytes-like, the serialized message
+    :param field_numbers: a collection of the numbers of fields to keep
+    :return: the serialized message with only those fields
+    """
+    data = memoryview(data)
+    return b''.join(data[start:end] for number, _, start, _, end in iter_fields(data) if number in field_numbers)
@@ -0,0 +1,128 @@
+"""
+Runs functions in worker processes and keeps them running: a worker that exits is started again.
+A worker that keeps dying right after it starts is restarted with an increasing delay, so a broken worker
+doesn't spin the machine.
+"""
+import multiprocessing
+import time
+
+from cortex.utils import logging
+
+module_logger = logging.get_module_logger(__file__)
+
+
+class Worker:
+    def __init__(self, name, target, args=(), kwargs=None):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.backoff = 0
+        self.next_start = 0
+
+    def start(self, context):
+        self.process = context.Process(target=self.target, args=self.args, kwargs=self.kwargs,
+                                       name=self.name, daemon=False)
+        self.process.start()
+        self.started_at = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name} pid={self.process and self.process.pid}>"
+
+
+class Supervisor:
+    def __init__(self, poll_interval=1, min_uptime=10, max_backoff=60, context=None):
+        """
+        :param poll_interval: seconds between checks on the workers
+        :param min_uptime: a worker that dies sooner than this after starting is restarted with a delay
+        :param max_backoff: the longest delay before restarting a worker
+        :param context: the multiprocessing context to start workers with
+        """
+        self.poll_interval = poll_interval
+        self.min_uptime = min_uptime
+        self.max_backoff = max_backoff
+        self.context = context or multiprocessing.get_context()
+        self.workers = []
+        self._running = False
+
+    def add(self, name, target, args=(), kwargs=None, replicas=1):
+        """
+        adds workers that run target(*args, **kwargs)
+        :param name: name of the workers, replicas are named <name>-<n>
+        :param replicas: how many workers to run the target in
+        :return: the added workers
+        """
+        added = [Worker(f"{name}-{i}", target, args, kwargs) for i in range(replicas)]
+        self.workers.extend(added)
+        return added
+
+    def start(self):
+        for worker in self.workers:
+            module_logger.info(f"starting {worker.name}")
+            worker.start(self.context)
+        self._running = True
+
+    def poll(self):
+        """
+        restarts the workers that exited
+        :return: the workers that were restarted
+        """
+        restarted = []
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.alive:
+                continue
+            if worker.next_start == 0:
+                # just found dead
+                if now - worker.started_at < self.min_uptime:
+                    worker.backoff = min(self.max_backoff, max(1, worker.backoff * 2))
+                else:
+                    worker.backoff = 0
+                worker.next_start = now + worker.backoff
+                module_logger.warning(f"{worker} exited with {worker.process.exitcode}, "
+                                      f"restarting in {worker.backoff} seconds")
+            if now >= worker.next_start:
+                worker.start(self.context)
+                worker.restarts += 1
+                worker.next_start = 0
+                restarted.append(worker)
+        return restarted
+
+    def run(self):
+        """
+        starts the workers and restarts them as they exit, until interrupted. then stops them
+        """
+        self.start()
+        try:
+            while self._running:
+                time.sleep(self.poll_interval)
+                self.poll()
+        except KeyboardInterrupt:
+            module_logger.info("interrupted, stopping workers...")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        """
+        terminates the workers, and kills the ones that didn't exit after timeout seconds
+        """
+        self._running = False
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                module_logger.warning(f"{worker} didn't stop, killing it")
+                worker.process.kill()
+                worker.process.join()
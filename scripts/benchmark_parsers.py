@@ -0,0 +1,68 @@
+"""
+Measures what it costs a parser to decode its snapshot: the whole snapshot, as parsers used to,
+against only the fields it declares in `with_protobuf_snapshot(fields=...)`.
+
+    python scripts/benchmark_parsers.py --repeat 50
+"""
+import pathlib
+import time
+
+import click
+try:
+    from cortex.core import cortex_pb2
+except ImportError:
+    import sys
+    sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+    from cortex.core import cortex_pb2
+from cortex.parser.protobuf_parsers import feelings_parser, image_parser, pose_parser
+from cortex.utils import protobuf_wire
+
+PARSERS = [pose_parser.parse_pose, feelings_parser.parse_feelings,
+           image_parser.parse_color_image, image_parser.parse_depth_image]
+
+
+def realistic_snapshot(width, height, depth_width, depth_height):
+    """ a snapshot the size of the ones in the sample: a full color image, a depth image, pose and feelings """
+    return cortex_pb2.Snapshot(
+        datetime=int(time.time() * 1000),
+        pose=dict(translation=dict(x=0.4, y=1.2, z=-0.3), rotation=dict(x=0.1, y=0.2, z=0.3, w=0.9)),
+        color_image=dict(width=width, height=height, data=bytes(range(256)) * (width * height * 3 // 256)),
+        depth_image=dict(width=depth_width, height=depth_height, data=[0.5] * (depth_width * depth_height)),
+        feelings=dict(hunger=0.1, thirst=0.2, exhaustion=0.3, happiness=0.4)).SerializeToString()
+
+
+def cpu_time(f, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        f()
+    return (time.process_time() - start) / repeat
+
+
+def decode_all(data):
+    cortex_pb2.Snapshot.FromString(data)
+
+
+def decode_fields(data, numbers):
+    cortex_pb2.Snapshot.FromString(protobuf_wire.select_fields(data, numbers))
+
+
+@click.command()
+@click.option('--repeat', '-r', default=20, help="decodes per measurement")
+@click.option('--width', default=1920)
+@click.option('--height', default=1080)
+@click.option('--depth-width', default=224)
+@click.option('--depth-height', default=172)
+def benchmark(repeat, width, height, depth_width, depth_height):
+    data = realistic_snapshot(width, height, depth_width, depth_height)
+    click.echo(f"snapshot: {len(data)} bytes, {repeat} decodes per parser")
+    click.echo(f"{'parser':<20}{'fields':<28}{'before (ms)':>12}{'after (ms)':>12}{'speedup':>10}")
+    for parser in PARSERS:
+        numbers = {cortex_pb2.Snapshot.DESCRIPTOR.fields_by_name[i].number for i in parser.fields}
+        before = cpu_time(lambda: decode_all(data), repeat)
+        after = cpu_time(lambda: decode_fields(data, numbers), repeat)
+        click.echo(f"{parser.__name__:<20}{','.join(parser.fields):<28}{before * 1000:>12.3f}{after * 1000:>12.3f}"
+                   f"{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark()
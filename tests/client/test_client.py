@@ -1,3 +1,73 @@
+import struct
+
 import pytest
+from unittest.mock import MagicMock
+
+from cortex.client import client, cortex_pb2
+
+
+def test_upload_sample_sends_one_by_one_by_default():
+    session = MagicMock()
+    client._upload_sample(range(5), session)
+    assert session.send_thought.call_count == 5
+    session.send_thoughts.assert_not_called()
+
+
+def test_upload_sample_sends_in_batches():
+    session = MagicMock()
+    client._upload_sample(range(5), session, batch_size=2)
+    assert [list(i[0][0]) for i in session.send_thoughts.call_args_list] == [[0, 1], [2, 3], [4]]
+    session.send_thought.assert_not_called()
+
+
+def test_upload_sample_concurrently_sends_everything():
+    session = MagicMock()
+    client._upload_sample(range(10), session, concurrency=3, window=4)
+    assert sorted(i[0][0] for i in session.send_thought.call_args_list) == list(range(10))
+
+
+def test_upload_sample_retries_failures():
+    session = MagicMock()
+    session.send_thought.side_effect = [False, ConnectionError(), True]
+    client._upload_sample(range(1), session, retries=2)
+    assert session.send_thought.call_count == 3
+
+
+def test_upload_sample_reports_failures_in_order(monkeypatch):
+    session = MagicMock()
+    session.send_thought.side_effect = lambda thought, *args, **kwargs: thought % 2 == 0
+    report = MagicMock()
+    monkeypatch.setattr(client, '_report', report)
+    client._upload_sample(range(8), session, concurrency=4)
+    assert [i[0] for i in report.call_args_list] == [(i, i % 2 == 0, 1) for i in range(8)]
+
+
+def test_upload_sample_with_workers_registers_user_once(httpserver, tmp_path):
+    user = cortex_pb2.User(user_id=7)
+    snapshots = [cortex_pb2.Snapshot(datetime=i) for i in range(1, 6)]
+    sample = tmp_path / 'sample.mind'
+    sample.write_bytes(b''.join(struct.pack("I", len(m)) + m
+                                for m in (i.SerializeToString() for i in [user] + snapshots)))
+    httpserver.expect_request('/configuration').respond_with_json({})
+    httpserver.expect_request('/users').respond_with_data('OK')
+    httpserver.expect_request('/user/7').respond_with_data('OK')
+    client.upload_sample(httpserver.host, httpserver.port, sample, batch_size=1, workers=2)
+    paths = [request.path for request, _ in httpserver.log]
+    assert paths.count('/users') == 1
+    assert paths.count('/user/7') == len(snapshots)
 
 
+def test_upload_sample_with_workers_reports_unparsable_snapshots(httpserver, tmp_path, monkeypatch):
+    user = cortex_pb2.User(user_id=7)
+    messages = [cortex_pb2.Snapshot(datetime=1).SerializeToString(), b'\xff\xff',
+                cortex_pb2.Snapshot(datetime=3).SerializeToString()]
+    sample = tmp_path / 'sample.mind'
+    sample.write_bytes(b''.join(struct.pack("I", len(m)) + m for m in [user.SerializeToString()] + messages))
+    httpserver.expect_request('/configuration').respond_with_json({})
+    httpserver.expect_request('/users').respond_with_data('OK')
+    httpserver.expect_request('/user/7').respond_with_data('OK')
+    report = MagicMock()
+    monkeypatch.setattr(client, '_report', report)
+    client.upload_sample(httpserver.host, httpserver.port, sample, batch_size=1, workers=2)
+    assert [i[0] for i in report.call_args_list] == [(0, True, 1), (1, False, 0), (2, True, 1)]
+    assert [request.path for request, _ in httpserver.log].count('/user/7') == 2
@@ -1,3 +1,5 @@
+from unittest.mock import Mock
+
 import pytest
 import urlpath
 from pytest_httpserver import HTTPServer
@@ -6,6 +8,8 @@ from cortex.client import cortex_pb2
 from cortex.client.client import ClientHTTPSession
 from cortex import Thought
 from cortex import configuration
+from cortex.core import snapshot_bundle
+from cortex.utils import compression
 
 @pytest.fixture()
 def config_dict():
@@ -43,3 +47,82 @@ def test_get_config_sets_config(httpserver, config_dict):
     with httpserver.wait(raise_assertions=True, timeout=2):
         client.get_config()
     assert client._server_config == config_dict
+
+def test_send_thoughts_sends_one_bundle(sessionserver):
+    client_session = ClientHTTPSession.start(sessionserver.host, sessionserver.port)
+    USER_ID = 12345
+    thoughts = [Thought.from_snapshot(cortex_pb2.User(user_id=USER_ID), cortex_pb2.Snapshot(datetime=i))
+                for i in range(3)]
+    sessionserver.expect_oneshot_request(f'/users').respond_with_json({})
+    sessionserver.expect_oneshot_request(f'/user/{USER_ID}/batch', method='POST',
+                                         data=snapshot_bundle.pack([b'string'] * len(thoughts))).respond_with_data('OK')
+    with sessionserver.wait(raise_assertions=True, timeout=2):
+        assert client_session.send_thoughts(thoughts, lambda x: b'string', lambda x: 'string')
+
+def test_send_thoughts_falls_back_without_batch_endpoint(sessionserver):
+    client_session = ClientHTTPSession.start(sessionserver.host, sessionserver.port)
+    USER_ID = 12345
+    thoughts = [Thought.from_snapshot(cortex_pb2.User(user_id=USER_ID), cortex_pb2.Snapshot(datetime=i))
+                for i in range(2)]
+    sessionserver.expect_oneshot_request(f'/users').respond_with_json({})
+    sessionserver.expect_oneshot_request(f'/user/{USER_ID}/batch', method='POST').respond_with_data('', status=404)
+    for _ in range(4):
+        sessionserver.expect_oneshot_request(f'/user/{USER_ID}', method='POST').respond_with_data('OK')
+    with sessionserver.wait(raise_assertions=True, timeout=2):
+        assert client_session.send_thoughts(thoughts, lambda x: b'string', lambda x: 'string')
+        # the session remembers, later batches go one by one straight away
+        assert client_session.send_thoughts(thoughts, lambda x: b'string', lambda x: 'string')
+
+def test_session_transport_lives_within_context(sessionserver):
+    session = ClientHTTPSession(urlpath.URL(sessionserver.url_for("/")))
+    with session:
+        transport = session.transport
+        session.get_config()
+        session.get_config()
+        assert session.transport is transport
+    assert session._transport is None
+
+
+def test_session_pool_size_is_configurable(sessionserver, monkeypatch):
+    monkeypatch.setitem(configuration.get_config(), configuration.CONFIG_CLIENT_POOL_SIZE, 3)
+    with ClientHTTPSession(urlpath.URL(sessionserver.url_for("/"))) as session:
+        adapter = session.transport.get_adapter(str(session.url))
+        assert adapter._pool_maxsize == 3
+
+def test_serialize_thought_sends_only_configured_fields():
+    snapshot = cortex_pb2.Snapshot(datetime=5, pose=dict(translation=dict(x=1)),
+                                   color_image=dict(width=1, height=1, data=b'abc'), feelings=dict(hunger=1))
+    thought = Thought.from_snapshot(cortex_pb2.User(user_id=1), snapshot)
+    session = ClientHTTPSession('http://localhost:1234',
+                                server_config={configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS: ['pose', 'feelings']})
+    sent = cortex_pb2.Snapshot()
+    sent.ParseFromString(session.serialize_thought(thought, cortex_pb2.Snapshot.SerializeToString))
+    assert sent == cortex_pb2.Snapshot(datetime=5, pose=snapshot.pose, feelings=snapshot.feelings)
+    assert thought.snapshot.color_image.data == b'abc'
+
+
+def test_serialize_thought_sends_everything_without_configured_fields():
+    snapshot = cortex_pb2.Snapshot(datetime=5, color_image=dict(width=1, height=1, data=b'abc'))
+    thought = Thought.from_snapshot(cortex_pb2.User(user_id=1), snapshot)
+    session = ClientHTTPSession('http://localhost:1234', server_config={})
+    assert session.serialize_thought(thought, cortex_pb2.Snapshot.SerializeToString) == snapshot.SerializeToString()
+
+def test_session_compresses_with_negotiated_encoding(sessionserver):
+    session = ClientHTTPSession(urlpath.URL(sessionserver.url_for("/")))
+    assert session.content_encoding is None
+    session._server_config = {configuration.CLIENT_CONFIG_CONTENT_ENCODINGS: ['gzip']}
+    assert session.content_encoding == 'gzip'
+    sessionserver.expect_oneshot_request('/user/1', method='POST', headers={'Content-Encoding': 'gzip'},
+                                         data=compression.compress('gzip', b'data')).respond_with_data('OK')
+    with sessionserver.wait(raise_assertions=True, timeout=2):
+        assert session.post_with_content_type('user/1', b'data', content_encoding=session.content_encoding)
+
+
+def test_start_closes_the_session_when_config_fails(httpserver, monkeypatch):
+    httpserver.expect_request('/configuration').respond_with_data('', status=500)
+    close = Mock(wraps=ClientHTTPSession.close)
+    monkeypatch.setattr(ClientHTTPSession, 'close', lambda self: close(self))
+    with pytest.raises(Exception, match="Couldn't get server config"):
+        ClientHTTPSession.start(httpserver.host, httpserver.port)
+    close.assert_called_once()
+    assert close.call_args[0][0]._transport is None
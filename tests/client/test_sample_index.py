@@ -0,0 +1,63 @@
+import struct
+from io import BytesIO
+
+import pytest
+
+from cortex.client import cortex_pb2
+from cortex.client.sample_index import SampleIndex
+
+
+def _build_message_buffer(message):
+    m = message.SerializeToString()
+    return struct.pack("I", len(m)) + m
+
+
+@pytest.fixture()
+def user_info():
+    return cortex_pb2.User(user_id=1, username="test_username")
+
+
+@pytest.fixture()
+def thoughts():
+    return [cortex_pb2.Snapshot(datetime=1000 + i, color_image=dict(width=1, height=1, data=b"abc" * i))
+            for i in range(10)]
+
+
+@pytest.fixture()
+def sample(user_info, thoughts):
+    return b"".join(_build_message_buffer(x) for x in [user_info] + thoughts)
+
+
+def test_build_indexes_every_snapshot(sample, thoughts):
+    index = SampleIndex.build(BytesIO(sample))
+    assert len(index) == len(thoughts)
+    assert [i.datetime for i in index.entries] == [i.datetime for i in thoughts]
+    for entry, thought in zip(index.entries, thoughts):
+        assert sample[entry.offset: entry.offset + entry.size] == thought.SerializeToString()
+
+
+def test_read_between_reads_only_the_range(sample, thoughts, user_info):
+    index = SampleIndex.build(BytesIO(sample))
+    read = list(index.read(BytesIO(sample), index.between(1003, 1006)))
+    assert [i.snapshot for i in read] == thoughts[3:6]
+    assert all(i.metadata == user_info for i in read)
+
+
+def test_split_covers_sample_contiguously(sample):
+    index = SampleIndex.build(BytesIO(sample))
+    parts = index.split(3)
+    assert len(parts) == 3
+    assert sum(parts, []) == index.entries
+    ranges = [SampleIndex.byte_range(i) for i in parts]
+    assert ranges[-1][1] == len(sample)
+    assert all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:]))
+
+
+def test_for_sample_saves_and_loads_sidecar(sample, tmp_path):
+    path = tmp_path / 'sample.mind'
+    path.write_bytes(sample)
+    built = SampleIndex.for_sample(path)
+    assert SampleIndex.sidecar_path(path).exists()
+    loaded = SampleIndex.load(SampleIndex.sidecar_path(path))
+    assert loaded.user == built.user
+    assert loaded.entries == built.entries
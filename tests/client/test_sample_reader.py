@@ -1,6 +1,7 @@
+import gzip
 from collections import namedtuple
 
-from cortex.client.sample_reader import SampleReader
+from cortex.client.sample_reader import SampleReader, MappedSampleStream, open_sample
 
 
 def test_sample_reader_user():
@@ -24,3 +25,28 @@ def test_sample_reader_iteration():
 
 
 
+
+
+def test_mapped_stream_reads_views(tmp_path):
+    path = tmp_path / 'sample'
+    path.write_bytes(b'0123456789')
+    with MappedSampleStream(path) as stream:
+        first = stream.read(4)
+        assert isinstance(first, memoryview)
+        assert bytes(first) == b'0123'
+        assert bytes(stream.read(100)) == b'456789'
+        assert not stream.read(1)
+    # views outlive the stream, the mapping goes when they do
+    assert bytes(first) == b'0123'
+
+
+def test_open_sample_picks_stream_by_file(tmp_path):
+    plain, compressed, empty = tmp_path / 'sample', tmp_path / 'sample.gz', tmp_path / 'empty'
+    plain.write_bytes(b'data')
+    compressed.write_bytes(gzip.compress(b'data'))
+    empty.write_bytes(b'')
+    with open_sample(plain) as stream:
+        assert isinstance(stream, MappedSampleStream)
+    for path, expected in ((compressed, b'data'), (empty, b''), (plain, b'data')):
+        with open_sample(path, mapped=False) as stream:
+            assert stream.read() == expected
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from cortex import configuration
+from cortex.core import cortex_async_server, snapshot_bundle
+from cortex.utils import compression
+from cortex.utils.dispatchers.backpressure import PublisherFull
+
+
+@pytest.fixture
+def mock_publish():
+    return MagicMock()
+
+
+@pytest.fixture
+def mock_encoder():
+    return MagicMock(side_effect=lambda snapshot, user: (bytes(snapshot), user))
+
+
+@pytest.fixture
+def request_server(mock_publish, mock_encoder):
+    """ runs a coroutine function with a test client of the server """
+    def run(test, **kwargs):
+        async def with_client():
+            app = cortex_async_server.get_server(mock_publish, mock_encoder, executor=ThreadPoolExecutor(2), **kwargs)
+            async with TestClient(TestServer(app)) as client:
+                return await test(client)
+        return asyncio.new_event_loop().run_until_complete(with_client())
+    return run
+
+
+def test_server_publishes_thought(request_server, mock_publish):
+    async def test(client):
+        rv = await client.post('/user/1234', data=b'testdata')
+        assert await rv.text() == 'OK'
+    request_server(test)
+    mock_publish.assert_called_once_with(configuration.topics.snapshot, (b'testdata', '1234'))
+
+
+def test_server_publishes_every_thought_in_compressed_batch(request_server, mock_publish):
+    test_data = [b'first', b'second', b'third']
+
+    async def test(client):
+        rv = await client.post('/user/1234/batch', data=compression.compress('gzip', snapshot_bundle.pack(test_data)),
+                               headers={'Content-Encoding': 'gzip'})
+        assert rv.status == 200
+    request_server(test)
+    assert [i[0][1][0] for i in mock_publish.call_args_list] == test_data
+
+
+def test_server_rejects_bad_requests_without_publishing(request_server, mock_publish):
+    async def test(client):
+        rv = await client.post('/user/1234/batch', data=snapshot_bundle.pack([b'first'])[:-1])
+        assert rv.status == 400
+        rv = await client.post('/user/1234', data=b'testdata', headers={'Content-Encoding': 'br'})
+        assert rv.status == 415
+    request_server(test)
+    mock_publish.assert_not_called()
+
+
+def test_server_registers_user(request_server, mock_publish):
+    async def test(client):
+        rv = await client.post('/users', json={'userId': 1, 'username': 'a', 'gender': 1})
+        assert rv.status == 200
+    request_server(test)
+    topic, message = mock_publish.call_args[0]
+    assert topic == configuration.get_parsed_data_topic_name(configuration.topics.user_info)
+    assert json.loads(message) == {'id': 1, 'username': 'a', 'gender': 'Female'}
+
+
+def test_server_gives_client_config(request_server):
+    async def test(client):
+        rv = await client.get(configuration.get_config()[configuration.CONFIG_SERVER_CONFIG_ENDPOINT])
+        return await rv.json()
+    assert request_server(test, client_config={'one': 2}) == {'one': 2}
+
+
+def test_server_answers_busy_when_publisher_is_full(request_server, mock_publish):
+    mock_publish.side_effect = PublisherFull()
+
+    async def test(client):
+        rv = await client.post('/user/1234', data=b'testdata')
+        assert rv.status == 503
+        assert rv.headers['Retry-After']
+    request_server(test)
+
+
+def test_server_decodes_bodies_off_the_event_loop(request_server, monkeypatch):
+    threads = []
+
+    def decode_body(data, encoding):
+        threads.append(threading.current_thread())
+        return data
+    monkeypatch.setattr(cortex_async_server, 'decode_body', decode_body)
+
+    async def test(client):
+        rv = await client.post('/user/1234', data=b'testdata')
+        assert rv.status == 200
+    request_server(test)
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_server_rejects_compression_bombs(request_server, mock_publish, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_SERVER_MAX_BODY_SIZE: 64 * 1024})
+    monkeypatch.setattr(configuration, 'get_config', MagicMock(return_value=config))
+
+    async def test(client):
+        rv = await client.post('/user/1234', data=compression.compress('gzip', bytes(1024 * 1024)),
+                               headers={'Content-Encoding': 'gzip'})
+        assert rv.status == 413
+    request_server(test)
+    mock_publish.assert_not_called()
@@ -2,8 +2,10 @@ from unittest.mock import MagicMock
 
 import pytest
 
-from cortex.core import cortex_rest_server
+from cortex.core import cortex_rest_server, snapshot_bundle
 from cortex import configuration
+from cortex.utils import compression
+from cortex.utils.dispatchers.backpressure import PublisherFull
 
 
 @pytest.fixture
@@ -60,6 +62,21 @@ def test_server_publishes_thought(mock_publish, mock_encoder, client):
 
 
 
+def test_server_publishes_every_thought_in_batch(mock_publish, mock_encoder, client):
+    user_id = 1234
+    test_data = [b"first", b"second", b"third"]
+    rv = client.post(f'/user/{user_id}/batch', data=snapshot_bundle.pack(test_data))
+    assert "OK" in rv.data.decode("utf-8")
+    assert mock_publish.call_count == len(test_data)
+    assert [bytes(i[0][0]) for i in mock_encoder.call_args_list] == test_data
+    assert all(int(i.kwargs['user']) == user_id for i in mock_encoder.call_args_list)
+
+
+def test_server_rejects_bad_batch_without_publishing(mock_publish, client):
+    rv = client.post(f'/user/1234/batch', data=snapshot_bundle.pack([b"first"])[:-1])
+    assert rv.status_code == 400
+    mock_publish.assert_not_called()
+
 
 def test_server_retrieves_configuration(client, monkeypatch):
     config_mock = MagicMock()
@@ -70,3 +87,39 @@ def test_server_retrieves_configuration(client, monkeypatch):
     assert rv.data.decode("utf-8")  == test_data
 
 
+
+def test_server_decodes_compressed_batch(mock_publish, mock_encoder, client):
+    test_data = [b"first", b"second"]
+    rv = client.post(f'/user/1234/batch', data=compression.compress('gzip', snapshot_bundle.pack(test_data)),
+                     headers={'Content-Encoding': 'gzip'})
+    assert rv.status_code == 200
+    assert [bytes(i[0][0]) for i in mock_encoder.call_args_list] == test_data
+
+
+def test_server_rejects_unknown_encoding(mock_publish, client):
+    rv = client.post(f'/user/1234', data=b"testdata", headers={'Content-Encoding': 'br'})
+    assert rv.status_code == 415
+    mock_publish.assert_not_called()
+
+
+def test_server_answers_busy_when_publisher_is_full(mock_publish, client):
+    mock_publish.side_effect = PublisherFull()
+    rv = client.post(f'/user/1234', data=b"testdata")
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After']
+
+
+def test_server_rejects_compression_bombs(mock_publish, client, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_SERVER_MAX_BODY_SIZE: 64 * 1024})
+    monkeypatch.setattr(configuration, 'get_config', MagicMock(return_value=config))
+    rv = client.post(f'/user/1234', data=compression.compress('gzip', bytes(1024 * 1024)),
+                     headers={'Content-Encoding': 'gzip'})
+    assert rv.status_code == 413
+    mock_publish.assert_not_called()
+
+
+def test_server_rejects_truncated_bodies(mock_publish, client):
+    body = compression.compress('gzip', bytes(range(256)) * 100)
+    rv = client.post(f'/user/1234', data=body[:len(body) // 2], headers={'Content-Encoding': 'gzip'})
+    assert rv.status_code == 400
+    mock_publish.assert_not_called()
@@ -69,3 +69,56 @@ def test_server_runs_server_run_with_args(monkeypatch):
     runner = CliRunner()
     runner.invoke(server.cli.cli, ['run-server', '-p', '1234', '-h', '127.0.0.1', 'some_uri'])
     get_server_mock.return_value.run.assert_called_once_with(host='127.0.0.1', port=1234)
+
+
+def test_client_config_advertises_parsed_fields(monkeypatch):
+    handlers = [Mock(target='pose'), Mock(target='feelings')]
+    monkeypatch.setattr(server.server.configuration, 'get_config',
+                        Mock(return_value={server.server.configuration.CONFIG_CLIENT_CONFIG: {}}))
+    import cortex.parser.repository
+    monkeypatch.setattr(cortex.parser.repository.Repository, 'get', Mock(return_value=Mock(handlers=lambda: handlers)))
+    fields = server.server.get_client_config()[server.server.configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS]
+    assert fields == ['feelings', 'pose']
+    handlers.append(Mock(target='news'))
+    assert server.server.configuration.CLIENT_CONFIG_SNAPSHOT_FIELDS not in server.server.get_client_config()
+
+
+def test_server_cli_selects_async_mode(monkeypatch):
+    run_server_mock = Mock()
+    monkeypatch.setattr(server.server, '_run_server', run_server_mock)
+    monkeypatch.setattr(server.server.dispatchers.repository.DispatcherRepository, 'get_dispatcher', MagicMock())
+    runner = CliRunner()
+    runner.invoke(server.cli.cli, ['run-server', '--mode', 'async', 'some_uri'])
+    assert run_server_mock.call_args.kwargs['mode'] == 'async'
+
+
+def test_prefork_mode_connects_publisher_in_workers(monkeypatch):
+    from cortex.utils import prefork
+    serve_mock = Mock()
+    get_dispatcher_mock = MagicMock()
+    monkeypatch.setattr(prefork, 'serve', serve_mock)
+    monkeypatch.setattr(server.server.dispatchers.repository.DispatcherRepository, 'get_dispatcher',
+                        get_dispatcher_mock)
+    server.server.run_server_with_url('127.0.0.1', 1234, 'some_uri', mode='prefork', workers=4)
+    get_dispatcher_mock.assert_not_called()
+    factory, host, port = serve_mock.call_args[0]
+    assert (host, port, serve_mock.call_args.kwargs) == ('127.0.0.1', 1234, {'workers': 4})
+    assert callable(factory().run)
+    get_dispatcher_mock.assert_called_once()
+
+
+def test_ingest_publisher_is_buffered(monkeypatch):
+    get_dispatcher_mock = MagicMock()
+    monkeypatch.setattr(server.server.dispatchers.repository.DispatcherRepository, 'get_dispatcher',
+                        get_dispatcher_mock)
+    server.server._get_publisher('rabbitmq://localhost:5672/')
+    config = server.server.configuration.get_config()
+    assert get_dispatcher_mock.call_args.kwargs['buffer_size'] == \
+        config[server.server.configuration.CONFIG_PUBLISHER_BUFFER_SIZE]
+
+
+def test_server_rejects_unknown_mode(mock_publish):
+    with pytest.raises(ValueError):
+        server.server._run_server('127.0.0.1', 1234, mock_publish, mode='asycn')
+    with pytest.raises(ValueError):
+        server.server.run_server_with_url('127.0.0.1', 1234, 'some_uri', mode='asycn')
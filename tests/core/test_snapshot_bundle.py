@@ -0,0 +1,20 @@
+import pytest
+
+from cortex.core import snapshot_bundle
+
+
+def test_pack_unpack_round_trip():
+    messages = [b'first', b'second message', b'3']
+    assert [bytes(i) for i in snapshot_bundle.unpack(snapshot_bundle.pack(messages))] == messages
+
+
+def test_unpack_empty_bundle():
+    assert list(snapshot_bundle.unpack(b'')) == []
+
+
+def test_unpack_raises_on_truncated_bundle():
+    data = snapshot_bundle.pack([b'some message'])
+    with pytest.raises(snapshot_bundle.BundleError):
+        list(snapshot_bundle.unpack(data[:-1]))
+    with pytest.raises(snapshot_bundle.BundleError):
+        list(snapshot_bundle.unpack(data + b'\x01'))
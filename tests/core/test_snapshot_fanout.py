@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from cortex import configuration
+from cortex.core import cortex_pb2, snapshot_fanout
+
+
+@pytest.fixture
+def snapshot():
+    return cortex_pb2.Snapshot(datetime=1234,
+                               pose=cortex_pb2.Pose(translation=cortex_pb2.Pose.Translation(x=1, y=2, z=3)),
+                               color_image=cortex_pb2.ColorImage(width=1, height=1, data=b'rgb'),
+                               feelings=cortex_pb2.Feelings(hunger=0.5))
+
+
+def test_split_cuts_a_payload_per_field(snapshot):
+    fields = {cortex_pb2.Snapshot.DESCRIPTOR.fields_by_name[i].number: i for i in ('pose', 'color_image', 'depth_image')}
+    parts = snapshot_fanout.split(snapshot.SerializeToString(), fields)
+    assert set(parts) == {'pose', 'color_image'}
+    pose = cortex_pb2.Snapshot.FromString(parts['pose'])
+    assert pose == cortex_pb2.Snapshot(datetime=1234, pose=snapshot.pose)
+    assert not pose.HasField('color_image')
+
+
+def test_fan_out_publishes_to_every_parser_topic(snapshot):
+    publish, release = MagicMock(), MagicMock()
+    fan_out = snapshot_fanout.SnapshotFanOut(publish, lambda payload, user, targets: (bytes(payload), user, targets),
+                                             ['pose', 'feelings', 'depth_image'], release=release)
+    fan_out(snapshot.SerializeToString(), user='1')
+    topics = [i[0][0] for i in publish.call_args_list]
+    assert topics == [configuration.get_raw_data_topic_name('pose'), configuration.get_raw_data_topic_name('feelings')]
+    # the snapshot has no depth image, so it is complete with pose and feelings
+    assert all(i[0][1][2] == ['feelings', 'pose'] for i in publish.call_args_list)
+    assert release.call_args_list[0][0][1] == ['feelings', 'depth_image']
+
+
+def test_fan_out_refuses_non_field_targets():
+    with pytest.raises(ValueError):
+        snapshot_fanout.SnapshotFanOut(MagicMock(), MagicMock(), ['pose', 'news'])
@@ -0,0 +1,29 @@
+from unittest.mock import Mock
+
+import pytest
+
+from cortex import configuration
+from cortex.core import snapshot_xcoder
+
+
+@pytest.fixture(autouse=True)
+def repo(tmp_path, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_RAW_MESSAGE_REPO: str(tmp_path),
+                                                 configuration.CONFIG_RAW_MESSAGE_INLINE_THRESHOLD: 100})
+    monkeypatch.setattr(configuration, 'get_config', Mock(return_value=config))
+    return tmp_path
+
+
+def test_small_snapshot_is_inlined(repo):
+    message = snapshot_xcoder.snapshot_encoder(memoryview(b'small'), user='1')
+    assert message.startswith(snapshot_xcoder.INLINE_MAGIC)
+    assert not any(i.is_file() for i in repo.rglob('*'))
+    assert snapshot_xcoder.snapshot_decoder(message) == {'user': '1', 'snapshot': b'small'}
+
+
+def test_large_snapshot_goes_to_the_store():
+    snapshot = b'large' * 100
+    message = snapshot_xcoder.snapshot_encoder(snapshot, user='1')
+    decoded = snapshot_xcoder.snapshot_decoder(message.encode())
+    assert decoded['snapshot'] == snapshot
+    assert decoded['snapshot_uri']
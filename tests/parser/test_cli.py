@@ -0,0 +1,33 @@
+from unittest.mock import Mock
+
+from click.testing import CliRunner
+
+import cortex.parser
+
+
+def test_start_all_supervises_parser_replicas(monkeypatch):
+    supervisor_mock = Mock()
+    supervisor_mock.return_value.workers = []
+    monkeypatch.setattr(cortex.parser.supervisor, 'Supervisor', supervisor_mock)
+    monkeypatch.setattr(cortex.parser.repository.Repository, 'get',
+                        Mock(return_value=Mock(handlers=lambda: [Mock(target='pose'), Mock(target='color_image')])))
+    result = CliRunner().invoke(cortex.parser.cli, ['start-all', '--processes', '-n', 'color_image=3',
+                                                    'rabbitmq://localhost:5672'])
+    assert result.exit_code == 0, result.output
+    added = {i.args[0]: i.kwargs['replicas'] for i in supervisor_mock.return_value.add.call_args_list}
+    assert added == {'parser-pose': 1, 'parser-color_image': 3}
+    supervisor_mock.return_value.run.assert_called_once()
+
+
+def test_start_all_rejects_bad_replicas():
+    result = CliRunner().invoke(cortex.parser.cli, ['start-all', '-n', 'color_image', 'rabbitmq://localhost:5672'])
+    assert result.exit_code != 0
+
+
+def test_run_parser_replicas_compete_under_supervisor(monkeypatch):
+    supervisor_mock = Mock()
+    monkeypatch.setattr(cortex.parser.supervisor, 'Supervisor', supervisor_mock)
+    result = CliRunner().invoke(cortex.parser.cli, ['run-parser', '--replicas', '3', 'color_image',
+                                                    'rabbitmq://localhost:5672'])
+    assert result.exit_code == 0, result.output
+    assert supervisor_mock.return_value.add.call_args.kwargs['replicas'] == 3
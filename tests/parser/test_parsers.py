@@ -46,6 +46,17 @@ def test_with_protobuf_snapshot_unpacks_message_according_to_key():
     f.assert_called_once_with( user_type_mock.return_value, mock_protobuf.return_value, passed_message)
 
 
+def test_with_protobuf_snapshot_decodes_only_declared_fields():
+    from cortex.core import cortex_pb2
+    f = MagicMock()
+    callee = parser_decorators.with_protobuf_snapshot(cortex_pb2.Snapshot, fields=('datetime', 'pose'))(f)
+    snapshot = cortex_pb2.Snapshot(datetime=1, pose=dict(translation=dict(x=1)), color_image=dict(data=b'rgb'))
+    callee({'snapshot': snapshot.SerializeToString(), 'user': '1'})
+    parsed = f.call_args[0][1]
+    assert parsed == cortex_pb2.Snapshot(datetime=1, pose=snapshot.pose)
+    assert callee.fields == ('datetime', 'pose')
+
+
 # @pytest.fixture()
 # def modules():
 #     return feelings_parser, image_parser, pose_parser
@@ -0,0 +1,86 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from cortex import configuration
+from cortex.saver import aggregator, db_dispatcher, write_behind
+from cortex.utils.dispatchers import acknowledgement
+
+
+@pytest.fixture
+def db():
+    return MagicMock()
+
+
+@pytest.fixture
+def agg(db):
+    return aggregator.SnapshotAggregator(db, ['pose', 'feelings'], timeout=60)
+
+
+def test_aggregator_writes_once_all_targets_reported(agg, db):
+    agg.update_snapshot('1', '100', {'pose': 1})
+    db.update_snapshot.assert_not_called()
+    agg.update_snapshot(1, 100, {'feelings': 2})
+    db.update_snapshot.assert_called_once_with(1, 100, {'pose': 1, 'feelings': 2})
+    assert agg.stats['merged'] == 1
+
+
+def test_aggregator_writes_incomplete_snapshots_after_timeout(agg, db):
+    agg.update_snapshot(1, 100, {'pose': 1})
+    assert agg.expire() == 0
+    agg.timeout = 0
+    assert agg.expire() == 1
+    db.update_snapshot.assert_called_once_with(1, 100, {'pose': 1})
+    assert agg.stats['incomplete'] == 1
+    assert agg.merge_latency >= 0
+
+
+def test_aggregator_acks_all_messages_of_a_snapshot_after_the_write(agg):
+    settles = [MagicMock(), MagicMock()]
+    with acknowledgement.handling(settles[0]):
+        agg.update_snapshot(1, 100, {'pose': 1})
+    settles[0].assert_not_called()
+    with acknowledgement.handling(settles[1]):
+        agg.update_snapshot(1, 100, {'feelings': 2})
+    for settle in settles:
+        settle.assert_called_once_with(True)
+
+
+def test_aggregator_leaves_acks_to_a_write_behind_db(db):
+    agg = aggregator.SnapshotAggregator(write_behind.WriteBehindDB(db, batch_size=10, delay=1), ['pose'])
+    settle = MagicMock()
+    with acknowledgement.handling(settle):
+        agg.update_snapshot(1, 100, {'pose': 1})
+    settle.assert_not_called()
+    agg.db.flush()
+    settle.assert_called_once_with(True)
+    db.update_snapshots.assert_called_once_with({(1, 100): {'pose': 1}})
+
+
+def test_aggregator_stop_writes_what_it_holds(agg, db):
+    agg.update_snapshot(1, 100, {'pose': 1})
+    agg.stop()
+    db.update_snapshot.assert_called_once_with(1, 100, {'pose': 1})
+    db.stop.assert_called_once()
+
+
+def test_aggregator_waits_only_for_the_targets_the_snapshot_was_split_for(agg, db):
+    with aggregator.expecting(['pose']):
+        agg.update_snapshot(1, 100, {'pose': 1})
+    db.update_snapshot.assert_called_once_with(1, 100, {'pose': 1})
+    assert agg.stats['merged'] == 1
+
+
+def test_db_dispatcher_tells_the_aggregator_what_to_expect(agg, db):
+    save = db_dispatcher.DBDispatcher(agg).result_publisher(
+        lambda database, data: database.update_snapshot(data['user'], data['timestamp'], data['result']))
+    save({'user': 1, 'timestamp': 100, 'result': {'feelings': 2}, configuration.MESSAGE_TARGETS_KEY: ['feelings']})
+    db.update_snapshot.assert_called_once_with(1, 100, {'feelings': 2})
+
+
+def test_nested_handling_restores_the_outer_delivery():
+    outer, inner = MagicMock(), MagicMock()
+    with acknowledgement.handling(outer):
+        with acknowledgement.handling(inner):
+            pass
+        assert acknowledgement.defer() is outer
@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock
+
+import mongomock
+import pytest
+
+from cortex import configuration
+from cortex.saver import write_behind
+from cortex.utils.databases import mongo_db
+from cortex.utils.dispatchers import acknowledgement
+
+
+@pytest.fixture
+def db():
+    return MagicMock()
+
+
+def test_write_behind_merges_updates_of_a_snapshot(db):
+    wb = write_behind.WriteBehindDB(db, batch_size=10, delay=1)
+    wb.update_snapshot('1', '100', {'pose': 1})
+    wb.update_snapshot(1, 100, {'feelings': 2})
+    wb.update_snapshot(1, 200, {'pose': 3})
+    db.update_snapshots.assert_not_called()
+    assert wb.flush() == 2
+    db.update_snapshots.assert_called_once_with({(1, 100): {'pose': 1, 'feelings': 2}, (1, 200): {'pose': 3}})
+
+
+def test_write_behind_writes_when_batch_is_full(db):
+    wb = write_behind.WriteBehindDB(db, batch_size=2, delay=1)
+    wb.update_snapshot(1, 100, {'pose': 1})
+    wb.update_snapshot(1, 200, {'pose': 1})
+    db.update_snapshots.assert_called_once()
+
+
+def test_write_behind_acks_after_the_write(db):
+    wb = write_behind.WriteBehindDB(db, batch_size=10, delay=1)
+    settle = MagicMock()
+    with acknowledgement.handling(settle) as delivery:
+        wb.update_snapshot(1, 100, {'pose': 1})
+    assert delivery.deferred
+    settle.assert_not_called()
+    wb.flush()
+    settle.assert_called_once_with(True)
+
+
+def test_write_behind_rejects_messages_of_a_failed_write(db):
+    db.update_snapshots.side_effect = RuntimeError
+    wb = write_behind.WriteBehindDB(db, batch_size=10, delay=1)
+    settle = MagicMock()
+    with acknowledgement.handling(settle):
+        wb.update_snapshot(1, 100, {'pose': 1})
+    assert wb.flush() == 0
+    settle.assert_called_once_with(False)
+
+
+def test_write_behind_passes_the_rest_to_the_db(db):
+    write_behind.WriteBehindDB(db).maybe_create_user(1, {})
+    db.maybe_create_user.assert_called_once_with(1, {})
+
+
+def test_mongo_update_snapshots_upserts_in_bulk():
+    db = mongo_db.MongoDB(mongomock.MongoClient())
+    db.update_snapshot(1, 100, {'pose': 1})
+    db.update_snapshots({(1, 100): {'feelings': 2}, (1, 200): {'pose': 3}})
+    assert db.get_snapshot(1, '100') == {'timestamp': 100, 'pose': 1, 'feelings': 2}
+    assert db.get_snapshot(1, '200') == {'timestamp': 200, 'pose': 3}
+
+
+def test_write_behind_batch_is_capped_at_the_prefetch(db):
+    prefetch = configuration.get_config()[configuration.CONFIG_CONSUMER_PREFETCH]
+    assert write_behind.WriteBehindDB(db, batch_size=prefetch * 4).batch_size == prefetch
+
+
+def test_write_behind_batch_defaults_when_not_configured(db):
+    assert configuration.get_config()[configuration.CONFIG_SAVER_BATCH_SIZE] is None
+    prefetch = configuration.get_config()[configuration.CONFIG_CONSUMER_PREFETCH]
+    assert write_behind.WriteBehindDB(db).batch_size == min(write_behind.BATCH_SIZE, prefetch)
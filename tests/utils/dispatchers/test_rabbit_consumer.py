@@ -4,7 +4,7 @@ import pytest
 import pika
 from unittest.mock import MagicMock
 
-from cortex.utils.dispatchers import rabbit_consumer
+from cortex.utils.dispatchers import rabbit_consumer, rabbit_dispatcher, acknowledgement
 
 
 @pytest.fixture()
@@ -174,3 +174,137 @@ def test_consumer_on_message_raises_runtime_error_on_none_decoder(consumer_with_
 
 
 #TODO: test start, stop, _run_consumer
+
+
+def test_consumer_register_handler_consumes_from_work_queue(monkeypatch):
+    monkeypatch.setattr(rabbit_consumer.pika, "BlockingConnection", MagicMock())
+    c = rabbit_consumer.RabbitQueueConsumer(None, None)
+    c.register_handler('topic', lambda x: None, queue='work.topic')
+    channel = c.handlers['topic'].channel
+    assert channel.basic_consume.call_args.kwargs['queue'] == 'work.topic'
+    channel.queue_bind.assert_called_once_with(queue='work.topic', exchange=c.Exchange, routing_key='topic')
+    channel.basic_qos.assert_called_once()
+
+
+def test_consumer_binds_split_snapshot_topics_to_whole_snapshots(monkeypatch):
+    monkeypatch.setattr(rabbit_consumer.pika, "BlockingConnection", MagicMock())
+    c = rabbit_consumer.RabbitQueueConsumer(None, None)
+    topic = rabbit_consumer.configuration.get_raw_data_topic_name('pose')
+    c.register_handler(topic, lambda x: None)
+    bound = [i.kwargs['routing_key'] for i in c.handlers[topic].channel.queue_bind.call_args_list]
+    assert bound == [topic, rabbit_consumer.configuration.topics.snapshot]
+    c.handlers[topic].channel.exchange_declare.assert_called_once_with(c.Exchange, exchange_type='topic')
+
+
+def test_consumer_on_message_acks_after_handling():
+    c = rabbit_consumer.RabbitQueueConsumer.__new__(rabbit_consumer.RabbitQueueConsumer)
+    c._logger = MagicMock()
+    channel, method = MagicMock(), MagicMock(routing_key='topic')
+    c.on_message(channel, method, None, 'body', message_decoder=lambda x: x, cb=MagicMock(), topic='topic',
+                 manual_ack=True)
+    channel.basic_ack.assert_called_once_with(delivery_tag=method.delivery_tag)
+    c.on_message(channel, method, None, 'body', message_decoder=lambda x: x, cb=MagicMock(side_effect=ValueError),
+                 topic='topic', manual_ack=True)
+    channel.basic_nack.assert_called_once_with(delivery_tag=method.delivery_tag, requeue=False)
+
+
+def test_consumer_in_manual_ack_mode_dead_letters(monkeypatch):
+    monkeypatch.setattr(rabbit_consumer.pika, "BlockingConnection", MagicMock())
+    config = dict(rabbit_consumer.configuration.get_config(),
+                  **{rabbit_consumer.configuration.CONFIG_CONSUMER_MANUAL_ACK: True})
+    monkeypatch.setattr(rabbit_consumer.configuration, 'get_config', MagicMock(return_value=config))
+    c = rabbit_consumer.RabbitQueueConsumer(None, None)
+    c.register_handler('topic', lambda x: None)
+    channel = c.handlers['topic'].channel
+    assert channel.basic_consume.call_args.kwargs['auto_ack'] is False
+    assert channel.queue_declare.call_args.kwargs['arguments'] == {
+        'x-dead-letter-exchange': rabbit_consumer.configuration.DEAD_LETTER_EXCHANGE}
+
+
+def test_consumer_explains_queues_declared_without_dead_lettering(monkeypatch):
+    monkeypatch.setattr(rabbit_consumer.pika, "BlockingConnection", MagicMock())
+    config = dict(rabbit_consumer.configuration.get_config(),
+                  **{rabbit_consumer.configuration.CONFIG_CONSUMER_MANUAL_ACK: True})
+    monkeypatch.setattr(rabbit_consumer.configuration, 'get_config', MagicMock(return_value=config))
+    c = rabbit_consumer.RabbitQueueConsumer(None, None)
+    c._logger = MagicMock()
+    channel = c._connection.channel.return_value
+
+    def queue_declare(queue, arguments=None, **kwargs):
+        # the topic's queue was declared before manual acks were turned on
+        if arguments:
+            raise rabbit_consumer.pika.exceptions.ChannelClosedByBroker(
+                rabbit_consumer.PRECONDITION_FAILED, "inequivalent arg 'x-dead-letter-exchange'")
+    channel.queue_declare.side_effect = queue_declare
+    with pytest.raises(RuntimeError, match="delete it"):
+        c.register_handler('topic', lambda x: None)
+    c._logger.error.assert_called_once()
+
+
+def test_consumer_routes_share_a_channel_and_a_thread(monkeypatch):
+    monkeypatch.setattr(rabbit_consumer.pika, "BlockingConnection", MagicMock())
+    c = rabbit_consumer.RabbitQueueConsumer(None, None)
+    c.register_routes('savers', {'first.parsed': lambda x: None, 'second.parsed': lambda x: None})
+    assert list(c.handlers) == ['savers']
+    channel = c.handlers['savers'].channel
+    c._connection.channel.assert_called_once()
+    assert [i.kwargs['queue'] for i in channel.basic_consume.call_args_list] == ['first.parsed', 'second.parsed']
+
+
+def test_consumer_leaves_deferred_acks_to_the_handler():
+    c = rabbit_consumer.RabbitQueueConsumer.__new__(rabbit_consumer.RabbitQueueConsumer)
+    c._logger = MagicMock()
+    c._connection = MagicMock()
+    channel, method = MagicMock(), MagicMock(routing_key='topic')
+    settles = []
+    c.on_message(channel, method, None, 'body', message_decoder=lambda x: x,
+                 cb=lambda x: settles.append(acknowledgement.defer()), topic='topic', manual_ack=True)
+    channel.basic_ack.assert_not_called()
+    settles[0](True)
+    c._connection.add_callback_threadsafe.call_args.args[0]()
+    channel.basic_ack.assert_called_once_with(delivery_tag=method.delivery_tag)
+
+
+@pytest.fixture()
+def manual_ack_consumer():
+    c = rabbit_consumer.RabbitQueueConsumer.__new__(rabbit_consumer.RabbitQueueConsumer)
+    c._logger = MagicMock()
+    c._connection = MagicMock()
+    # the ack is scheduled on the consumer's thread, run it right away
+    c._connection.add_callback_threadsafe.side_effect = lambda f: f()
+    return c
+
+
+@pytest.fixture()
+def confirming_publisher():
+    publisher = rabbit_dispatcher.RabbitQueueDispatcher(None, None, buffer_size=10, confirm=True)
+    publisher._connection = MagicMock()
+    publisher._on_channel_opened(MagicMock())
+    return publisher
+
+
+def test_consumer_acks_only_after_the_result_is_confirmed(manual_ack_consumer, confirming_publisher):
+    channel, method = MagicMock(), MagicMock(routing_key='topic')
+    manual_ack_consumer.on_message(channel, method, None, 'body', message_decoder=lambda x: x,
+                                   cb=lambda x: confirming_publisher.publish('out', x), topic='topic',
+                                   manual_ack=True)
+    confirming_publisher._drain()
+    channel.basic_ack.assert_not_called()
+    nack = MagicMock(method=pika.spec.Basic.Nack(delivery_tag=1))
+    confirming_publisher._on_delivery_confirmation(nack)
+    channel.basic_ack.assert_not_called()
+    channel.basic_nack.assert_not_called()
+    ack = MagicMock(method=pika.spec.Basic.Ack(delivery_tag=2))
+    confirming_publisher._on_delivery_confirmation(ack)
+    channel.basic_ack.assert_called_once_with(delivery_tag=method.delivery_tag)
+
+
+def test_consumer_does_not_ack_when_the_result_is_not_published(manual_ack_consumer, confirming_publisher):
+    confirming_publisher._channel.basic_publish.side_effect = Exception
+    channel, method = MagicMock(), MagicMock(routing_key='topic')
+    manual_ack_consumer.on_message(channel, method, None, 'body', message_decoder=lambda x: x,
+                                   cb=lambda x: confirming_publisher.publish('out', x), topic='topic',
+                                   manual_ack=True)
+    confirming_publisher._drain()
+    channel.basic_ack.assert_not_called()
+    assert confirming_publisher._queue[0][:2] == ('out', 'body')
@@ -154,6 +154,104 @@ def test__create_and_start_conn_starts_con_io_loop(dispatcher, monkeypatch):
     rabbit_dispatcher.pika.SelectConnection.return_value.ioloop.start.assert_called_once()
 
 
+@pytest.fixture()
+def buffered_dispatcher():
+    dispatcher = rabbit_dispatcher.RabbitQueueDispatcher(None, None, buffer_size=3, batch_size=2)
+    dispatcher._connection = MagicMock()
+    dispatcher._channel = MagicMock()
+    return dispatcher
+
+
+def test_buffered_dispatch_leaves_publishing_to_the_ioloop(buffered_dispatcher):
+    buffered_dispatcher.dispatch('topic', 'data1')
+    buffered_dispatcher.dispatch('topic', 'data2')
+    buffered_dispatcher._channel.basic_publish.assert_not_called()
+    buffered_dispatcher._connection.ioloop.add_callback_threadsafe.assert_called_once_with(buffered_dispatcher._drain)
+    assert buffered_dispatcher.backlog == 2 / 3
+
+
+def test_buffered_dispatch_raises_when_full(buffered_dispatcher):
+    for i in range(3):
+        buffered_dispatcher.dispatch('topic', i)
+    with pytest.raises(rabbit_dispatcher.PublisherFull):
+        buffered_dispatcher.dispatch('topic', 3)
+
+
+def test__drain_publishes_a_batch_and_schedules_the_rest(buffered_dispatcher):
+    for i in range(3):
+        buffered_dispatcher.dispatch('topic', i)
+    buffered_dispatcher._drain()
+    assert [i.args[2] for i in buffered_dispatcher._channel.basic_publish.call_args_list] == [0, 1]
+    assert buffered_dispatcher._connection.ioloop.add_callback_threadsafe.call_count == 2
+    buffered_dispatcher._drain()
+    assert [i.args[2] for i in buffered_dispatcher._channel.basic_publish.call_args_list] == [0, 1, 2]
+    assert buffered_dispatcher.backlog == 0
+
+
+def test__drain_keeps_messages_in_order_on_channel_failure(buffered_dispatcher):
+    for i in range(2):
+        buffered_dispatcher.dispatch('topic', i)
+    channel = buffered_dispatcher._channel
+    channel.basic_publish.side_effect = (None, Exception)
+    buffered_dispatcher._drain()
+    assert buffered_dispatcher._queue == [('topic', 1)]
+    buffered_dispatcher._connection.channel.assert_called_once_with(
+        on_open_callback=buffered_dispatcher._on_channel_opened)
+
+
+
+@pytest.fixture()
+def confirming_dispatcher():
+    dispatcher = rabbit_dispatcher.RabbitQueueDispatcher(None, None, buffer_size=10, confirm=True)
+    dispatcher._connection = MagicMock()
+    dispatcher._on_channel_opened(MagicMock())
+    return dispatcher
+
+
+def confirmation(method, delivery_tag, multiple=False):
+    return MagicMock(method=method(delivery_tag=delivery_tag, multiple=multiple))
+
+
+def test_confirms_need_a_buffer():
+    with pytest.raises(ValueError):
+        rabbit_dispatcher.RabbitQueueDispatcher(None, None, confirm=True)
+
+
+def test_confirming_dispatcher_forgets_messages_confirmed_in_batch(confirming_dispatcher):
+    confirming_dispatcher._channel.confirm_delivery.assert_called_once()
+    for i in range(3):
+        confirming_dispatcher.dispatch('topic', i)
+    confirming_dispatcher._drain()
+    assert confirming_dispatcher.unconfirmed == 3
+    confirming_dispatcher._on_delivery_confirmation(confirmation(pika.spec.Basic.Ack, 2, multiple=True))
+    assert confirming_dispatcher.unconfirmed == 1
+    assert confirming_dispatcher.stats['confirmed'] == 2
+    assert confirming_dispatcher.throughput > 0
+
+
+def test_confirming_dispatcher_republishes_nacked_messages(confirming_dispatcher):
+    for i in range(3):
+        confirming_dispatcher.dispatch('topic', i)
+    confirming_dispatcher._drain()
+    confirming_dispatcher._on_delivery_confirmation(confirmation(pika.spec.Basic.Nack, 2))
+    published = [i.args[2] for i in confirming_dispatcher._channel.basic_publish.call_args_list]
+    assert published == [0, 1, 2, 1]
+    assert confirming_dispatcher.stats['nacked'] == 1
+
 
+def test_confirming_dispatcher_republishes_unconfirmed_in_order_on_new_channel(confirming_dispatcher):
+    for i in range(2):
+        confirming_dispatcher.dispatch('topic', i)
+    confirming_dispatcher._drain()
+    confirming_dispatcher._queue.append(('topic', 2))
+    channel = MagicMock()
+    confirming_dispatcher._on_channel_opened(channel)
+    assert [i.args[2] for i in channel.basic_publish.call_args_list] == [0, 1, 2]
+    assert confirming_dispatcher.stats['republished'] == 2
+    assert list(confirming_dispatcher._unconfirmed) == [1, 2, 3]
 
 
+def test_get_dispatcher_is_unbuffered_by_default(monkeypatch):
+    monkeypatch.setattr(rabbit_dispatcher.pika, "SelectConnection", MagicMock())
+    disp = rabbit_dispatcher.get_dispatcher('rabbitmq://testdomainname:1234/', [], auto_start=False)
+    assert disp._buffer is None
@@ -0,0 +1,32 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from cortex.utils.dispatchers import topic_router
+
+
+@pytest.fixture
+def router():
+    return topic_router.TopicRouter('test', MagicMock())
+
+
+def test_router_registers_all_routes_at_once(router):
+    first, second = MagicMock(), MagicMock()
+    router.route('first', first)
+    router.route('second', second)
+    router.start(message_decoder=str)
+    router._consumer.register_routes.assert_called_once_with('test', {'first': first, 'second': second},
+                                                             message_decoder=str)
+    router._consumer.start.assert_called_once()
+
+
+def test_router_needs_routes(router):
+    with pytest.raises(RuntimeError):
+        router.start()
+
+
+def test_router_does_not_route_once_started(router):
+    router.route('first', MagicMock())
+    router.start()
+    with pytest.raises(RuntimeError):
+        router.route('second', MagicMock())
@@ -0,0 +1,44 @@
+import pytest
+
+from cortex.utils import compression
+
+
+@pytest.mark.parametrize('name', compression.available())
+def test_round_trip(name):
+    data = b'cortex' * 1000
+    assert compression.decompress(name, compression.compress(name, data)) == data
+
+
+def test_negotiate_picks_best_common_codec():
+    assert compression.negotiate(['gzip', 'unknown']) == 'gzip'
+    assert compression.negotiate(['unknown']) is None
+    assert compression.negotiate(compression.available()) == compression.available()[0]
+
+
+def test_unknown_codec_raises():
+    with pytest.raises(compression.UnsupportedEncoding):
+        compression.decompress('unknown', b'')
+
+
+@pytest.mark.parametrize('name', compression.available())
+def test_decompression_stops_at_max_size(name):
+    bomb = compression.compress(name, bytes(10 * 1024 * 1024))
+    assert len(bomb) < 1024 * 1024
+    with pytest.raises(compression.TooLarge):
+        compression.decompress(name, bomb, max_size=1024 * 1024)
+    assert len(compression.decompress(name, bomb, max_size=10 * 1024 * 1024)) == 10 * 1024 * 1024
+
+
+@pytest.mark.parametrize('name', compression.available())
+def test_truncated_data_raises(name):
+    data = compression.compress(name, bytes(range(256)) * 1000)
+    for cut in (1, len(data) // 2, len(data) - 1):
+        with pytest.raises(compression.Truncated):
+            compression.decompress(name, data[:cut])
+
+
+@pytest.mark.parametrize('name', compression.available())
+def test_every_member_is_decompressed(name):
+    data = compression.compress(name, b'abc') + compression.compress(name, b'def')
+    assert compression.decompress(name, data) == b'abcdef'
+    assert compression.decompress(name, data, max_size=6) == b'abcdef'
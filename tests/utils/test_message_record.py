@@ -0,0 +1,124 @@
+from unittest.mock import Mock
+
+import pytest
+
+from cortex import configuration
+from cortex.core import snapshot_xcoder
+from cortex.utils.filesystem import MessageRecord, segment_log
+from cortex.utils.filesystem.segment_log import SegmentLog
+
+
+@pytest.fixture(autouse=True)
+def repo(tmp_path, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_RAW_MESSAGE_REPO: str(tmp_path),
+                                                 configuration.CONFIG_RAW_MESSAGE_INLINE_THRESHOLD: 0})
+    monkeypatch.setattr(configuration, 'get_config', Mock(return_value=config))
+    return tmp_path
+
+
+def test_record_is_stored_by_content(repo):
+    with MessageRecord.create() as mr:
+        mr.write(b'some ')
+        mr.write(b'snapshot')
+    assert mr.path == MessageRecord.path_for(mr.digest)
+    assert mr.path.relative_to(repo).parts[:2] == (mr.digest[:2], mr.digest[2:4])
+    assert mr.path.read_bytes() == b'some snapshot'
+    assert not list((repo / MessageRecord.TMP_DIR).iterdir())
+
+
+def test_same_content_is_stored_once(repo):
+    uris = []
+    for _ in range(2):
+        with MessageRecord.create() as mr:
+            mr.write(b'snapshot')
+        uris.append(mr.uri())
+    assert uris[0] == uris[1]
+    assert len(list(repo.glob('??/??/*'))) == 1
+
+
+def test_record_reaped_while_stored_is_written_again(repo, monkeypatch):
+    with MessageRecord.create() as mr:
+        mr.write(b'snapshot')
+    def reaped(path):
+        # the reaper takes the record between the reference and the touch
+        path.unlink()
+        raise FileNotFoundError(path)
+    utime = Mock(side_effect=reaped)
+    monkeypatch.setattr('os.utime', utime)
+    with MessageRecord.create() as mr:
+        mr.write(b'snapshot')
+    utime.assert_called_once()
+    assert mr.path.read_bytes() == b'snapshot'
+
+
+def test_xcoder_round_trip():
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    decoded = snapshot_xcoder.snapshot_decoder(message)
+    assert (decoded['user'], decoded['snapshot']) == ('1', b'snapshot')
+
+
+@pytest.fixture
+def segments(repo, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_RAW_MESSAGE_BACKEND: 'segments',
+                                                 configuration.CONFIG_SEGMENT_SIZE: 10,
+                                                 configuration.CONFIG_SEGMENT_RETENTION: 0})
+    monkeypatch.setattr(configuration, 'get_config', Mock(return_value=config))
+    log = SegmentLog.get()
+    yield log
+    log.seal()
+
+
+def test_segment_records_round_trip(segments):
+    uris = []
+    for data in (b'first', b'second', b'third'):
+        with MessageRecord.create() as mr:
+            mr.write(data)
+        uris.append(mr.uri())
+    assert all(segment_log.is_segment_uri(i) for i in uris)
+    # the first two fill a segment, the third starts a new one
+    assert len({segment_log.parse_uri(i)[0] for i in uris}) == 2
+    assert [MessageRecord.open(i).read() for i in uris] == [b'first', b'second', b'third']
+
+
+def test_segments_are_compacted_once_consumed(segments):
+    uris = [snapshot_xcoder.snapshot_encoder(data, user='1') for data in (b'first', b'second')]
+    segments.seal()
+    for i in uris:
+        snapshot_xcoder.snapshot_acknowledger('pose', snapshot_xcoder.snapshot_decoder(i))
+    assert segments.compact(['pose', 'feelings']) == 0
+    for i in uris:
+        snapshot_xcoder.snapshot_acknowledger('feelings', snapshot_xcoder.snapshot_decoder(i))
+    assert segments.compact(['pose', 'feelings']) == len(b'firstsecond')
+    assert not list(segments.directory.iterdir())
+
+
+def test_segment_acks_count_each_message_once(segments):
+    uris = [segments.append(data) for data in (b'first', b'second')]
+    segments.acknowledge(uris[0], 'pose')
+    segments.acknowledge(uris[0], 'pose')
+    assert segments.compact(['pose']) == 0
+    segments.acknowledge(uris[1], 'pose')
+    assert segments.compact(['pose']) == len(b'firstsecond')
+
+
+def test_segments_of_dead_writers_are_sealed(segments, monkeypatch):
+    uri = segments.append(b'one')
+    segment_id = segment_log.parse_uri(uri)[0]
+    # forget the segment, like a writer that crashed would
+    segments._active = None
+    assert segments.seal_stale() == []
+    monkeypatch.setattr(SegmentLog, '_writer_is_dead', staticmethod(lambda x: True))
+    assert segments.seal_stale() == [segment_id]
+    segments.acknowledge(uri, 'pose')
+    assert segments.compact(['pose']) == len(b'one')
+
+
+def test_segment_reads_share_a_bounded_set_of_maps(segments):
+    segments.map_cache = 1
+    uris = [segments.append(data) for data in (b'first', b'second', b'third')]
+    first = segments.read(uris[0])
+    assert isinstance(first, memoryview) and first == b'first'
+    assert segments.read(uris[2]) == b'third'
+    assert len(segments._maps) == 1
+    # the evicted map stays alive for the view that is still out
+    assert first == b'first'
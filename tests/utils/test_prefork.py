@@ -0,0 +1,23 @@
+from unittest.mock import Mock
+
+from cortex import configuration
+from cortex.utils import prefork
+
+
+def test_options_fall_back_to_configuration():
+    options = prefork.get_options(workers=3)
+    config = configuration.get_config()
+    assert options['workers'] == 3
+    assert options['backlog'] == config[configuration.CONFIG_PREFORK_BACKLOG]
+    assert options['timeout'] == config[configuration.CONFIG_PREFORK_TIMEOUT]
+
+
+def test_app_is_built_in_the_worker():
+    factory = Mock()
+    server = prefork.PreforkServer(factory, '127.0.0.1', 1234, workers=3, timeout=7)
+    factory.assert_not_called()
+    assert server.cfg.workers == 3
+    assert server.cfg.timeout == 7
+    assert server.cfg.address == [('127.0.0.1', 1234)]
+    assert not server.cfg.preload_app
+    assert server.load() is factory.return_value
@@ -0,0 +1,32 @@
+import pytest
+
+from cortex.core import cortex_pb2
+from cortex.utils import protobuf_wire
+
+
+def test_read_varint():
+    assert protobuf_wire.read_varint(b'\x96\x01') == (150, 2)
+    with pytest.raises(protobuf_wire.WireFormatError):
+        protobuf_wire.read_varint(b'\x96')
+
+
+def test_iter_fields_slices_whole_fields():
+    snapshot = cortex_pb2.Snapshot(datetime=12345, color_image=dict(data=b'abc'), feelings=dict(hunger=1))
+    data = snapshot.SerializeToString()
+    fields = list(protobuf_wire.iter_fields(data))
+    assert [i[0] for i in fields] == [1, 3, 5]
+    rebuilt = cortex_pb2.Snapshot()
+    rebuilt.ParseFromString(b''.join(data[start:end] for _, _, start, _, end in fields))
+    assert rebuilt == snapshot
+
+
+def test_find_varint():
+    data = cortex_pb2.Snapshot(datetime=12345, feelings=dict(hunger=1)).SerializeToString()
+    assert protobuf_wire.find_varint(data, 1) == 12345
+    assert protobuf_wire.find_varint(cortex_pb2.Snapshot().SerializeToString(), 1, default=None) is None
+
+
+def test_select_fields():
+    data = cortex_pb2.Snapshot(datetime=12345, color_image=dict(data=b'abc'), feelings=dict(hunger=1)).SerializeToString()
+    selected = cortex_pb2.Snapshot.FromString(protobuf_wire.select_fields(data, {1, 5}))
+    assert selected == cortex_pb2.Snapshot(datetime=12345, feelings=dict(hunger=1))
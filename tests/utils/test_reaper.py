@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from cortex import configuration
+from cortex.core import snapshot_xcoder
+from cortex.utils.filesystem import MessageRecord
+from cortex.utils.filesystem.reaper import RecordReaper
+
+
+@pytest.fixture(autouse=True)
+def repo(tmp_path, monkeypatch):
+    config = dict(configuration.get_config(), **{configuration.CONFIG_RAW_MESSAGE_REPO: str(tmp_path),
+                                                 configuration.CONFIG_RAW_MESSAGE_INLINE_THRESHOLD: 0})
+    monkeypatch.setattr(configuration, 'get_config', Mock(return_value=config))
+    return tmp_path
+
+
+def consume(message, *consumers):
+    for consumer in consumers:
+        snapshot_xcoder.snapshot_acknowledger(consumer, snapshot_xcoder.snapshot_decoder(message))
+
+
+def test_record_is_reaped_once_every_consumer_acknowledged():
+    reaper = RecordReaper(lambda: ['pose', 'feelings'], retention=0)
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    assert reaper.reap() == 0
+    consume(message, 'feelings')
+    assert reaper.reap() == len(b'snapshot')
+    assert snapshot_xcoder.snapshot_decoder(message) is None
+    assert reaper.stats['bytes_reclaimed'] == len(b'snapshot')
+
+
+def test_deduplicated_record_waits_for_every_reference():
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    assert RecordReaper(lambda: ['pose'], retention=0).reap() == 0
+    consume(message, 'pose')
+    # a new reaper picks up where the last one left off
+    assert RecordReaper(lambda: ['pose'], retention=0).reap() == len(b'snapshot')
+
+
+def test_retention_keeps_consumed_records():
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    assert RecordReaper(lambda: ['pose'], retention=3600).reap() == 0
+    assert snapshot_xcoder.snapshot_decoder(message)['snapshot'] == b'snapshot'
+
+
+def test_reapers_share_state():
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    first, second = RecordReaper(lambda: ['pose'], retention=0), RecordReaper(lambda: ['pose'], retention=0)
+    assert first.reap() == 0
+    # the second instance picks up the reference the first one counted
+    consume(message, 'pose')
+    assert second.reap() == len(b'snapshot')
+    assert first.reap() == 0
+
+
+def test_reaper_waits_for_registered_consumers():
+    from cortex.server import server
+    MessageRecord.register_consumer('pose')
+    MessageRecord.register_consumer('feelings')
+    assert server.deployed_consumers() == ['feelings', 'pose']
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    reaper = RecordReaper(server.deployed_consumers, retention=0)
+    assert reaper.reap() == 0
+    MessageRecord.forget_consumer('feelings')
+    assert reaper.reap() == len(b'snapshot')
+
+
+def test_record_referenced_while_reaping_is_kept(monkeypatch):
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    reaper = RecordReaper(lambda: ['pose'], retention=0)
+    take_journals = reaper._take_journals
+
+    def take_then_store():
+        taken = take_journals()
+        snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+        return taken
+    monkeypatch.setattr(reaper, '_take_journals', take_then_store)
+    assert reaper.reap() == 0
+    assert snapshot_xcoder.snapshot_decoder(message)['snapshot'] == b'snapshot'
+
+
+def test_record_referenced_after_it_was_moved_aside_is_restored(monkeypatch):
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose')
+    reaper = RecordReaper(lambda: ['pose'], retention=0)
+    # a store reuses the record after the reaper looked at the journal, before it deletes the record
+    digest = Path(json.loads(message)['snapshot']).name
+    monkeypatch.setattr(reaper, '_fresh_references', Mock(side_effect=[set(), {digest}]))
+    assert reaper.reap() == 0
+    assert snapshot_xcoder.snapshot_decoder(message)['snapshot'] == b'snapshot'
+
+
+def test_consumer_names_may_have_dots():
+    message = snapshot_xcoder.snapshot_encoder(b'snapshot', user='1')
+    consume(message, 'pose.v2')
+    assert RecordReaper(lambda: ['pose.v2'], retention=0).reap() == len(b'snapshot')
@@ -0,0 +1,46 @@
+import time
+
+from cortex.utils import supervisor
+
+
+def exit_right_away():
+    pass
+
+
+def sleep_a_while():
+    time.sleep(30)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+
+def test_supervisor_runs_replicas_and_restarts_exited_workers():
+    sup = supervisor.Supervisor(min_uptime=0)
+    sleeping = sup.add('sleeper', sleep_a_while, replicas=2)
+    exiting, = sup.add('exiter', exit_right_away)
+    assert [i.name for i in sleeping] == ['sleeper-0', 'sleeper-1']
+    sup.start()
+    try:
+        assert wait_for(lambda: not exiting.alive)
+        assert sup.poll() == [exiting]
+        assert exiting.restarts == 1
+        assert all(i.alive for i in sleeping)
+    finally:
+        sup.stop(timeout=1)
+    assert not any(i.alive for i in sup.workers)
+
+
+def test_supervisor_backs_off_from_crashing_workers():
+    sup = supervisor.Supervisor(min_uptime=60)
+    worker, = sup.add('exiter', exit_right_away)
+    sup.start()
+    try:
+        assert wait_for(lambda: not worker.alive)
+        assert sup.poll() == []
+        assert worker.backoff == 1
+    finally:
+        sup.stop(timeout=1)